@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+# Compares the list-returning and the streaming certificate queries of
+# dbaccess on a synthetic database, reporting latency and peak memory.
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from mini_py_ca import dbaccess
+from mini_py_ca import utils
+
+
+def populate_database(conn, row_count, revoked_ratio):
+    now = utils.to_timestamp_milis(utils.utc_now())
+    day = 24 * 60 * 60 * 1000
+
+    rows = []
+    for i in range(row_count):
+        rows.append((
+            now,
+            now - day,
+            now + 365 * day,
+            utils.format_serial(random.getrandbits(159)),
+            "CN=Benchmark certificate {0},O=Acme".format(i),
+            0
+        ))
+
+    conn.executemany("""INSERT INTO issued_certificate (
+    date_created,
+    not_before_date,
+    not_after_date,
+    serial,
+    subject,
+    is_self_signed
+) VALUES(?, ?, ?, ?, ?, ?);""",
+        rows
+    )
+
+    revoked_count = int(row_count * revoked_ratio)
+    conn.executemany("""INSERT INTO revoked_certificate (
+    issued_certificate_id,
+    revocation_date,
+    reason
+) VALUES(?, ?, 'unspecified');""",
+        [ (certificate_id, now) for certificate_id in range(1, revoked_count + 1) ]
+    )
+
+    conn.commit()
+
+def consume_all(certificates):
+    count = 0
+    for cert in certificates:
+        cert.serial
+        cert.not_after_date
+        count = count + 1
+
+    return count
+
+def measure(name, fn):
+    tracemalloc.start()
+    start_time = time.perf_counter()
+
+    count = fn()
+
+    elapsed = time.perf_counter() - start_time
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print("{0:38} {1:>10d} rows {2:>9.3f}s {3:>10.1f} MiB peak".format(
+        name,
+        count,
+        elapsed,
+        peak / (1024 * 1024)
+    ))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rows",
+        type = int,
+        default = 100000,
+        help = "Number of synthetic certificates"
+    )
+
+    parser.add_argument(
+        "--revoked-ratio",
+        type = float,
+        default = 0.1,
+        help = "Fraction of the certificates that are revoked"
+    )
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as ca_dir:
+        os.chdir(ca_dir)
+
+        conn = dbaccess.get_connection()
+        populate_database(conn, args.rows, args.revoked_ratio)
+
+        utc_now = utils.utc_now()
+
+        measure("get_active_certificates", lambda: consume_all(dbaccess.get_active_certificates()))
+        measure("iter_active_certificates", lambda: consume_all(dbaccess.iter_active_certificates()))
+        measure("iter_active_certificates page", lambda: consume_all(dbaccess.iter_active_certificates(
+            after_id = args.rows // 2,
+            limit = 1000
+        )))
+        measure("iter_active_certificates revoked page", lambda: consume_all(dbaccess.iter_active_certificates(
+            revoked = True,
+            limit = 1000
+        )))
+        measure("iter_crl_entries", lambda: len([ entry for entry in dbaccess.iter_crl_entries(utc_now) ]))
+
+        conn.close()
+        dbaccess.database_connection = None
+
+
+if __name__ == "__main__":
+    main()
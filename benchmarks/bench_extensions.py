@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+# Measures the per-certificate cost of adding the extensions of a sign_request
+# section, building them from the configuration every time as
+# x509ext.add_extensions does, against reusing an x509ext.ExtensionTemplate.
+
+import argparse
+import datetime
+import time
+
+from ruamel.yaml import YAML
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from mini_py_ca import config
+from mini_py_ca import x509ext
+
+
+def make_request():
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+    builder = x509.CertificateSigningRequestBuilder()
+    builder = builder.subject_name(x509.Name([ x509.NameAttribute(NameOID.COMMON_NAME, "bench.acme.corp") ]))
+    builder = builder.add_extension(x509.SubjectAlternativeName([ x509.DNSName("bench.acme.corp") ]), critical = False)
+    builder = builder.add_extension(x509.BasicConstraints(ca = False, path_length = None), critical = False)
+
+    return (key, builder.sign(key, hashes.SHA256(), default_backend()))
+
+def make_builder(request, serial):
+    builder = x509.CertificateBuilder()
+    builder = builder.not_valid_before(datetime.datetime(2020, 1, 1))
+    builder = builder.not_valid_after(datetime.datetime(2030, 1, 1))
+    builder = builder.serial_number(serial)
+    builder = builder.subject_name(request.subject)
+    builder = builder.issuer_name(request.subject)
+
+    return builder.public_key(request.public_key())
+
+def measure(name, iterations, fn):
+    start_time = time.perf_counter()
+
+    for i in range(iterations):
+        fn(i + 1)
+
+    elapsed = time.perf_counter() - start_time
+
+    print("{0:28} {1:>8d} certificates {2:>9.3f}s {3:>10.2f} us/certificate".format(
+        name,
+        iterations,
+        elapsed,
+        elapsed * 1000000 / iterations
+    ))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--config",
+        default = "example_config.yml",
+        help = "Configuration file holding the section"
+    )
+
+    parser.add_argument(
+        "--section",
+        default = "authority",
+        help = "Name of the sign_request section"
+    )
+
+    parser.add_argument(
+        "--iterations",
+        type = int,
+        default = 10000,
+        help = "Number of certificates whose extensions are built"
+    )
+
+    args = parser.parse_args()
+
+    with open(args.config, "rb") as file:
+        section = config.parse_section(YAML(typ = "safe").load(file)[args.section], args.section)
+
+    key, request = make_request()
+    ext_ctx = x509ext.ExtensionContext(authority_key = key.public_key(), subject_key = key.public_key())
+    template = x509ext.ExtensionTemplate(ext_ctx, section.extensions)
+
+    built = x509ext.add_extensions(make_builder(request, 1), ext_ctx, section.extensions, request.extensions)
+    templated = template.add_extensions(make_builder(request, 1), ext_ctx, request.extensions)
+    if built.sign(key, hashes.SHA256(), default_backend()).tbs_certificate_bytes != \
+        templated.sign(key, hashes.SHA256(), default_backend()).tbs_certificate_bytes:
+        raise Exception("The template does not produce the same extensions.")
+
+    measure("add_extensions", args.iterations, lambda i: x509ext.add_extensions(
+        make_builder(request, i),
+        ext_ctx,
+        section.extensions,
+        request.extensions
+    ))
+
+    measure("ExtensionTemplate", args.iterations, lambda i: template.add_extensions(
+        make_builder(request, i),
+        ext_ctx,
+        request.extensions
+    ))
+
+    measure("builder without extensions", args.iterations, lambda i: make_builder(request, i))
+
+
+if __name__ == "__main__":
+    main()
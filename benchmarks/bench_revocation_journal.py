@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Measures writing the revocation journal of a synthetic database, verifying
+# the table against it, and replaying it into an emptied table.
+
+import argparse
+import os
+import tempfile
+import time
+
+from mini_py_ca import dbaccess
+from mini_py_ca.commands import revocation_journal
+
+from bench_certificate_query import populate_database
+
+
+def measure(name, count, fn):
+    start_time = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start_time
+
+    print("{0:28} {1:>10d} records {2:>9.3f}s {3:>12.0f} records/min".format(
+        name,
+        count,
+        elapsed,
+        count / elapsed * 60 if elapsed > 0 else 0.0
+    ))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--revocations",
+        type = int,
+        default = 1000000,
+        help = "Number of synthetic revoked certificates"
+    )
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as ca_dir:
+        os.chdir(ca_dir)
+
+        conn = dbaccess.get_connection()
+        populate_database(conn, args.revocations, 1.0)
+
+        journal = dbaccess.get_revocation_journal()
+
+        measure("init", args.revocations, dbaccess.init_revocation_journal)
+        measure("verify", args.revocations, lambda: revocation_journal.compare_journal(journal, conn))
+
+        conn.execute("DELETE FROM revoked_certificate;")
+        conn.commit()
+
+        def replay():
+            comparison = revocation_journal.compare_journal(journal, conn)
+            dbaccess.replay_revocations(comparison.pending)
+
+        measure("replay", args.revocations, replay)
+
+        conn.close()
+        dbaccess.database_connection = None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# Compares per-serial allocation costs on a synthetic database: the former
+# lookup per candidate serial (which claimed nothing until the certificate
+# was stored) against reservations of whole batches.
+
+import argparse
+import os
+import tempfile
+import time
+
+from cryptography import x509
+
+from mini_py_ca import dbaccess
+
+from bench_certificate_query import populate_database
+
+
+def lookup_serials(count):
+    conn = dbaccess.get_connection()
+
+    serials = []
+    while len(serials) < count:
+        serial = x509.random_serial_number()
+
+        if not dbaccess.serial_exists(conn, serial):
+            serials.append(serial)
+
+    return serials
+
+def measure(name, batch_size, total_count, fn):
+    start_time = time.perf_counter()
+
+    allocated_count = 0
+    while allocated_count < total_count:
+        allocated_count = allocated_count + len(fn(batch_size))
+
+    elapsed = time.perf_counter() - start_time
+
+    print("{0:8} batch {1:>6d} {2:>8d} serials {3:>9.3f}s {4:>10.2f} us/serial".format(
+        name,
+        batch_size,
+        allocated_count,
+        elapsed,
+        elapsed * 1000000 / allocated_count
+    ))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rows",
+        type = int,
+        default = 100000,
+        help = "Number of synthetic issued certificates"
+    )
+
+    parser.add_argument(
+        "--serials",
+        type = int,
+        default = 10000,
+        help = "Number of serials allocated for each batch size"
+    )
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as ca_dir:
+        os.chdir(ca_dir)
+
+        conn = dbaccess.get_connection()
+        populate_database(conn, args.rows, 0.0)
+
+        for batch_size in [ 1, 100, 10000 ]:
+            measure("lookup", batch_size, args.serials, lookup_serials)
+            measure("reserve", batch_size, args.serials, dbaccess.reserve_certificate_serials)
+
+            dbaccess.release_certificate_serials([
+                int(row[0], 16) for row in conn.execute("SELECT serial FROM serial_reservation;").fetchall()
+            ])
+
+        conn.close()
+        dbaccess.database_connection = None
+
+
+if __name__ == "__main__":
+    main()
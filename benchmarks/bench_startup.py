@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+# Measures the import cost of every subcommand, as reported by
+# 'python -X importtime', and whether it pulls in cryptography or ruamel.yaml.
+
+import argparse
+import subprocess
+import sys
+
+from mini_py_ca.commands import mca
+
+
+def measure_import(module_name):
+    result = subprocess.run(
+        [ sys.executable, "-X", "importtime", "-c", "import " + module_name ],
+        stderr = subprocess.PIPE,
+        check = True
+    )
+
+    total = 0
+    loaded = set()
+    for line in result.stderr.decode("utf-8").splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+
+        # The cumulative time of the module includes everything it imports.
+        if name == module_name:
+            total = int(cumulative_us)
+
+        loaded.add(name.split(".")[0])
+
+    return (total, "cryptography" in loaded, "ruamel" in loaded)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--repeat",
+        type = int,
+        default = 5,
+        help = "Number of imports per subcommand, the fastest being kept"
+    )
+
+    args = parser.parse_args()
+
+    print("{0:<16} {1:>12} {2:>14} {3:>8}".format("subcommand", "import (ms)", "cryptography", "ruamel"))
+
+    for name, module in mca.subcommand_modules.items():
+        measures = [ measure_import("mini_py_ca.commands." + module) for i in range(args.repeat) ]
+        best = min(measures)
+
+        print("{0:<16} {1:>12.1f} {2:>14} {3:>8}".format(
+            name,
+            best[0] / 1000,
+            "yes" if best[1] else "no",
+            "yes" if best[2] else "no"
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+
+# Times the main paths of the CA (issuance, serial generation, revocation, CRL
+# generation, inventory queries and the startup of every subcommand) against
+# synthetic CA directories, writing the results as JSON. Two result files are
+# compared with a relative threshold, failing on regressions:
+#
+#     PYTHONPATH=. python benchmarks/bench_suite.py run --output before.json
+#     PYTHONPATH=. python benchmarks/bench_suite.py run --output after.json --baseline before.json
+#     PYTHONPATH=. python benchmarks/bench_suite.py compare before.json after.json
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import cryptography
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from mini_py_ca import authority
+from mini_py_ca import config
+from mini_py_ca import common
+from mini_py_ca import crlenc
+from mini_py_ca import dbaccess
+from mini_py_ca import utils
+from mini_py_ca.commands import active_certificates
+from mini_py_ca.commands import gen_crl
+from mini_py_ca.commands import mca
+from mini_py_ca.commands import metrics
+from mini_py_ca.commands import sign_csr
+
+
+results_version = 1
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run_command(ca_dir, module, *args):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = package_dir
+
+    subprocess.run(
+        [ sys.executable, "-W", "ignore", "-m", "mini_py_ca.commands." + module ] + list(args),
+        cwd = ca_dir,
+        env = env,
+        stdout = subprocess.DEVNULL,
+        check = True
+    )
+
+def create_authority(ca_dir):
+    os.makedirs(os.path.join(ca_dir, ".minipyca"))
+    shutil.copyfile(os.path.join(package_dir, "example_config.yml"), os.path.join(ca_dir, ".minipyca", "config.yml"))
+
+    run_command(ca_dir, "gen_key", "--size", "2048", "--algorithm", "rsa")
+    run_command(ca_dir, "gen_ca_cert")
+
+def populate_certificates(conn, count, revoked_ratio, rng):
+    # Rows only, without DER, the revocations spread over the certificates
+    # and carrying their CRL entries as revocations made by mca-revoke-cert.
+    now = utils.utc_now()
+    now_ms = utils.to_timestamp_milis(now)
+    day = 24 * 60 * 60 * 1000
+
+    first_id = conn.execute("SELECT COALESCE(MAX(issued_certificate_id), 0) + 1 FROM issued_certificate;").fetchone()[0]
+
+    rows = []
+    serials = []
+    for i in range(count):
+        serial = rng.getrandbits(159)
+        serials.append(serial)
+
+        rows.append((
+            first_id + i,
+            now_ms,
+            now_ms - day,
+            now_ms + rng.randint(1, 730) * day,
+            utils.format_serial(serial),
+            "CN=Benchmark certificate {0},O=Acme".format(i),
+            0
+        ))
+
+    conn.executemany("""INSERT INTO issued_certificate (
+    issued_certificate_id,
+    date_created,
+    not_before_date,
+    not_after_date,
+    serial,
+    subject,
+    is_self_signed
+) VALUES(?, ?, ?, ?, ?, ?, ?);""",
+        rows
+    )
+
+    revoked_indexes = rng.sample(range(count), int(count * revoked_ratio))
+    revoked_indexes.sort()
+
+    conn.executemany("""INSERT INTO revoked_certificate (
+    revoked_certificate_id,
+    issued_certificate_id,
+    revocation_date,
+    reason
+) VALUES(?, ?, ?, 'unspecified');""",
+        [ (position + 1, first_id + index, now_ms) for position, index in enumerate(revoked_indexes) ]
+    )
+
+    conn.executemany(
+        "INSERT INTO revoked_certificate_entry (revoked_certificate_id, der) VALUES(?, ?);",
+        [ (position + 1, crlenc.encode_revoked_entry(serials[index], now, "unspecified")) for position, index in enumerate(revoked_indexes) ]
+    )
+
+    conn.commit()
+
+    return first_id
+
+def make_request(index):
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+    builder = x509.CertificateSigningRequestBuilder()
+    builder = builder.subject_name(x509.Name([ x509.NameAttribute(NameOID.COMMON_NAME, "bench-{0}.acme.corp".format(index)) ]))
+    builder = builder.add_extension(x509.SubjectAlternativeName([ x509.DNSName("bench-{0}.acme.corp".format(index)) ]), critical = False)
+
+    return builder.sign(key, hashes.SHA256(), default_backend())
+
+class Recorder:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = dict()
+
+    def measure(self, name, count, fn, setup = None):
+        # Keeps the fastest of the runs, setup not being timed.
+        runs = []
+        for i in range(self.repeat):
+            state = None if setup is None else setup()
+
+            start_time = time.perf_counter()
+            fn(state)
+            runs.append(time.perf_counter() - start_time)
+
+        best = min(runs)
+        self.results[name] = {
+            "seconds": best,
+            "count": count,
+            "per_item_us": best / count * 1e6 if count > 0 else None,
+            "runs": runs,
+        }
+
+        print("{0:44} {1:>9d} items {2:>10.4f}s {3:>12.1f} us/item".format(
+            name,
+            count,
+            best,
+            best / count * 1e6 if count > 0 else 0.0
+        ))
+
+def consume(iterable):
+    count = 0
+    for item in iterable:
+        count = count + 1
+
+    return count
+
+def bench_dataset(recorder, base_dir, size, revoked_ratio, sign_count, revoke_count, rng):
+    ca_dir = os.path.join(os.path.dirname(base_dir), "ca-{0}".format(size))
+    shutil.copytree(base_dir, ca_dir, symlinks = True)
+    os.chdir(ca_dir)
+
+    dbaccess.database_connection = None
+    authority.current_context = None
+
+    conn = dbaccess.get_connection()
+    first_id = populate_certificates(conn, size, revoked_ratio, rng)
+    dbaccess.init_revocation_journal()
+
+    prefix = "{0}.".format(size)
+
+    # Serial generation.
+    recorder.measure(prefix + "serials.single", 100, lambda state: [ dbaccess.generate_certificate_serial() for i in range(100) ])
+    recorder.measure(prefix + "serials.batch", 1000, lambda state: dbaccess.generate_certificate_serials(1000))
+    conn.execute("DELETE FROM serial_reservation;")
+    conn.commit()
+
+    # Issuance, single certificates as mca-sign-csr signs them, then a batch.
+    section = config.get_section_for_context("sign_request", None)
+    crl_partitions = config.get_crl_partitions()
+    authority_context = authority.get_authority_context()
+    private_key = common.load_private_key()
+
+    not_before = utils.floor_time_minute(utils.utc_now())
+    not_after = not_before + section.duration
+
+    requests = [ make_request(i) for i in range(8) ]
+
+    def sign_single(state):
+        for i in range(sign_count):
+            certificate = sign_csr.build_certificate(
+                requests[i % len(requests)],
+                section,
+                authority_context,
+                private_key,
+                dbaccess.generate_certificate_serial(),
+                not_before,
+                not_after,
+                crl_partitions
+            )
+
+            dbaccess.add_certificate_to_db(certificate, is_self_signed = False, crl_partitions = crl_partitions)
+
+    recorder.measure(prefix + "sign.single", sign_count, sign_single)
+
+    csr_dir = os.path.join(ca_dir, "csr")
+    os.mkdir(csr_dir)
+    csr_paths = []
+    for i in range(sign_count):
+        csr_path = os.path.join(csr_dir, "{0}.csr".format(i))
+        utils.write_all_bytes(csr_path, requests[i % len(requests)].public_bytes(serialization.Encoding.PEM))
+        csr_paths.append(csr_path)
+
+    def sign_batch(state):
+        results = sign_csr.sign_batch(csr_paths, section, crl_partitions, authority_context, private_key, not_before, not_after, 1)
+        sign_csr.store_batch([ result.certificate for result in results ], crl_partitions, write_files = False)
+
+    recorder.measure(prefix + "sign.batch", sign_count, sign_batch)
+
+    # Revocation, targets being taken among the not yet revoked synthetic
+    # certificates.
+    def pick_targets(count):
+        return [ record.id for record in dbaccess.iter_active_certificates(
+            revoked = False,
+            self_signed = False,
+            after_id = rng.randint(first_id, first_id + size // 2),
+            limit = count
+        ) ]
+
+    def revoke_single(targets):
+        for certificate_id in targets:
+            record = dbaccess.get_certificate_by_id(certificate_id)
+            dbaccess.revoke_certificate_by_id(utils.utc_now(), certificate_id, record.formatted_serial)
+
+    recorder.measure(prefix + "revoke.single", revoke_count, revoke_single, lambda: pick_targets(revoke_count))
+    recorder.measure(
+        prefix + "revoke.bulk",
+        revoke_count * 10,
+        lambda targets: dbaccess.revoke_certificates(utils.utc_now(), certificate_ids = targets),
+        lambda: pick_targets(revoke_count * 10)
+    )
+
+    # CRL generation, as mca-gen-crl streams it, without recording it.
+    crl_section = config.get_section_for_context("revocation_list", None)
+    crl_path = os.path.join(ca_dir, "bench.crl")
+    revoked_count = conn.execute("SELECT COUNT(*) FROM revoked_certificate;").fetchone()[0]
+
+    def build_crl(state):
+        utc_now = utils.utc_now()
+        crl_start_time = utils.floor_time_minute(utc_now)
+
+        builder = gen_crl.make_crl_builder(
+            crl_section,
+            authority_context,
+            private_key.public_key(),
+            crl_start_time,
+            crl_start_time + crl_section.duration,
+            dbaccess.get_next_crl_number()
+        )
+
+        template = crlenc.CrlTemplate(builder, private_key, utils.hash_algorithm_name_to_instance(crl_section.signature_algorithm))
+        template.write_streamed_crl(dbaccess.iter_crl_entries(utc_now), crl_path)
+
+    recorder.measure(prefix + "crl.build", revoked_count, build_crl)
+
+    # Inventory queries.
+    active_count = consume(dbaccess.iter_active_certificates())
+    recorder.measure(prefix + "active.iter", active_count, lambda state: consume(dbaccess.iter_active_certificates()))
+    recorder.measure(prefix + "active.page", 1000, lambda state: consume(dbaccess.iter_active_certificates(
+        after_id = first_id + size // 2,
+        limit = 1000
+    )))
+
+    def write_jsonl(state):
+        with open(os.devnull, "w") as output:
+            active_certificates.write_jsonl(dbaccess.iter_active_certificates(), output)
+
+    recorder.measure(prefix + "active.jsonl", active_count, write_jsonl)
+
+    # Metrics, read from the summaries maintained by triggers.
+    recorder.measure(prefix + "metrics.collect", 1, lambda state: metrics.collect_metrics(utils.utc_now(), 30))
+
+    conn.close()
+    dbaccess.database_connection = None
+    authority.current_context = None
+
+    os.chdir(os.path.dirname(base_dir))
+    shutil.rmtree(ca_dir)
+
+def bench_startup(recorder, ca_dir):
+    # Wall time of 'mca <subcommand> --help' in a new interpreter.
+    env = dict(os.environ)
+    env["PYTHONPATH"] = package_dir
+
+    for name in mca.subcommand_modules.keys():
+        def start(state):
+            subprocess.run(
+                [ sys.executable, "-W", "ignore", "-m", "mini_py_ca.commands.mca", name, "--help" ],
+                cwd = ca_dir,
+                env = env,
+                stdout = subprocess.DEVNULL,
+                check = True
+            )
+
+        recorder.measure("startup." + name, 1, start)
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+            [ "git", "rev-parse", "--short", "HEAD" ],
+            cwd = package_dir,
+            stdout = subprocess.PIPE,
+            stderr = subprocess.DEVNULL,
+            check = True
+        ).stdout.decode("ascii").strip()
+    except Exception:
+        return None
+
+def run(args):
+    rng = random.Random(args.seed)
+    recorder = Recorder(args.repeat)
+
+    sizes = [ int(value) for value in args.sizes.split(",") ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        base_dir = os.path.join(temp_dir, "base")
+        os.mkdir(base_dir)
+        create_authority(base_dir)
+
+        bench_startup(recorder, base_dir)
+
+        for size in sizes:
+            bench_dataset(recorder, base_dir, size, args.revoked_ratio, args.sign_count, args.revoke_count, rng)
+
+        os.chdir(package_dir)
+
+    results = {
+        "version": results_version,
+        "date": utils.utc_now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cryptography": cryptography.__version__,
+            "sqlite": sqlite3.sqlite_version,
+            "cpu_count": os.cpu_count(),
+            "revision": get_git_revision(),
+        },
+        "parameters": {
+            "sizes": sizes,
+            "revoked_ratio": args.revoked_ratio,
+            "sign_count": args.sign_count,
+            "revoke_count": args.revoke_count,
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": recorder.results,
+    }
+
+    if not args.output is None:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent = 2)
+
+        print("Wrote the results to '{0}'.".format(args.output))
+
+    if not args.baseline is None:
+        return compare(load_results(args.baseline), results, args.threshold)
+
+    return 0
+
+def load_results(path):
+    with open(path, "r") as file:
+        results = json.load(file)
+
+    if results.get("version") != results_version:
+        raise Exception("Unsupported benchmark results version in '" + path + "'.")
+
+    return results
+
+def compare(baseline, current, threshold):
+    # Returns 1 when a benchmark of both runs is slower than the baseline by
+    # more than the threshold.
+    if baseline["parameters"] != current["parameters"]:
+        print("Warning: the runs were made with different parameters.")
+
+    regression_count = 0
+
+    print("{0:44} {1:>11} {2:>11} {3:>8}".format("benchmark", "baseline", "current", "change"))
+
+    for name, result in current["results"].items():
+        if not name in baseline["results"]:
+            continue
+
+        baseline_seconds = baseline["results"][name]["seconds"]
+        change = result["seconds"] / baseline_seconds - 1 if baseline_seconds > 0 else 0.0
+
+        status = ""
+        if change > threshold:
+            status = "REGRESSION"
+            regression_count = regression_count + 1
+        elif change < -threshold:
+            status = "faster"
+
+        print("{0:44} {1:>10.4f}s {2:>10.4f}s {3:>+7.1%}  {4}".format(name, baseline_seconds, result["seconds"], change, status))
+
+    print("{0} regression(s) over {1:.0%}.".format(regression_count, threshold))
+
+    return 1 if regression_count > 0 else 0
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "operation",
+        choices = [ "run", "compare" ],
+        help = "Run the benchmarks, or compare two result files"
+    )
+
+    parser.add_argument(
+        "files",
+        nargs = "*",
+        help = "For compare, the baseline and current result files"
+    )
+
+    parser.add_argument(
+        "--sizes",
+        default = "1000,100000,1000000",
+        help = "Comma separated numbers of synthetic certificates, one dataset each"
+    )
+
+    parser.add_argument(
+        "--revoked-ratio",
+        type = float,
+        default = 0.1,
+        help = "Fraction of the synthetic certificates that are revoked"
+    )
+
+    parser.add_argument(
+        "--sign-count",
+        type = int,
+        default = 100,
+        help = "Number of certificates signed per issuance benchmark"
+    )
+
+    parser.add_argument(
+        "--revoke-count",
+        type = int,
+        default = 20,
+        help = "Number of single revocations, bulk revocations revoking ten times more"
+    )
+
+    parser.add_argument(
+        "--repeat",
+        type = int,
+        default = 3,
+        help = "Number of runs of each benchmark, the fastest being kept"
+    )
+
+    parser.add_argument(
+        "--seed",
+        type = int,
+        default = 1,
+        help = "Seed of the synthetic data"
+    )
+
+    parser.add_argument(
+        "--output",
+        help = "File receiving the results as JSON"
+    )
+
+    parser.add_argument(
+        "--baseline",
+        help = "Result file to compare the run against"
+    )
+
+    parser.add_argument(
+        "--threshold",
+        type = float,
+        default = 0.1,
+        help = "Relative slowdown reported as a regression"
+    )
+
+    args = parser.parse_args()
+
+    if args.operation == "compare":
+        if len(args.files) != 2:
+            parser.error("compare needs the baseline and current result files")
+
+        sys.exit(compare(load_results(args.files[0]), load_results(args.files[1]), args.threshold))
+
+    sys.exit(run(args))
+
+
+if __name__ == "__main__":
+    main()
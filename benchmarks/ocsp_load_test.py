@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Load test for mca-ocsp-server, run from the CA directory: builds OCSP
+# requests for the active certificates and sends them over keep-alive
+# connections, reporting the request rate and latency percentiles.
+
+import argparse
+import asyncio
+import base64
+import random
+import time
+import urllib.parse
+
+from cryptography.x509 import ocsp
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+
+from mini_py_ca import authority
+from mini_py_ca import dbaccess
+
+
+def build_requests(limit):
+    authority_certificate = authority.get_authority_context().certificate
+
+    requests = []
+    for record in dbaccess.iter_active_certificates():
+        certificate = dbaccess.load_certificate_by_serial(record.formatted_serial)
+
+        builder = ocsp.OCSPRequestBuilder().add_certificate(certificate, authority_certificate, hashes.SHA1())
+        requests.append(builder.build().public_bytes(serialization.Encoding.DER))
+
+        if len(requests) >= limit:
+            break
+
+    return requests
+
+def make_http_request(host, port, request_bytes, method):
+    if method == "GET":
+        path = "/" + urllib.parse.quote(base64.b64encode(request_bytes).decode("ascii"), safe = "")
+
+        return "GET {0} HTTP/1.1\r\nHost: {1}:{2}\r\n\r\n".format(path, host, port).encode("ascii")
+
+    header = "POST / HTTP/1.1\r\nHost: {0}:{1}\r\nContent-Type: application/ocsp-request\r\nContent-Length: {2:d}\r\n\r\n"
+
+    return header.format(host, port, len(request_bytes)).encode("ascii") + request_bytes
+
+async def read_response(reader):
+    content_length = 0
+
+    status_line = await reader.readline()
+    while True:
+        header_line = await reader.readline()
+        if header_line in (b"\r\n", b""):
+            break
+
+        name, _, value = header_line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            content_length = int(value.strip())
+
+    body = await reader.readexactly(content_length)
+
+    return (status_line, body)
+
+async def run_client(host, port, http_requests, deadline, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+
+    try:
+        while time.perf_counter() < deadline:
+            start_time = time.perf_counter()
+
+            writer.write(random.choice(http_requests))
+            await writer.drain()
+            status_line, body = await read_response(reader)
+
+            latencies.append(time.perf_counter() - start_time)
+
+            if not status_line.startswith(b"HTTP/1.1 200"):
+                raise Exception("Unexpected response: " + status_line.decode("latin-1").strip())
+    finally:
+        writer.close()
+
+async def run_load_test(host, port, http_requests, concurrency, duration):
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    await asyncio.gather(*[
+        run_client(host, port, http_requests, deadline, latencies) for i in range(concurrency)
+    ])
+
+    return latencies
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default = "127.0.0.1", help = "Address of the responder")
+    parser.add_argument("--port", type = int, default = 8080, help = "Port of the responder")
+    parser.add_argument("--method", choices = [ "GET", "POST" ], default = "GET", help = "HTTP method used")
+    parser.add_argument("--concurrency", type = int, default = 16, help = "Number of concurrent connections")
+    parser.add_argument("--duration", type = float, default = 10.0, help = "Length of the test in seconds")
+    parser.add_argument("--certificates", type = int, default = 1000, help = "Maximum number of distinct certificates queried")
+
+    args = parser.parse_args()
+
+    requests = build_requests(args.certificates)
+    if len(requests) < 1:
+        print("No active certificates to query.")
+        return
+
+    http_requests = [ make_http_request(args.host, args.port, request, args.method) for request in requests ]
+
+    latencies = asyncio.run(run_load_test(args.host, args.port, http_requests, args.concurrency, args.duration))
+    latencies.sort()
+
+    print("{0} {1} requests for {2} certificate(s) over {3} connection(s):".format(
+        len(latencies),
+        args.method,
+        len(requests),
+        args.concurrency
+    ))
+    print(" - {0:.1f} requests/s".format(len(latencies) / args.duration))
+    print(" - latency p50 {0:.3f}ms, p99 {1:.3f}ms, max {2:.3f}ms".format(
+        percentile(latencies, 0.50) * 1000,
+        percentile(latencies, 0.99) * 1000,
+        latencies[-1] * 1000
+    ))
+
+
+if __name__ == "__main__":
+    main()
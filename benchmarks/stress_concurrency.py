@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# Runs parallel issuers and revokers against a copy of the CA directory it is
+# started from, for increasing numbers of issuers, then checks that the
+# database is consistent after each round.
+
+import argparse
+import concurrent.futures
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from mini_py_ca import authority
+from mini_py_ca import config
+from mini_py_ca import common
+from mini_py_ca import dbaccess
+from mini_py_ca import utils
+from mini_py_ca.commands import revocation_journal
+from mini_py_ca.commands import sign_csr
+
+
+def make_request(index):
+    key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+    builder = x509.CertificateSigningRequestBuilder()
+    builder = builder.subject_name(x509.Name([ x509.NameAttribute(NameOID.COMMON_NAME, "stress-{0}.acme.corp".format(index)) ]))
+
+    return builder.sign(key, hashes.SHA256(), default_backend())
+
+def run_issuer(ca_dir, index, count):
+    os.chdir(ca_dir)
+
+    section = config.get_section_for_context("sign_request", None)
+    crl_partitions = config.get_crl_partitions()
+    authority_context = authority.get_authority_context()
+    private_key = common.load_private_key()
+    request = make_request(index)
+
+    not_before = utils.floor_time_minute(utils.utc_now())
+    not_after = not_before + section.duration
+
+    for i in range(count):
+        certificate = sign_csr.build_certificate(
+            request,
+            section,
+            authority_context,
+            private_key,
+            dbaccess.generate_certificate_serial(),
+            not_before,
+            not_after,
+            crl_partitions
+        )
+
+        dbaccess.add_certificate_to_db(certificate, is_self_signed = False, crl_partitions = crl_partitions)
+
+    return ("issuer", count, 0)
+
+def run_revoker(ca_dir, index, count):
+    # Revokers pick their targets at random among the same certificates, so
+    # they regularly race for one.
+    os.chdir(ca_dir)
+
+    rng = random.Random(index)
+    conn = dbaccess.get_connection()
+
+    revoked_count = 0
+    conflict_count = 0
+    idle_count = 0
+    i = 0
+    while i < count and idle_count < 200:
+        max_id = conn.execute("SELECT MAX(issued_certificate_id) FROM issued_certificate;").fetchone()[0]
+
+        records = list(dbaccess.iter_active_certificates(
+            revoked = False,
+            self_signed = False,
+            after_id = rng.randint(0, max_id),
+            limit = 1
+        ))
+
+        if len(records) < 1:
+            # Waits for the issuers.
+            idle_count = idle_count + 1
+            time.sleep(0.005)
+            continue
+
+        i = i + 1
+
+        if i % 2 == 0:
+            try:
+                dbaccess.revoke_certificate_by_id(utils.utc_now(), records[0].id, records[0].formatted_serial)
+                revoked_count = revoked_count + 1
+            except Exception:
+                conflict_count = conflict_count + 1
+        else:
+            revoked, skipped = dbaccess.revoke_certificates(utils.utc_now(), certificate_ids = [ records[0].id ])
+            revoked_count = revoked_count + len(revoked)
+            conflict_count = conflict_count + len(skipped)
+
+    return ("revoker", revoked_count, conflict_count)
+
+def count_rows(conn, query):
+    return conn.execute(query).fetchone()[0]
+
+def get_counts(conn):
+    return (
+        count_rows(conn, "SELECT COUNT(*) FROM issued_certificate;"),
+        count_rows(conn, "SELECT COUNT(*) FROM revoked_certificate;")
+    )
+
+def check_consistency(conn, initial_counts, issued_count, revoked_count):
+    errors = []
+
+    issued_total, revoked_total = get_counts(conn)
+    if issued_total != initial_counts[0] + issued_count:
+        errors.append("{0} certificates in the database, expected {1}".format(issued_total, initial_counts[0] + issued_count))
+
+    if revoked_total != initial_counts[1] + revoked_count:
+        errors.append("{0} revocations in the database, expected {1}".format(revoked_total, initial_counts[1] + revoked_count))
+
+    checks = [
+        ("duplicate serials", "SELECT COUNT(*) - COUNT(DISTINCT serial) FROM issued_certificate;"),
+        ("duplicate revocations", "SELECT COUNT(*) - COUNT(DISTINCT issued_certificate_id) FROM revoked_certificate;"),
+        ("revocations without CRL entry", """SELECT COUNT(*) FROM revoked_certificate AS rc
+WHERE NOT EXISTS (SELECT 1 FROM revoked_certificate_entry AS rce WHERE rce.revoked_certificate_id = rc.revoked_certificate_id);"""),
+        ("leftover serial reservations", "SELECT COUNT(*) FROM serial_reservation;"),
+        ("certificates without DER", "SELECT COUNT(*) FROM issued_certificate WHERE der IS NULL;"),
+    ]
+
+    for name, query in checks:
+        count = count_rows(conn, query)
+        if count != 0:
+            errors.append("{0} {1}".format(count, name))
+
+    comparison = revocation_journal.compare_journal(dbaccess.get_revocation_journal(), conn)
+    if not comparison.is_consistent() or len(comparison.pending) > 0:
+        errors.append("revocation journal: {0} missing, {1} mismatched, {2} corrupt, {3} pending".format(
+            len(comparison.missing),
+            len(comparison.mismatched),
+            len(comparison.corrupt_offsets),
+            len(comparison.pending)
+        ))
+
+    return errors
+
+def run_round(source_dir, issuer_count, revoker_count, certificate_count, revocation_count):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        ca_dir = os.path.join(temp_dir, "ca")
+        shutil.copytree(source_dir, ca_dir, symlinks = True)
+
+        os.chdir(ca_dir)
+        dbaccess.database_connection = None
+        conn = dbaccess.get_connection()
+        initial_counts = get_counts(conn)
+        conn.close()
+        dbaccess.database_connection = None
+
+        start_time = time.perf_counter()
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers = issuer_count + revoker_count) as executor:
+            futures = [ executor.submit(run_issuer, ca_dir, i, certificate_count) for i in range(issuer_count) ]
+            revoker_futures = [ executor.submit(run_revoker, ca_dir, i, revocation_count) for i in range(revoker_count) ]
+
+            # The throughput is the one of the issuers, revokers possibly
+            # waiting for targets after them.
+            results = [ future.result() for future in futures ]
+            elapsed = time.perf_counter() - start_time
+
+            results.extend([ future.result() for future in revoker_futures ])
+
+        issued_count = sum([ result[1] for result in results if result[0] == "issuer" ])
+        revoked_count = sum([ result[1] for result in results if result[0] == "revoker" ])
+        conflict_count = sum([ result[2] for result in results if result[0] == "revoker" ])
+
+        conn = dbaccess.get_connection()
+        errors = check_consistency(conn, initial_counts, issued_count, revoked_count)
+        conn.close()
+        dbaccess.database_connection = None
+
+        os.chdir(source_dir)
+
+        return (issued_count, revoked_count, conflict_count, elapsed, errors)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--issuers",
+        default = "1,2,4",
+        help = "Comma separated numbers of parallel issuers, one round each"
+    )
+
+    parser.add_argument(
+        "--revokers",
+        type = int,
+        default = 2,
+        help = "Number of parallel revokers in every round"
+    )
+
+    parser.add_argument(
+        "--certificates",
+        type = int,
+        default = 200,
+        help = "Number of certificates issued by each issuer"
+    )
+
+    parser.add_argument(
+        "--revocations",
+        type = int,
+        default = 100,
+        help = "Number of revocation attempts by each revoker"
+    )
+
+    args = parser.parse_args()
+
+    source_dir = os.getcwd()
+    if not os.path.exists(os.path.join(source_dir, ".minipyca", "db.sqlite")):
+        print("Run from a CA directory, which is copied for every round.")
+        sys.exit(1)
+
+    print("{0:>7} {1:>8} {2:>8} {3:>8} {4:>9} {5:>8} {6:>12} {7:>8}  {8}".format(
+        "issuers", "revokers", "issued", "revoked", "conflicts", "time", "certs/s", "speedup", "consistency"
+    ))
+
+    base_rate = None
+    failed = False
+    for issuer_count in [ int(value) for value in args.issuers.split(",") ]:
+        issued_count, revoked_count, conflict_count, elapsed, errors = run_round(
+            source_dir,
+            issuer_count,
+            args.revokers,
+            args.certificates,
+            args.revocations
+        )
+
+        rate = issued_count / elapsed
+        if base_rate is None:
+            base_rate = rate
+
+        print("{0:>7d} {1:>8d} {2:>8d} {3:>8d} {4:>9d} {5:>7.2f}s {6:>12.1f} {7:>7.2f}x  {8}".format(
+            issuer_count,
+            args.revokers,
+            issued_count,
+            revoked_count,
+            conflict_count,
+            elapsed,
+            rate,
+            rate / base_rate,
+            "ok" if len(errors) < 1 else "; ".join(errors)
+        ))
+
+        failed = failed or len(errors) > 0
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+from cryptography import x509
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+
+from mini_py_ca import dbaccess
+from mini_py_ca import ocspresp
+from mini_py_ca import timings
+
+
+# The context of the current authority, loaded once per process.
+current_context = None
+
+class AuthorityContext:
+    # Derived values of the authority certificate, the certificate itself
+    # being parsed only when a builder needs it.
+    def __init__(self, certificate_id, serial, certificate_der, values):
+        self.certificate_id = certificate_id
+        self.serial = serial
+        self.certificate_der = certificate_der
+
+        self.key_identifier = values["key_identifier"]
+        self.spki_sha256 = values["spki_sha256"]
+        self.ocsp_issuer_hashes = {
+            "sha1": (values["ocsp_sha1_name_hash"], values["ocsp_sha1_key_hash"]),
+            "sha256": (values["ocsp_sha256_name_hash"], values["ocsp_sha256_key_hash"]),
+        }
+
+        self.parsed_certificate = None
+
+    def __getstate__(self):
+        # Lets process pool workers receive the context, parsed objects of
+        # cryptography not being picklable.
+        state = dict(self.__dict__)
+        state["parsed_certificate"] = None
+
+        return state
+
+    @property
+    def certificate(self):
+        if self.parsed_certificate is None:
+            self.parsed_certificate = x509.load_der_x509_certificate(self.certificate_der, default_backend())
+
+        return self.parsed_certificate
+
+    @property
+    def authority_key_identifier(self):
+        return x509.AuthorityKeyIdentifier(self.key_identifier, None, None)
+
+def compute_authority_values(certificate):
+    spki = certificate.public_key().public_bytes(
+        encoding = serialization.Encoding.DER,
+        format = serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    spki_hasher = hashes.Hash(hashes.SHA256(), default_backend())
+    spki_hasher.update(spki)
+
+    sha1_hashes = ocspresp.compute_issuer_hashes(certificate, hashes.SHA1())
+    sha256_hashes = ocspresp.compute_issuer_hashes(certificate, hashes.SHA256())
+
+    return {
+        "key_identifier": x509.AuthorityKeyIdentifier.from_issuer_public_key(certificate.public_key()).key_identifier,
+        "spki_sha256": spki_hasher.finalize(),
+        "ocsp_sha1_name_hash": sha1_hashes[0],
+        "ocsp_sha1_key_hash": sha1_hashes[1],
+        "ocsp_sha256_name_hash": sha256_hashes[0],
+        "ocsp_sha256_key_hash": sha256_hashes[1],
+    }
+
+value_names = [
+    "key_identifier",
+    "spki_sha256",
+    "ocsp_sha1_name_hash",
+    "ocsp_sha1_key_hash",
+    "ocsp_sha256_name_hash",
+    "ocsp_sha256_key_hash",
+]
+
+@timings.timed("db.authority_context")
+def load_authority_context():
+    row = dbaccess.find_current_authority_context()
+    if row is None:
+        raise Exception("No authority certificate, run 'mca-gen-ca-cert' first.")
+
+    certificate_id, serial, certificate_der = row[0:3]
+
+    if certificate_der is None:
+        certificate_der = dbaccess.load_certificate_by_serial(serial).public_bytes(serialization.Encoding.DER)
+
+    if row[3] is None:
+        # Authorities created before the values were persisted.
+        certificate = x509.load_der_x509_certificate(certificate_der, default_backend())
+        values = compute_authority_values(certificate)
+        dbaccess.record_authority_context(certificate.serial_number, values)
+    else:
+        values = dict(zip(value_names, row[3:]))
+
+    return AuthorityContext(certificate_id, serial, certificate_der, values)
+
+def get_authority_context():
+    global current_context
+
+    if current_context is None:
+        current_context = load_authority_context()
+
+    return current_context
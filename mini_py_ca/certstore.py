@@ -0,0 +1,438 @@
+import mmap
+import os
+import struct
+
+from mini_py_ca import der
+from mini_py_ca import lazyimport
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+x509 = lazyimport.lazy_import("cryptography.x509")
+backends = lazyimport.lazy_import("cryptography.hazmat.backends")
+
+
+# The pack file is the concatenation of the DER certificates, appended to.
+# The index holds one fixed size entry per serial, sorted by serial, giving
+# the position of the certificate in the pack. New entries are appended to
+# the log, which is merged into the index once it holds log_merge_threshold
+# of them, so adding certificates does not rewrite the whole index.
+pack_name = "certificates.pack"
+index_name = "certificates.idx"
+log_name = "certificates.log"
+lock_name = "store.lock"
+
+pack_magic = b"MCAPAK01"
+index_magic = b"MCAIDX01"
+log_magic = b"MCALOG01"
+
+log_merge_threshold = 65536
+
+# Serials are at most 20 octets (RFC 5280 4.1.2.2), stored big-endian so
+# the byte order of the keys is the numeric order.
+serial_size = 20
+index_entry = struct.Struct(">20sQI")
+
+def make_serial_key(serial):
+    return serial.to_bytes(serial_size, "big")
+
+def make_filler(length):
+    # DER NULL elements, led by a one octet OCTET STRING for odd lengths, that
+    # take the place of a removed certificate in the pack.
+    filler = b""
+    if length % 2 == 1:
+        filler = der.encode_tlv(der.tag_octet_string, b"\x00")
+
+    return filler + der.encode_tlv(der.tag_null, b"") * ((length - len(filler)) // 2)
+
+def read_certificate_serial(data, offset):
+    tag, certificate_start, certificate_end = der.read_tlv(data, offset)
+    tag, tbs_start, tbs_end = der.read_tlv(data, certificate_start)
+
+    tag, value_start, value_end = der.read_tlv(data, tbs_start)
+    if tag == der.tag_context_0:
+        # Skips the explicit version.
+        tag, value_start, value_end = der.read_tlv(data, value_end)
+
+    if tag != der.tag_integer:
+        raise Exception("Invalid certificate at offset {0} of the pack.".format(offset))
+
+    return (int.from_bytes(data[value_start:value_end], "big"), certificate_end)
+
+class StoreLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, "ab")
+        if not fcntl is None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+
+        return self
+
+    def __exit__(self, exec_type, exec_value, traceback):
+        self.file.close()
+
+class StoreMark:
+    # Returned by CertificateStore.add, for remove_added to undo it.
+    def __init__(self, keys, pack_start, pack_end, log_start, log_end, log_inode):
+        self.keys = keys
+        self.pack_start = pack_start
+        self.pack_end = pack_end
+        self.log_start = log_start
+        self.log_end = log_end
+        self.log_inode = log_inode
+
+class CertificateStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.pack_path = os.path.join(directory, pack_name)
+        self.index_path = os.path.join(directory, index_name)
+        self.log_path = os.path.join(directory, log_name)
+        self.lock_path = os.path.join(directory, lock_name)
+
+        self.index_stat = None
+        self.index_map = None
+        self.pack_map = None
+
+        # Log entries by serial key, as (pack offset, length), the length
+        # being 0 for removed certificates.
+        self.log_stat = None
+        self.log_entries = dict()
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    def create(self):
+        if not os.path.exists(self.directory):
+            os.mkdir(self.directory)
+
+        with StoreLock(self.lock_path):
+            if not os.path.exists(self.pack_path):
+                with open(self.pack_path, "wb") as pack:
+                    pack.write(pack_magic)
+
+            if not os.path.exists(self.index_path):
+                self.write_index([])
+
+            if not os.path.exists(self.log_path):
+                self.write_log([])
+
+    def refresh_maps(self):
+        # Maps the files again after another writer changed the log or the
+        # index, the pack having grown along with them. The log is read first,
+        # as a merge replaces the index before emptying the log.
+        log_stat = get_stat_key(self.log_path)
+        index_stat = get_stat_key(self.index_path)
+        if log_stat == self.log_stat and index_stat == self.index_stat:
+            return
+
+        log_entries = read_log(self.log_path)
+
+        # The former maps are left to the garbage collector, since callers
+        # may still hold views on them.
+        self.index_map = map_file(self.index_path)
+        self.pack_map = map_file(self.pack_path)
+        self.log_entries = log_entries
+        self.index_stat = index_stat
+        self.log_stat = log_stat
+
+        if self.index_map[:len(index_magic)] != index_magic or self.pack_map[:len(pack_magic)] != pack_magic:
+            raise Exception("Invalid certificate store in '" + self.directory + "'.")
+
+    def count(self):
+        self.refresh_maps()
+
+        count = (len(self.index_map) - len(index_magic)) // index_entry.size
+        for key, log_entry in self.log_entries.items():
+            is_indexed = not self.find_index_entry(key) is None
+            if log_entry[1] > 0 and not is_indexed:
+                count = count + 1
+            elif log_entry[1] == 0 and is_indexed:
+                count = count - 1
+
+        return count
+
+    def find_position(self, index_map, key):
+        # Offset of the first entry whose serial is not lower than key.
+        low = 0
+        high = (len(index_map) - len(index_magic)) // index_entry.size
+
+        while low < high:
+            middle = (low + high) // 2
+            offset = len(index_magic) + middle * index_entry.size
+
+            if index_map[offset:offset + serial_size] < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return len(index_magic) + low * index_entry.size
+
+    def find_index_entry(self, key):
+        offset = self.find_position(self.index_map, key)
+        if offset >= len(self.index_map):
+            return None
+
+        entry_key, pack_offset, length = index_entry.unpack_from(self.index_map, offset)
+        if entry_key != key:
+            return None
+
+        return (pack_offset, length)
+
+    def get_der(self, serial):
+        # Returns a view on the mapped pack, without copying the certificate.
+        self.refresh_maps()
+
+        key = make_serial_key(serial)
+        entry = self.log_entries.get(key)
+        if entry is None:
+            entry = self.find_index_entry(key)
+
+        if entry is None or entry[1] == 0:
+            return None
+
+        pack_offset, length = entry
+        return memoryview(self.pack_map)[pack_offset:pack_offset + length]
+
+    def load_certificate(self, serial):
+        certificate_der = self.get_der(serial)
+        if certificate_der is None:
+            return None
+
+        return x509.load_der_x509_certificate(bytes(certificate_der), backends.default_backend())
+
+    def iter_entries(self):
+        # In serial order, the log entries taking the place of the index ones.
+        self.refresh_maps()
+
+        index_map = self.index_map
+        pack_view = memoryview(self.pack_map)
+        log_keys = sorted(self.log_entries.keys())
+        log_position = 0
+
+        for offset in range(len(index_magic), len(index_map), index_entry.size):
+            key, pack_offset, length = index_entry.unpack_from(index_map, offset)
+
+            while log_position < len(log_keys) and log_keys[log_position] <= key:
+                log_key = log_keys[log_position]
+                log_position = log_position + 1
+
+                if log_key == key:
+                    pack_offset, length = self.log_entries[log_key]
+                else:
+                    log_offset, log_length = self.log_entries[log_key]
+                    if log_length > 0:
+                        yield (int.from_bytes(log_key, "big"), pack_view[log_offset:log_offset + log_length])
+
+            if length > 0:
+                yield (int.from_bytes(key, "big"), pack_view[pack_offset:pack_offset + length])
+
+        for log_key in log_keys[log_position:]:
+            log_offset, log_length = self.log_entries[log_key]
+            if log_length > 0:
+                yield (int.from_bytes(log_key, "big"), pack_view[log_offset:log_offset + log_length])
+
+    def add(self, certificates_der):
+        # Appends the certificates to the pack, then their entries to the log.
+        # A crash in between only leaves unreferenced bytes at the end of the
+        # pack, and a serial stored again points to its latest certificate.
+        # Returns the mark to pass to remove_added.
+        if len(certificates_der) < 1:
+            return None
+
+        with StoreLock(self.lock_path):
+            if not os.path.exists(self.log_path):
+                self.write_log([])
+
+            log_stat = os.stat(self.log_path)
+
+            keys = []
+            entries = []
+            with open(self.pack_path, "ab") as pack:
+                pack_start = pack.tell()
+                pack_offset = pack_start
+
+                for certificate_der in certificates_der:
+                    serial, end = read_certificate_serial(certificate_der, 0)
+                    keys.append(make_serial_key(serial))
+                    entries.append(index_entry.pack(make_serial_key(serial), pack_offset, len(certificate_der)))
+
+                    pack.write(certificate_der)
+                    pack_offset = pack_offset + len(certificate_der)
+
+                pack.flush()
+                os.fsync(pack.fileno())
+
+            log_end = self.append_log(entries)
+            mark = StoreMark(keys, pack_start, pack_offset, log_stat.st_size, log_end, log_stat.st_ino)
+
+            if (log_end - len(log_magic)) // index_entry.size >= log_merge_threshold:
+                self.merge_log()
+
+            return mark
+
+    def remove_added(self, mark):
+        # Undoes an add whose certificates were not recorded after all. The
+        # pack and the log are cut back when nothing was added since, else
+        # the certificates are blanked in the pack and removed by the log.
+        if mark is None:
+            return
+
+        with StoreLock(self.lock_path):
+            log_stat = os.stat(self.log_path)
+            if log_stat.st_ino == mark.log_inode and log_stat.st_size == mark.log_end and \
+                    os.path.getsize(self.pack_path) == mark.pack_end:
+                truncate_file(self.log_path, mark.log_start)
+                truncate_file(self.pack_path, mark.pack_start)
+                return
+
+            entries = []
+            with open(self.pack_path, "r+b") as pack:
+                pack_map = map_file(self.pack_path)
+                pack_offset = mark.pack_start
+                while pack_offset < mark.pack_end:
+                    serial, end = read_certificate_serial(pack_map, pack_offset)
+                    entries.append(index_entry.pack(make_serial_key(serial), pack_offset, 0))
+
+                    pack.seek(pack_offset)
+                    pack.write(make_filler(end - pack_offset))
+                    pack_offset = end
+
+                pack_map.close()
+                pack.flush()
+                os.fsync(pack.fileno())
+
+            self.append_log(entries)
+
+    def merge_log(self):
+        # Writes the index with the log entries, then empties the log. A
+        # crash in between merges the same entries again.
+        log_entries = read_log(self.log_path)
+        index_map = map_file(self.index_path)
+
+        chunks = []
+        previous_offset = len(index_magic)
+        for key in sorted(log_entries.keys()):
+            offset = self.find_position(index_map, key)
+            chunks.append(index_map[previous_offset:offset])
+
+            pack_offset, length = log_entries[key]
+            if length > 0:
+                chunks.append(index_entry.pack(key, pack_offset, length))
+
+            previous_offset = offset
+            if offset < len(index_map) and index_map[offset:offset + serial_size] == key:
+                previous_offset = offset + index_entry.size
+
+        chunks.append(index_map[previous_offset:])
+        index_map.close()
+
+        self.write_index(chunks)
+        self.write_log([])
+
+    def rebuild_index(self):
+        # Scans the whole pack, for recovery and after bulk appends, skipping
+        # the blanked certificates. The log is emptied, being merged as well.
+        with StoreLock(self.lock_path):
+            pack_map = map_file(self.pack_path)
+
+            entries = dict()
+            offset = len(pack_magic)
+            while offset < len(pack_map):
+                if pack_map[offset] != der.tag_sequence:
+                    tag, value_start, offset = der.read_tlv(pack_map, offset)
+                    continue
+
+                serial, end = read_certificate_serial(pack_map, offset)
+                entries[make_serial_key(serial)] = index_entry.pack(make_serial_key(serial), offset, end - offset)
+                offset = end
+
+            pack_map.close()
+
+            self.write_index([ entries[key] for key in sorted(entries.keys()) ])
+            self.write_log([])
+
+            return len(entries)
+
+    def append_unindexed(self, certificates_der):
+        with StoreLock(self.lock_path):
+            with open(self.pack_path, "ab") as pack:
+                for certificate_der in certificates_der:
+                    pack.write(certificate_der)
+
+                pack.flush()
+                os.fsync(pack.fileno())
+
+    def write_index(self, chunks):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "wb") as index:
+            index.write(index_magic)
+            for chunk in chunks:
+                index.write(chunk)
+
+            index.flush()
+            os.fsync(index.fileno())
+
+        os.replace(temp_path, self.index_path)
+
+    def write_log(self, entries):
+        temp_path = self.log_path + ".tmp"
+        with open(temp_path, "wb") as log:
+            log.write(log_magic)
+            for entry in entries:
+                log.write(entry)
+
+            log.flush()
+            os.fsync(log.fileno())
+
+        os.replace(temp_path, self.log_path)
+
+    def append_log(self, entries):
+        # Returns the size of the log afterwards.
+        with open(self.log_path, "ab") as log:
+            log.write(b"".join(entries))
+            log.flush()
+            os.fsync(log.fileno())
+
+            return log.tell()
+
+def get_stat_key(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+def read_log(path):
+    # Entries by serial key, the latest one of a serial winning. A partial
+    # entry being appended by another process is left for the next read.
+    if not os.path.exists(path):
+        return dict()
+
+    with open(path, "rb") as file:
+        data = file.read()
+
+    if data[:len(log_magic)] != log_magic:
+        raise Exception("Invalid certificate store log '" + path + "'.")
+
+    entries = dict()
+    for offset in range(len(log_magic), len(data) - index_entry.size + 1, index_entry.size):
+        key, pack_offset, length = index_entry.unpack_from(data, offset)
+        entries[key] = (pack_offset, length)
+
+    return entries
+
+def truncate_file(path, size):
+    with open(path, "r+b") as file:
+        file.truncate(size)
+        file.flush()
+        os.fsync(file.fileno())
+
+def map_file(path):
+    with open(path, "rb") as file:
+        return mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 
 
+import argparse
+import csv
+import json
 import shutil
+import sys
 
 from mini_py_ca import dbaccess
+from mini_py_ca import timings
 from mini_py_ca import utils
 
 
@@ -13,9 +18,58 @@ def format_serial_for_display(serial):
     return full_string[:6] + "..." + full_string[-6:]
     
 
-def main():
-    cert_list = dbaccess.get_active_certificates()
+output_fields = [
+    "id",
+    "serial",
+    "subject",
+    "not_before",
+    "not_after",
+    "self_signed",
+    "revoked",
+    "revocation_date",
+    "revocation_reason",
+]
+
+def format_datetime(value):
+    return None if value is None else value.isoformat()
+
+def make_output_values(cert):
+    return [
+        cert.id,
+        cert.formatted_serial,
+        cert.subject,
+        format_datetime(cert.not_before_date),
+        format_datetime(cert.not_after_date),
+        cert.is_self_signed,
+        cert.is_revoked,
+        format_datetime(cert.revocation_date),
+        cert.revocation_reason
+    ]
+
+def write_json(cert_list, output):
+    # Writes the array one certificate at a time, never holding the list.
+    output.write("[")
+
+    separator = "\n"
+    for cert in cert_list:
+        output.write(separator + json.dumps(dict(zip(output_fields, make_output_values(cert)))))
+        separator = ",\n"
+
+    output.write("\n]\n")
+
+def write_jsonl(cert_list, output):
+    for cert in cert_list:
+        output.write(json.dumps(dict(zip(output_fields, make_output_values(cert)))) + "\n")
+
+def write_csv(cert_list, output):
+    writer = csv.writer(output)
+    writer.writerow(output_fields)
+
+    for cert in cert_list:
+        values = make_output_values(cert)
+        writer.writerow([ "" if value is None else value for value in values ])
 
+def write_table(cert_list, output):
     terminal_size = shutil.get_terminal_size()
 
     header_format_string = "{0:>4} | {1:15} | {2:26} | {3:26} | {4:2} | {5:2} | {6}"
@@ -27,14 +81,14 @@ def main():
         "S",
         "R",
         "Subject"
-    ))
-    print("-" * terminal_size.columns)
+    ), file = output)
+    print("-" * terminal_size.columns, file = output)
 
     cert_format_string = "{0.id:4d} | {1:15} | {2:26} | {3:26} | {4:2} | {5:2} | {0.subject}"
     is_first_cert = True
     for cert in cert_list:
         if not is_first_cert:
-            print("-" * terminal_size.columns)
+            print("-" * terminal_size.columns, file = output)
         else:
             is_first_cert = False
 
@@ -45,7 +99,100 @@ def main():
             str(cert.not_before_date.astimezone(tz = None)),
             "Y" if cert.is_self_signed else "N",
             "Y" if cert.is_revoked else "N"
-        ))
+        ), file = output)
+
+class CountingIterator:
+    # Keeps the count and the id of the last certificate written, for the
+    # next page hint.
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.count = 0
+        self.last_id = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        cert = next(self.iterator)
+
+        self.count = self.count + 1
+        self.last_id = cert.id
+
+        return cert
+
+writers = {
+    "table": write_table,
+    "json": write_json,
+    "jsonl": write_jsonl,
+    "csv": write_csv,
+}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--format",
+        choices = writers.keys(),
+        default = "table",
+        help = "Output format, every format but table being streamed"
+    )
+
+    parser.add_argument(
+        "--revoked",
+        action = argparse.BooleanOptionalAction,
+        help = "Only list revoked certificates, or with --no-revoked the others"
+    )
+
+    parser.add_argument(
+        "--expiring-before",
+        type = utils.parse_datetime,
+        help = "Only list certificates expiring before this ISO 8601 date, local time unless an offset is given"
+    )
+
+    parser.add_argument(
+        "--subject-like",
+        help = "Only list certificates whose subject matches this SQL LIKE pattern, such as 'CN=%%.acme.corp%%'"
+    )
+
+    parser.add_argument(
+        "--self-signed",
+        action = argparse.BooleanOptionalAction,
+        help = "Only list self-signed certificates, or with --no-self-signed the others"
+    )
+
+    parser.add_argument(
+        "--after-id",
+        type = int,
+        help = "Only list certificates whose id is greater, the last id of the previous page"
+    )
+
+    parser.add_argument(
+        "--limit",
+        type = int,
+        help = "Maximum number of certificates listed"
+    )
+
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    if not args.limit is None and args.limit < 1:
+        parser.error("--limit must be positive.")
+
+    cert_list = CountingIterator(timings.timed_iter("db.certificates", dbaccess.iter_active_certificates(
+        revoked = args.revoked,
+        expiring_before = args.expiring_before,
+        subject_like = args.subject_like,
+        self_signed = args.self_signed,
+        after_id = args.after_id,
+        limit = args.limit
+    )))
+
+    with timings.phase("output"):
+        writers[args.format](cert_list, sys.stdout)
+
+    # On stderr, so the output stays parseable.
+    if not args.limit is None and cert_list.count == args.limit:
+        print("Next page: --after-id {0}".format(cert_list.last_id), file = sys.stderr)
 
 
 if __name__ == "__main__":
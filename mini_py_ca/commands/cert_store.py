@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+import time
+
+from cryptography import x509
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+from mini_py_ca import certstore
+from mini_py_ca import common
+from mini_py_ca import dbaccess
+from mini_py_ca import timings
+from mini_py_ca import utils
+
+
+migrate_chunk_size = 10000
+
+def list_byserial_files():
+    if not os.path.exists("byserial"):
+        return []
+
+    return sorted([ entry.name for entry in os.scandir("byserial") if entry.name.endswith(common.cert_ext) ])
+
+def list_authority_files():
+    # Authority certificates keep their files in the packed layout.
+    paths = set()
+    if os.path.exists("cacert"):
+        for entry in os.scandir("cacert"):
+            paths.add(os.path.basename(os.path.realpath(entry.path)))
+
+    return paths
+
+def migrate(store, remove_files):
+    store.create()
+
+    file_names = list_byserial_files()
+
+    added_count = 0
+    chunk = []
+    for file_name in file_names:
+        serial = int(file_name[:-len(common.cert_ext)], 16)
+        if not store.get_der(serial) is None:
+            continue
+
+        with timings.phase("disk.read_certificates"):
+            certificate_bytes = utils.read_all_bytes(os.path.join("byserial", file_name))
+            certificate = x509.load_pem_x509_certificate(certificate_bytes, default_backend())
+            chunk.append(certificate.public_bytes(serialization.Encoding.DER))
+
+        if len(chunk) >= migrate_chunk_size:
+            with timings.phase("disk.append_store"):
+                store.append_unindexed(chunk)
+            added_count = added_count + len(chunk)
+            chunk = []
+
+    if len(chunk) > 0:
+        with timings.phase("disk.append_store"):
+            store.append_unindexed(chunk)
+        added_count = added_count + len(chunk)
+
+    with timings.phase("disk.rebuild_index"):
+        total_count = store.rebuild_index()
+
+    removed_count = 0
+    if remove_files:
+        removed_count = remove_migrated_files(store, file_names)
+
+    print("Added {0} certificate(s) to the store, which now holds {1}; removed {2} file(s).".format(
+        added_count,
+        total_count,
+        removed_count
+    ))
+
+def remove_migrated_files(store, file_names):
+    authority_files = list_authority_files()
+
+    removed_count = 0
+    if os.path.exists("cert"):
+        for entry in os.scandir("cert"):
+            target_name = os.path.basename(os.path.realpath(entry.path))
+            if not target_name in authority_files and target_name in file_names:
+                os.remove(entry.path)
+                removed_count = removed_count + 1
+
+    for file_name in file_names:
+        if file_name in authority_files:
+            continue
+
+        if store.get_der(int(file_name[:-len(common.cert_ext)], 16)) is None:
+            raise Exception("Certificate '" + file_name + "' is missing from the store, not removing it.")
+
+        os.remove(os.path.join("byserial", file_name))
+        removed_count = removed_count + 1
+
+    return removed_count
+
+def export(output_dir):
+    # Writes the browsable 'byserial', 'cert' and 'cacert' layout for every
+    # certificate of the database, read from the database itself or from
+    # wherever it was stored at issuance.
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+
+    conn = dbaccess.get_connection()
+
+    written_count = 0
+    missing_count = 0
+    for record in dbaccess.iter_certificates_by_filter(conn, "1 = 1", {}):
+        if os.path.exists(os.path.join(output_dir, "byserial", record.formatted_serial + common.cert_ext)):
+            continue
+
+        try:
+            with timings.phase("db.load_certificate"):
+                certificate = dbaccess.load_certificate_by_serial(record.formatted_serial)
+        except FileNotFoundError:
+            print("Certificate " + record.formatted_serial + " is missing.")
+            missing_count = missing_count + 1
+            continue
+
+        with timings.phase("disk.write_certificates"):
+            common.write_certificate_files(certificate, record.is_self_signed, output_dir)
+        written_count = written_count + 1
+
+    print("Exported {0} certificate(s) to '{1}'.".format(written_count, output_dir))
+
+    if missing_count > 0:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "operation",
+        choices = [ "migrate", "export", "rebuild-index" ],
+        help = "The operation on the certificate store"
+    )
+
+    parser.add_argument(
+        "--remove-files",
+        action = "store_true",
+        help = "Remove the migrated files of 'byserial' and 'cert', except for authority certificates"
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        default = "export",
+        help = "Directory receiving the exported layout"
+    )
+
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    store = certstore.CertificateStore(common.store_dir)
+
+    start_time = time.perf_counter()
+
+    if args.operation == "migrate":
+        migrate(store, args.remove_files)
+    elif args.operation == "export":
+        export(args.output_dir)
+    else:
+        if not store.exists():
+            print("No certificate store, run 'mca-cert-store migrate' first.")
+            sys.exit(1)
+
+        with timings.phase("disk.rebuild_index"):
+            indexed_count = store.rebuild_index()
+
+        print("Indexed {0} certificate(s).".format(indexed_count))
+
+    print("Done in {0:.3f}s.".format(time.perf_counter() - start_time))
+
+
+if __name__ == "__main__":
+    main()
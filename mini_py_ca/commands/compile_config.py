@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+
+from mini_py_ca import config
+from mini_py_ca import timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    compiled_config = config.load_compiled_config(use_cache = False)
+
+    for section_name, section in sorted(compiled_config.sections.items()):
+        kind = "unknown kind" if section is None else type(section).__name__
+        print("OK     {0} ({1})".format(section_name, kind))
+
+    for section_name, error in sorted(compiled_config.errors.items()):
+        print("FAILED {0}: {1}".format(section_name, error))
+
+    for context_name, section_name in sorted(compiled_config.default_section.items()):
+        if not section_name in compiled_config.sections and not section_name in compiled_config.errors:
+            print("FAILED default section '{0}' for '{1}' does not exist".format(section_name, context_name))
+            compiled_config.errors[section_name] = "No section with name '" + section_name + "'."
+
+    if len(compiled_config.errors) > 0:
+        sys.exit(1)
+
+    print("Configuration compiled to '" + config.get_config_cache_path() + "'.")
+
+
+if __name__ == "__main__":
+    main()
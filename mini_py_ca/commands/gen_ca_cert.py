@@ -11,11 +11,13 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
 
+from mini_py_ca import authority
 from mini_py_ca import config
 from mini_py_ca import common
 from mini_py_ca import dbaccess
 from mini_py_ca import x509ext
 from mini_py_ca import utils
+from mini_py_ca import timings
 
 from pprint import pprint
 
@@ -27,7 +29,9 @@ def main():
         help = "Section name to use"
     )
 
+    timings.add_arguments(parser)
     args = parser.parse_args()
+    timings.start(parser, args)
 
     section = config.get_section_for_context("root_authority", args.section)
     if not isinstance(section, config.Certificate):
@@ -68,14 +72,16 @@ def main():
         existing_extensions = []
     )
 
-    certificate = builder.sign(
-        private_key = authority_private_key,
-        algorithm = hash_algorithm,
-        backend = default_backend()
-    )
+    with timings.phase("crypto.sign_certificate"):
+        certificate = builder.sign(
+            private_key = authority_private_key,
+            algorithm = hash_algorithm,
+            backend = default_backend()
+        )
 
     common.write_certificate_to_disk(certificate, is_self_signed = True)
     dbaccess.add_certificate_to_db(certificate, is_self_signed = True)
+    dbaccess.record_authority_context(certificate.serial_number, authority.compute_authority_values(certificate))
 
     msg_format = "Generated self-signed certificate with serial {0}:\n" + \
         " - valid on {1}\n" + \
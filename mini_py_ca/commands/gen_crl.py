@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 
 import argparse
+import multiprocessing
+import os
+import sys
 
 from cryptography import x509
 
@@ -8,44 +11,24 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
 
+from mini_py_ca import authority
 from mini_py_ca import config
 from mini_py_ca import common
+from mini_py_ca import crlenc
 from mini_py_ca import dbaccess
+from mini_py_ca import x509ext
 from mini_py_ca import utils
+from mini_py_ca import timings
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--section",
-        help = "Section name to use"
-    )
-
-    args = parser.parse_args()
-
-    section = config.get_section_for_context("revocation_list", args.section)
-    if not isinstance(section, config.RevocationList):
-        raise Exception("Wrong section kind for generating revocation list.")
-
-    utc_now = utils.utc_now()
-    crl_start_time = utils.floor_time_minute(utc_now)
-    crl_next_update = crl_start_time + section.duration
-
-    revocation_list_contents = dbaccess.get_certificates_for_crl(utc_now)
-    number = dbaccess.get_next_crl_number()
-
-    authority_certificate_serial = dbaccess.find_current_authority_certificate_serial()
-    authority_certificate = common.load_certificate_by_serial(authority_certificate_serial)
-    private_key = common.load_private_key()
-    public_key = private_key.public_key()
-
+def make_crl_builder(section, authority_context, public_key, crl_start_time, crl_next_update, number, base_crl_number = None, partition_uri = None):
     builder = x509.CertificateRevocationListBuilder()
-    builder = builder.issuer_name(authority_certificate.issuer)
+    builder = builder.issuer_name(authority_context.certificate.issuer)
     builder = builder.last_update(crl_start_time)
     builder = builder.next_update(crl_next_update)
 
     builder = builder.add_extension(
-        x509.AuthorityKeyIdentifier.from_issuer_public_key(public_key),
+        authority_context.authority_key_identifier,
         critical = False
     )
 
@@ -54,50 +37,248 @@ def main():
         critical = False
     )
 
-    for cert in revocation_list_contents:
-        revoked_cert_builder = x509.RevokedCertificateBuilder()
-
-        revoked_cert_builder = revoked_cert_builder.serial_number(cert.serial)
-        revoked_cert_builder = revoked_cert_builder.revocation_date(
-            utils.floor_time_minute(cert.revocation_date)
+    if not base_crl_number is None:
+        builder = builder.add_extension(
+            x509.DeltaCRLIndicator(base_crl_number),
+            critical = True
         )
 
-        if cert.revocation_reason != "unspecified":
-            revoked_cert_builder = revoked_cert_builder.add_extension(
-                x509.CRLReason(dbaccess.reason_flag_mapping[cert.revocation_reason]),
-                critical = False
-            )
-
-        builder = builder.add_revoked_certificate(
-            revoked_cert_builder.build(default_backend())
+    if not partition_uri is None:
+        builder = builder.add_extension(
+            x509.IssuingDistributionPoint(
+                full_name = [ x509.UniformResourceIdentifier(partition_uri) ],
+                relative_name = None,
+                only_contains_user_certs = False,
+                only_contains_ca_certs = False,
+                only_some_reasons = None,
+                indirect_crl = False,
+                only_contains_attribute_certs = False
+            ),
+            critical = True
         )
 
-    hash_algorithm = utils.hash_algorithm_name_to_instance(section.signature_algorithm)
-    crl = builder.sign(
-        private_key = private_key,
-        algorithm = hash_algorithm,
-        backend = default_backend()
+    ext_ctx = x509ext.ExtensionContext(
+        authority_key = public_key,
+        subject_key = None,
+        authority_key_identifier = authority_context.authority_key_identifier
     )
 
-    common.write_crl_to_disk(crl)
-    dbaccess.add_crl_to_db(crl, utc_now)
+    return x509ext.add_extensions(
+        builder,
+        ext_ctx,
+        extension_config_list = section.extensions,
+        existing_extensions = []
+    )
 
+def print_crl_summary(number, crl_start_time, crl_next_update, revoked_count, base_crl = None, crl_partition = None):
     msg_format_prefix = "Generated CRL number {0} "
+    if not base_crl is None:
+        msg_format_prefix = "Generated delta CRL number {0} against base CRL number " + \
+            str(base_crl[0]) + " "
+    elif not crl_partition is None:
+        msg_format_prefix = "Generated CRL number {0} for partition " + str(crl_partition) + " "
+
     msg_format_suffix = ":\n - valid on {1}\n - next update expected on {2}"
     msg_format_empty = msg_format_prefix + "with no revoked certificates" + msg_format_suffix
     msg_format = msg_format_prefix + "with {3} revoked certificate(s)" + msg_format_suffix
 
-    chosen_format = msg_format if len(revocation_list_contents) > 0 else msg_format_empty
+    chosen_format = msg_format if revoked_count > 0 else msg_format_empty
 
     print(chosen_format.format(
         number,
         crl_start_time.astimezone(tz = None),
         crl_next_update.astimezone(tz = None),
-        len(revocation_list_contents)
+        revoked_count
     ))
 
+# State shared by the partition signing workers, set once per process by
+# init_partition_worker.
+partition_worker_state = None
 
-if __name__ == "__main__":
-    main()
+def init_partition_worker(private_key_bytes, section, authority_context, utc_now, crl_start_time, crl_next_update, last_revoked_certificate_id):
+    global partition_worker_state
+
+    # Each worker reads its partition with its own connection, the one of
+    # the parent process not being usable across a fork.
+    if not multiprocessing.parent_process() is None:
+        dbaccess.database_connection = None
+
+    partition_worker_state = (
+        section,
+        authority_context,
+        common.load_signing_pool_key(private_key_bytes),
+        utc_now,
+        crl_start_time,
+        crl_next_update,
+        last_revoked_certificate_id
+    )
+
+def sign_partition_crl(number, partition):
+    # Streams the entries of the partition from the database into its CRL
+    # file. Returns the template CRL, for the bookkeeping, and the number of
+    # entries.
+    section, authority_context, private_key, utc_now, crl_start_time, crl_next_update, last_revoked_certificate_id = partition_worker_state
+
+    builder = make_crl_builder(
+        section,
+        authority_context,
+        private_key.public_key(),
+        crl_start_time,
+        crl_next_update,
+        number,
+        partition_uri = section.partitions.uri_for_partition(partition)
+    )
+
+    template = crlenc.CrlTemplate(
+        builder,
+        private_key,
+        utils.hash_algorithm_name_to_instance(section.signature_algorithm)
+    )
+
+    revoked_count = template.write_streamed_crl(
+        dbaccess.iter_crl_entries(utc_now, last_revoked_certificate_id = last_revoked_certificate_id, crl_partition = partition),
+        common.make_crl_path(template.template_crl, crl_partition = partition)
+    )
+
+    return (template.template_crl.public_bytes(serialization.Encoding.DER), revoked_count)
+
+def generate_partition_crls(section, authority_context, private_key, utc_now, crl_start_time, crl_next_update, first_number, last_revoked_certificate_id, job_count):
+    partitions = section.partitions
+
+    numbers = [ first_number + partition for partition in range(partitions.count) ]
+
+    job_count = max(1, min(job_count, partitions.count))
+
+    with timings.phase("crypto.sign_partitions"):
+        results = common.run_with_signing_pool(
+            init_partition_worker,
+            (section, authority_context, utc_now, crl_start_time, crl_next_update, last_revoked_certificate_id),
+            private_key,
+            sign_partition_crl,
+            numbers,
+            range(partitions.count),
+            jobs = job_count
+        )
+
+    for partition in range(partitions.count):
+        crl_bytes, revoked_count = results[partition]
+        crl = x509.load_der_x509_crl(crl_bytes, default_backend())
+
+        dbaccess.add_crl_to_db(crl, utc_now, last_revoked_certificate_id, crl_partition = partition)
+
+        print_crl_summary(
+            numbers[partition],
+            crl_start_time,
+            crl_next_update,
+            revoked_count,
+            crl_partition = partition
+        )
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--section",
+        help = "Section name to use"
+    )
+
+    parser.add_argument(
+        "--delta",
+        action = "store_true",
+        help = "Generate a delta CRL against the latest base CRL"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type = int,
+        help = "Number of processes used to sign partitioned CRLs (defaults to the CPU count)"
+    )
+
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    context_name = "delta_revocation_list" if args.delta else "revocation_list"
+    section = config.get_section_for_context(context_name, args.section)
+    if not isinstance(section, config.RevocationList):
+        raise Exception("Wrong section kind for generating revocation list.")
+
+    utc_now = utils.utc_now()
+    crl_start_time = utils.floor_time_minute(utc_now)
+    crl_next_update = crl_start_time + section.duration
+
+    # Bounds the entries to the revocations committed so far, so the next
+    # delta CRL picks up the ones committed while this CRL is generated.
+    last_revoked_certificate_id = dbaccess.get_last_revoked_certificate_id()
 
+    base_crl = None
+    if args.delta:
+        base_crl = dbaccess.find_latest_base_crl()
+        if base_crl is None:
+            print("Cannot generate a delta CRL without a base CRL.")
+            sys.exit(1)
 
+        revocation_list_contents = dbaccess.iter_crl_entries(
+            utc_now,
+            base_revoked_certificate_id = base_crl[2],
+            last_revoked_certificate_id = last_revoked_certificate_id
+        )
+    else:
+        revocation_list_contents = dbaccess.iter_crl_entries(utc_now, last_revoked_certificate_id = last_revoked_certificate_id)
+
+    revocation_list_contents = timings.timed_iter("db.crl_entries", revocation_list_contents)
+
+    number = dbaccess.get_next_crl_number()
+
+    authority_context = authority.get_authority_context()
+    private_key = common.load_private_key()
+    public_key = private_key.public_key()
+
+    builder = make_crl_builder(
+        section,
+        authority_context,
+        public_key,
+        crl_start_time,
+        crl_next_update,
+        number,
+        base_crl_number = None if base_crl is None else base_crl[0]
+    )
+
+    hash_algorithm = utils.hash_algorithm_name_to_instance(section.signature_algorithm)
+    with timings.phase("crypto.sign_template"):
+        template = crlenc.CrlTemplate(builder, private_key, hash_algorithm)
+
+    # The entries are streamed from the database into the CRL file, the
+    # template CRL carrying the same number and dates for the bookkeeping.
+    revoked_count = template.write_streamed_crl(
+        revocation_list_contents,
+        common.make_crl_path(template.template_crl)
+    )
+
+    dbaccess.add_crl_to_db(template.template_crl, utc_now, last_revoked_certificate_id)
+
+    print_crl_summary(
+        number,
+        crl_start_time,
+        crl_next_update,
+        revoked_count,
+        base_crl = base_crl
+    )
+
+    # The complete CRL above stays the reference for certificates issued
+    # before partitioning and for delta CRLs.
+    if base_crl is None and not section.partitions is None:
+        generate_partition_crls(
+            section,
+            authority_context,
+            private_key,
+            utc_now,
+            crl_start_time,
+            crl_next_update,
+            number + 1,
+            last_revoked_certificate_id,
+            args.jobs if not args.jobs is None else (os.cpu_count() or 1)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,7 @@ from cryptography.hazmat.primitives import serialization
 from mini_py_ca import common
 from mini_py_ca import utils
 from mini_py_ca import config
+from mini_py_ca import timings
 
 def main():
     parser = argparse.ArgumentParser()
@@ -34,15 +35,18 @@ def main():
         help = "Algorithm of the generated key"
     )
 
+    timings.add_arguments(parser)
     args = parser.parse_args()
+    timings.start(parser, args)
 
     key_size = args.size
 
-    private_key = rsa.generate_private_key(
-        public_exponent = 65537,
-        key_size = key_size,
-        backend = default_backend()
-    )
+    with timings.phase("crypto.generate_key"):
+        private_key = rsa.generate_private_key(
+            public_exponent = 65537,
+            key_size = key_size,
+            backend = default_backend()
+        )
 
     key_encryption = serialization.NoEncryption()
     if args.encrypt:
@@ -55,7 +59,8 @@ def main():
         encryption_algorithm = key_encryption
     )
 
-    utils.write_all_bytes(common.get_current_private_key_path(), serialized_private_key)
+    with timings.phase("disk.write_key"):
+        utils.write_all_bytes(common.get_current_private_key_path(), serialized_private_key)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import argparse
+import base64
+import os
+import shutil
+import time
+
+from cryptography.hazmat.primitives import hashes
+
+from mini_py_ca import authority
+from mini_py_ca import config
+from mini_py_ca import common
+from mini_py_ca import dbaccess
+from mini_py_ca import ocspresp
+from mini_py_ca import timings
+from mini_py_ca import utils
+
+
+def make_response_path(output_dir, request_bytes):
+    # Static servers decode the GET path before mapping it to a file, so the
+    # slashes of the base64 request make up directories (and, as with merged
+    # slashes, empty segments are dropped).
+    segments = base64.b64encode(request_bytes).decode("ascii").split("/")
+
+    return os.path.join(output_dir, *[ segment for segment in segments if len(segment) > 0 ])
+
+def write_response(output_dir, request_bytes, serial, response_bytes):
+    response_path = make_response_path(output_dir, request_bytes)
+    os.makedirs(os.path.dirname(response_path), exist_ok = True)
+
+    temp_path = response_path + ".tmp"
+    utils.write_all_bytes(temp_path, response_bytes)
+    os.replace(temp_path, response_path)
+
+    byserial_dir = os.path.join(output_dir, "byserial")
+    byserial_path = os.path.join(byserial_dir, utils.format_serial(serial) + ".der")
+
+    if os.name == "nt":
+        shutil.copyfile(response_path, byserial_path)
+    elif not os.path.lexists(byserial_path):
+        os.symlink(os.path.relpath(response_path, byserial_dir), byserial_path)
+
+# State shared by the signing workers, set once per process by init_worker.
+worker_state = None
+
+def init_worker(private_key_bytes, section, authority_context, output_dir, now):
+    global worker_state
+
+    private_key = common.load_signing_pool_key(private_key_bytes)
+
+    responder = ocspresp.OcspResponder(section, authority_context, private_key)
+    issuer_hashes = responder.get_issuer_hashes(hashes.SHA1())
+
+    worker_state = (responder, issuer_hashes, output_dir, now)
+
+def sign_records(records):
+    responder, issuer_hashes, output_dir, now = worker_state
+    algorithm = hashes.SHA1()
+
+    results = []
+    for record in records:
+        response = responder.sign_response(record.serial, record, algorithm, now)
+
+        request_bytes = ocspresp.encode_sha1_request(issuer_hashes[0], issuer_hashes[1], record.serial)
+        write_response(output_dir, request_bytes, record.serial, response.der)
+
+        results.append((record.id, record.is_revoked, response.this_update, response.refresh_time))
+
+    return results
+
+def split_chunks(items, chunk_size):
+    return [ items[i:i + chunk_size] for i in range(0, len(items), chunk_size) ]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--section",
+        help = "Section name to use"
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        default = "ocsp",
+        help = "Directory receiving the responses, laid out by GET request path"
+    )
+
+    parser.add_argument(
+        "--full",
+        action = "store_true",
+        help = "Sign the responses of every active certificate again"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type = int,
+        help = "Number of processes used to sign the responses (defaults to the CPU count)"
+    )
+
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    section = config.get_section_for_context("ocsp_response", args.section)
+    if not isinstance(section, config.OcspResponse):
+        raise Exception("Wrong section kind for generating OCSP responses.")
+
+    now = utils.utc_now()
+    with timings.phase("db.certificates"):
+        records = list(dbaccess.iter_certificates_for_static_ocsp(now, include_current = args.full))
+
+    if len(records) < 1:
+        print("All OCSP responses are up to date.")
+        return
+
+    private_key = common.load_private_key()
+
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(os.path.join(output_dir, "byserial"), exist_ok = True)
+
+    job_count = args.jobs if not args.jobs is None else (os.cpu_count() or 1)
+    job_count = max(1, min(job_count, len(records)))
+
+    start_time = time.perf_counter()
+
+    results = []
+    with timings.phase("crypto.sign_responses"):
+        chunks = [ records ]
+        if job_count > 1:
+            chunks = split_chunks(records, max(1, min(1000, len(records) // (job_count * 4))))
+
+        for chunk_results in common.run_with_signing_pool(
+            init_worker,
+            (section, authority.get_authority_context(), output_dir, now),
+            private_key,
+            sign_records,
+            chunks,
+            jobs = job_count
+        ):
+            results.extend(chunk_results)
+
+    dbaccess.record_static_ocsp_responses(results)
+
+    elapsed = time.perf_counter() - start_time
+    revoked_count = len([ result for result in results if result[1] ])
+
+    msg_format = "Signed {0} OCSP response(s) ({1} revoked) with {2} job(s) in {3:.3f}s:\n" + \
+        " - valid on {4}\n" + \
+        " - expiring on {5}"
+
+    print(msg_format.format(
+        len(results),
+        revoked_count,
+        job_count,
+        elapsed,
+        utils.floor_time_minute(now).astimezone(tz = None),
+        (utils.floor_time_minute(now) + section.duration).astimezone(tz = None)
+    ))
+
+
+if __name__ == "__main__":
+    main()
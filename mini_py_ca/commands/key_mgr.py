@@ -10,6 +10,7 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import serialization
 
 from mini_py_ca import common
+from mini_py_ca import timings
 from mini_py_ca import utils
 
 
@@ -21,7 +22,9 @@ def main():
         help = 'The operation on the key'
     )
 
+    timings.add_arguments(parser)
     args = parser.parse_args()
+    timings.start(parser, args)
 
     private_key_path = common.get_current_private_key_path()
     private_key_bytes = utils.read_all_bytes(private_key_path)
@@ -54,9 +57,10 @@ def main():
         encryption_algorithm = key_encryption
     )
 
-    temp_private_key_path = common.get_temp_private_key_path()
-    utils.write_all_bytes(temp_private_key_path, serialized_private_key)
-    os.replace(temp_private_key_path, private_key_path)
+    with timings.phase("disk.write_key"):
+        temp_private_key_path = common.get_temp_private_key_path()
+        utils.write_all_bytes(temp_private_key_path, serialized_private_key)
+        os.replace(temp_private_key_path, private_key_path)
 
     print("Key " + args.operation + "ed successfully.")
 
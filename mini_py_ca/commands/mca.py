@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import importlib
+import sys
+
+
+# Modules of the subcommands, only the one invoked being imported. The
+# mca-<subcommand> scripts remain as aliases.
+subcommand_modules = {
+    "gen-key": "gen_key",
+    "key-mgr": "key_mgr",
+    "gen-ca-cert": "gen_ca_cert",
+    "sign-csr": "sign_csr",
+    "revoke-cert": "revoke_cert",
+    "gen-crl": "gen_crl",
+    "active-certs": "active_certificates",
+    "ocsp-server": "ocsp_server",
+    "gen-ocsp": "gen_ocsp",
+    "cert-store": "cert_store",
+    "compile-config": "compile_config",
+    "renew": "renew",
+    "revocation-journal": "revocation_journal",
+    "metrics": "metrics",
+    "publish": "publish",
+}
+
+def print_usage(file):
+    print("usage: mca <subcommand> [arguments]\n\nsubcommands:", file = file)
+
+    for name in subcommand_modules.keys():
+        print("  " + name, file = file)
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        print_usage(sys.stdout if len(sys.argv) >= 2 else sys.stderr)
+        sys.exit(0 if len(sys.argv) >= 2 else 2)
+
+    subcommand = sys.argv[1]
+    if not subcommand in subcommand_modules:
+        print("mca: unknown subcommand '" + subcommand + "'.\n", file = sys.stderr)
+        print_usage(sys.stderr)
+        sys.exit(2)
+
+    module = importlib.import_module("mini_py_ca.commands." + subcommand_modules[subcommand])
+
+    # Lets argparse show 'mca <subcommand>' in its messages.
+    sys.argv = [ "mca " + subcommand ] + sys.argv[2:]
+
+    module.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import os
+import sys
+
+from mini_py_ca import common
+from mini_py_ca import dbaccess
+from mini_py_ca import timings
+from mini_py_ca import utils
+
+
+crl_kind_prefixes = {
+    "complete": "",
+    "delta": "delta_",
+}
+
+class MetricsWriter:
+    # Prometheus text exposition format, as read by the textfile collector of
+    # node_exporter.
+    def __init__(self):
+        self.lines = []
+
+    def add(self, name, kind, help_text, samples):
+        self.lines.append("# HELP {0} {1}".format(name, help_text))
+        self.lines.append("# TYPE {0} {1}".format(name, kind))
+
+        for labels, value in samples:
+            label_text = ""
+            if len(labels) > 0:
+                label_text = "{" + ",".join([ "{0}=\"{1}\"".format(key, label_value) for key, label_value in labels ]) + "}"
+
+            self.lines.append("{0}{1} {2}".format(name, label_text, format_value(value)))
+
+    def get_text(self):
+        return "\n".join(self.lines) + "\n"
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+
+    return str(value)
+
+def to_seconds(value):
+    return utils.to_timestamp_milis(value) / 1000.0
+
+def collect_metrics(utc_now, expiring_days):
+    writer = MetricsWriter()
+
+    expiring_before = utc_now + datetime.timedelta(days = expiring_days)
+    issued_total, revoked_total, active_count, revoked_count, expiring_count = dbaccess.get_certificate_counts(utc_now, expiring_before)
+
+    writer.add("mca_certificates_issued_total", "counter", "Certificates issued by the authority.", [ ((), issued_total) ])
+    writer.add("mca_certificates_revoked_total", "counter", "Certificates revoked by the authority.", [ ((), revoked_total) ])
+    writer.add("mca_certificates_active", "gauge", "Certificates neither expired nor revoked.", [ ((), active_count) ])
+    writer.add("mca_certificates_revoked", "gauge", "Revoked certificates not expired yet, as listed in the CRL.", [ ((), revoked_count) ])
+    writer.add(
+        "mca_certificates_expiring",
+        "gauge",
+        "Certificates neither expired nor revoked expiring within the number of days.",
+        [ ((("days", str(expiring_days)),), expiring_count) ]
+    )
+
+    numbers = []
+    last_updates = []
+    next_updates = []
+    countdowns = []
+    sizes = []
+    for kind, number, update_date, next_update_date in dbaccess.get_crl_summaries():
+        labels = (("kind", kind),)
+
+        numbers.append((labels, number))
+        last_updates.append((labels, to_seconds(update_date)))
+        next_updates.append((labels, to_seconds(next_update_date)))
+        countdowns.append((labels, (next_update_date - utc_now).total_seconds()))
+
+        crl_path = common.make_crl_path_from_values(number, next_update_date, crl_kind_prefixes[kind])
+        if os.path.exists(crl_path):
+            sizes.append((labels, os.path.getsize(crl_path)))
+
+    if len(numbers) > 0:
+        writer.add("mca_crl_number", "gauge", "Number of the latest CRL.", numbers)
+        writer.add("mca_crl_last_update_timestamp_seconds", "gauge", "thisUpdate of the latest CRL.", last_updates)
+        writer.add("mca_crl_next_update_timestamp_seconds", "gauge", "nextUpdate of the latest CRL.", next_updates)
+        writer.add("mca_crl_next_update_seconds", "gauge", "Seconds until the nextUpdate of the latest CRL, negative once it is past.", countdowns)
+
+    if len(sizes) > 0:
+        writer.add("mca_crl_size_bytes", "gauge", "Size of the file of the latest CRL.", sizes)
+
+    return writer.get_text()
+
+def write_textfile(path, text):
+    # The collector may read the file at any time, so it is replaced at once.
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        file.write(text)
+
+    os.replace(temp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--output",
+        help = "The .prom file of the node_exporter textfile directory to write, stdout by default"
+    )
+
+    parser.add_argument(
+        "--expiring-days",
+        type = int,
+        default = 30,
+        help = "Window of the expiring certificates count, in days"
+    )
+
+    parser.add_argument(
+        "--rebuild",
+        action = "store_true",
+        help = "Recompute the counters from the certificate, revocation and CRL tables first"
+    )
+
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    if args.rebuild:
+        with timings.phase("db.rebuild_metrics"):
+            dbaccess.rebuild_metrics()
+
+    with timings.phase("db.metrics"):
+        text = collect_metrics(utils.utc_now(), args.expiring_days)
+
+    if args.output is None:
+        sys.stdout.write(text)
+        return
+
+    with timings.phase("disk.write_metrics"):
+        write_textfile(args.output, text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import base64
+import time
+import urllib.parse
+
+from mini_py_ca import authority
+from mini_py_ca import config
+from mini_py_ca import common
+from mini_py_ca import dbaccess
+from mini_py_ca import der
+from mini_py_ca import ocspresp
+from mini_py_ca import timings
+from mini_py_ca import utils
+
+from cryptography.hazmat.primitives import hashes
+
+
+ocsp_response_content_type = "application/ocsp-response"
+max_request_size = 64 * 1024
+
+status_lines = {
+    200: "200 OK",
+    405: "405 Method Not Allowed",
+    413: "413 Payload Too Large",
+}
+
+def decode_base64_request(encoded_request):
+    try:
+        request_bytes = base64.b64decode(encoded_request + "=" * (-len(encoded_request) % 4), validate = True)
+    except ValueError:
+        return None
+
+    # Only a whole DER SEQUENCE, so that a part of the path is not taken for
+    # the request.
+    try:
+        tag, value_start, value_end = der.read_tlv(request_bytes, 0)
+    except IndexError:
+        return None
+
+    if tag != der.tag_sequence or value_end != len(request_bytes):
+        return None
+
+    return request_bytes
+
+def decode_get_request(target):
+    # RFC 6960 A.1: the path ends with the URL encoding of the base64
+    # encoding of the DER request, so the request is the last segment of the
+    # path wherever the responder is published. Some clients leave the
+    # slashes of the base64 encoding as they are, so the path is tried from
+    # each of its slashes, the longest first, as the end of the request is
+    # itself a DER SEQUENCE.
+    path = urllib.parse.urlsplit(target).path
+    segments = path.split("/")
+
+    for i in range(1, len(segments)):
+        request_bytes = decode_base64_request(urllib.parse.unquote("/".join(segments[i:])))
+        if not request_bytes is None:
+            return request_bytes
+
+    return None
+
+class OcspHttpServer:
+    def __init__(self, responder):
+        self.responder = responder
+        self.request_count = 0
+
+    def handle_request(self, method, target, body):
+        request_bytes = None
+        if method == "GET":
+            request_bytes = decode_get_request(target)
+        elif method == "POST":
+            request_bytes = body
+        else:
+            return (405, "text/plain", b"Method not allowed.\n", [])
+
+        if request_bytes is None or len(request_bytes) < 1:
+            return (200, ocsp_response_content_type, ocspresp.malformed_request_response, [])
+
+        self.request_count = self.request_count + 1
+
+        now = utils.utc_now()
+        with timings.phase("ocsp.respond"):
+            response = self.responder.respond(request_bytes, now)
+        if response is None:
+            return (200, ocsp_response_content_type, ocspresp.unauthorized_response, [])
+
+        extra_headers = []
+        if method == "GET":
+            # RFC 5019 5: lets caches keep GET responses until they are refreshed.
+            max_age = max(0, int((response.refresh_time - now).total_seconds()))
+            extra_headers.append("Cache-Control: max-age={0:d}, public, no-transform, must-revalidate".format(max_age))
+
+        return (200, ocsp_response_content_type, response.der, extra_headers)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if len(request_line) < 1:
+                    break
+
+                parts = request_line.decode("latin-1").split()
+                if len(parts) != 3:
+                    break
+
+                method, target, version = parts
+
+                headers = dict()
+                while True:
+                    header_line = await reader.readline()
+                    if header_line in (b"\r\n", b"\n", b""):
+                        break
+
+                    name, _, value = header_line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                content_length = int(headers.get("content-length", "0"))
+                if content_length > max_request_size:
+                    await self.write_response(writer, 413, "text/plain", b"Request too large.\n", [], False)
+                    break
+
+                body = b""
+                if content_length > 0:
+                    body = await reader.readexactly(content_length)
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                if version == "HTTP/1.0":
+                    keep_alive = headers.get("connection", "").lower() == "keep-alive"
+
+                status, content_type, content, extra_headers = self.handle_request(method, target, body)
+                await self.write_response(writer, status, content_type, content, extra_headers, keep_alive)
+
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_response(self, writer, status, content_type, content, extra_headers, keep_alive):
+        header_lines = [
+            "HTTP/1.1 " + status_lines[status],
+            "Content-Type: " + content_type,
+            "Content-Length: {0:d}".format(len(content)),
+            "Connection: " + ("keep-alive" if keep_alive else "close"),
+        ] + extra_headers
+
+        writer.write(("\r\n".join(header_lines) + "\r\n\r\n").encode("latin-1") + content)
+        await writer.drain()
+
+async def maintain_cache(responder, poll_interval):
+    while True:
+        await asyncio.sleep(poll_interval)
+
+        with timings.phase("ocsp.maintain"):
+            revoked_count = responder.poll_revocations()
+
+        # Refreshes in batches, letting the pending requests through between
+        # them rather than signing the whole cache at once.
+        now = utils.utc_now()
+        refreshed_count = 0
+        while True:
+            with timings.phase("ocsp.refresh"):
+                batch_count = responder.refresh_due(now)
+
+            refreshed_count = refreshed_count + batch_count
+            if batch_count < ocspresp.refresh_batch_size:
+                break
+
+            await asyncio.sleep(0)
+
+        if revoked_count > 0 or refreshed_count > 0:
+            print("Picked up {0} revocation(s), signed {1} response(s) again.".format(revoked_count, refreshed_count))
+
+async def serve(responder, host, port, poll_interval):
+    server = OcspHttpServer(responder)
+
+    tcp_server = await asyncio.start_server(server.handle_connection, host, port)
+    maintenance_task = asyncio.ensure_future(maintain_cache(responder, poll_interval))
+
+    print("Serving OCSP on {0}:{1}.".format(host, port))
+
+    try:
+        async with tcp_server:
+            await tcp_server.serve_forever()
+    finally:
+        maintenance_task.cancel()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--section",
+        help = "Section name to use"
+    )
+
+    parser.add_argument(
+        "--host",
+        default = "127.0.0.1",
+        help = "Address to listen on"
+    )
+
+    parser.add_argument(
+        "--port",
+        type = int,
+        default = 8080,
+        help = "Port to listen on"
+    )
+
+    parser.add_argument(
+        "--poll-interval",
+        type = float,
+        default = 1.0,
+        help = "Seconds between checks for new revocations and due responses"
+    )
+
+    parser.add_argument(
+        "--no-presign",
+        action = "store_true",
+        help = "Do not sign responses for every active certificate at startup"
+    )
+
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    section = config.get_section_for_context("ocsp_response", args.section)
+    if not isinstance(section, config.OcspResponse):
+        raise Exception("Wrong section kind for answering OCSP requests.")
+
+    private_key = common.load_private_key()
+
+    responder = ocspresp.OcspResponder(section, authority.get_authority_context(), private_key)
+    dbaccess.revocation_listeners.append(responder.on_revocation)
+
+    if not args.no_presign:
+        start_time = time.perf_counter()
+        with timings.phase("crypto.presign"):
+            count = responder.presign(timings.timed_iter("db.certificates", dbaccess.iter_active_certificates()), hashes.SHA1())
+
+        print("Signed responses for {0} active certificate(s) in {1:.3f}s.".format(
+            count,
+            time.perf_counter() - start_time
+        ))
+
+    try:
+        asyncio.run(serve(responder, args.host, args.port, args.poll_interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import urllib.parse
+
+from cryptography.hazmat.primitives import serialization
+
+from mini_py_ca import authority
+from mini_py_ca import config
+from mini_py_ca import common
+from mini_py_ca import dbaccess
+from mini_py_ca import der
+from mini_py_ca import timings
+from mini_py_ca import utils
+
+
+manifest_name = "manifest.json"
+manifest_version = 1
+
+pem_chunk_size = 1024 * 1024
+
+# Content types of RFC 2585 and RFC 5751 3.2.1.
+crl_content_type = "application/pkix-crl"
+certificate_content_type = "application/pkix-cert"
+certs_only_content_type = "application/pkcs7-mime"
+
+signed_data_oid = "1.2.840.113549.1.7.2"
+data_oid = "1.2.840.113549.1.7.1"
+
+class Artifact:
+    def __init__(self, name, content_type, source, chunks):
+        self.name = name
+        self.content_type = content_type
+        self.source = source
+        self.chunks = chunks
+
+def find_extension(section, name):
+    if section is None:
+        return None
+
+    for ext_config in section.extensions:
+        if ext_config.name == name:
+            return ext_config
+
+    return None
+
+def get_uri_file_name(general_name):
+    for name_type, value in general_name.items():
+        if name_type.lower() == "uri":
+            file_name = os.path.basename(urllib.parse.urlsplit(value).path)
+            if len(file_name) > 0:
+                return file_name
+
+    return None
+
+def get_distribution_point_file_name(section, extension_name):
+    ext_config = find_extension(section, extension_name)
+    if ext_config is None:
+        return None
+
+    for point in ext_config.dict.get("distributionPoints", []):
+        for general_name in point.get("fullName", []):
+            file_name = get_uri_file_name(general_name)
+            if not file_name is None:
+                return file_name
+
+    return None
+
+def get_ca_issuers_file_names(section):
+    # The caIssuers URIs point to the .cer and .p7c files, the one not
+    # configured being named after the other.
+    certificate_name = None
+    bundle_name = None
+
+    ext_config = find_extension(section, "authorityInfoAccess")
+    if not ext_config is None:
+        for desc in ext_config.dict.get("accessDescriptions", []):
+            if not "caIssuers" in desc:
+                continue
+
+            file_name = get_uri_file_name(desc["caIssuers"])
+            if file_name is None:
+                continue
+
+            if file_name.endswith(".p7c"):
+                bundle_name = bundle_name or file_name
+            else:
+                certificate_name = certificate_name or file_name
+
+    if certificate_name is None:
+        certificate_name = "ca.cer" if bundle_name is None else os.path.splitext(bundle_name)[0] + ".cer"
+
+    if bundle_name is None:
+        bundle_name = os.path.splitext(certificate_name)[0] + ".p7c"
+
+    return (certificate_name, bundle_name)
+
+def iter_pem_der(path):
+    # Decodes PEM files a chunk of lines at a time, as CRLs can be large.
+    with open(path, "rb") as file:
+        lines = file.readlines(pem_chunk_size)
+        while len(lines) > 0:
+            yield base64.b64decode(b"".join([ line.strip() for line in lines if not line.startswith(b"-----") ]))
+            lines = file.readlines(pem_chunk_size)
+
+def encode_certs_only(certificates_der):
+    # The 'certs-only' CMS message of RFC 2797 2.2, a SignedData without
+    # content nor signers, the certificates being a SET OF in DER order.
+    signed_data = der.encode_sequence(
+        der.encode_integer(1),
+        der.encode_set_of(),
+        der.encode_sequence(der.encode_oid(data_oid)),
+        der.encode_tlv(der.tag_context_0, b"".join(sorted(certificates_der))),
+        der.encode_set_of()
+    )
+
+    return der.encode_sequence(
+        der.encode_oid(signed_data_oid),
+        der.encode_tlv(der.tag_context_0, signed_data)
+    )
+
+def get_authority_certificates_der():
+    # Every authority certificate still valid, so relying parties find the
+    # previous authority during a rollover.
+    conn = dbaccess.get_connection()
+
+    certificates_der = []
+    for record in dbaccess.iter_active_certificates(self_signed = True):
+        certificate_der = dbaccess.get_certificate_der(conn, record.formatted_serial)
+        if certificate_der is None:
+            certificate_der = dbaccess.load_certificate_by_serial(record.formatted_serial).public_bytes(serialization.Encoding.DER)
+
+        certificates_der.append(certificate_der)
+
+    return certificates_der
+
+def collect_artifacts(sign_section, crl_section):
+    artifacts = []
+
+    crl_name = get_distribution_point_file_name(sign_section, "crlDistributionPoints") or "ca.crl"
+    delta_crl_name = get_distribution_point_file_name(crl_section, "freshestCRL") or \
+        get_distribution_point_file_name(sign_section, "freshestCRL") or \
+        os.path.splitext(crl_name)[0] + "-delta.crl"
+
+    crl_names = {
+        "complete": (crl_name, ""),
+        "delta": (delta_crl_name, "delta_"),
+    }
+
+    for kind, number, update_date, next_update_date in dbaccess.get_crl_summaries():
+        name, kind_prefix = crl_names[kind]
+        crl_path = common.make_crl_path_from_values(number, next_update_date, kind_prefix)
+
+        if not os.path.exists(crl_path):
+            print("MISSING   {0}: CRL file '{1}' does not exist".format(name, crl_path))
+            continue
+
+        artifacts.append(Artifact(name, crl_content_type, "CRL {0}".format(number), iter_pem_der(crl_path)))
+
+    partitions = None if crl_section is None else crl_section.partitions
+    if not partitions is None:
+        for partition, number, next_update_date in dbaccess.find_latest_partition_crls():
+            name = os.path.basename(urllib.parse.urlsplit(partitions.uri_for_partition(partition)).path)
+            crl_path = common.make_crl_path_from_values(number, next_update_date, "p{0:d}_".format(partition))
+
+            if not os.path.exists(crl_path):
+                print("MISSING   {0}: CRL file '{1}' does not exist".format(name, crl_path))
+                continue
+
+            artifacts.append(Artifact(name, crl_content_type, "CRL {0}".format(number), iter_pem_der(crl_path)))
+
+    certificate_name, bundle_name = get_ca_issuers_file_names(sign_section)
+    authority_context = authority.get_authority_context()
+
+    artifacts.append(Artifact(
+        certificate_name,
+        certificate_content_type,
+        "certificate " + authority_context.serial,
+        [ authority_context.certificate_der ]
+    ))
+
+    certificates_der = get_authority_certificates_der()
+    artifacts.append(Artifact(
+        bundle_name,
+        certs_only_content_type,
+        "{0} authority certificate(s)".format(len(certificates_der)),
+        [ encode_certs_only(certificates_der) ]
+    ))
+
+    return artifacts
+
+def render_artifact(output_dir, artifact):
+    # Writes the artifact to a temporary file next to its final path, so it
+    # can be renamed over the published one, returning its hash and size.
+    temp_path = os.path.join(output_dir, "." + artifact.name + ".tmp")
+
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, "wb") as file:
+            for chunk in artifact.chunks:
+                file.write(chunk)
+                hasher.update(chunk)
+                size = size + len(chunk)
+
+            file.flush()
+            os.fsync(file.fileno())
+    except:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return (temp_path, hasher.hexdigest(), size)
+
+def publish_artifact(output_dir, artifact, previous_entry):
+    # Returns the manifest entry of the artifact and whether it was replaced.
+    temp_path, digest, size = render_artifact(output_dir, artifact)
+    path = os.path.join(output_dir, artifact.name)
+
+    entry = {
+        "sha256": digest,
+        "etag": "\"" + digest + "\"",
+        "size": size,
+        "content_type": artifact.content_type,
+        "source": artifact.source,
+    }
+
+    is_unchanged = not previous_entry is None and previous_entry.get("sha256") == digest and \
+        os.path.exists(path) and os.path.getsize(path) == size
+
+    if is_unchanged:
+        os.remove(temp_path)
+        return (entry, False)
+
+    os.replace(temp_path, path)
+    return (entry, True)
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as file:
+        manifest = json.load(file)
+
+    if manifest.get("version") != manifest_version:
+        raise Exception("Unsupported publication manifest version in '" + path + "'.")
+
+    return manifest
+
+def write_manifest(path, manifest):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump(manifest, file, indent = 2, sort_keys = True)
+        file.write("\n")
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(temp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--section",
+        help = "Section name of the signed certificates, whose distribution point and caIssuers URIs name the files"
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        default = "publish",
+        help = "Directory receiving the published files and their manifest"
+    )
+
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    sign_section = config.get_section_for_context("sign_request", args.section)
+    if not isinstance(sign_section, config.SignRequest):
+        raise Exception("Wrong section kind for publishing.")
+
+    crl_section = config.find_section_for_context("revocation_list")
+    if not crl_section is None and not isinstance(crl_section, config.RevocationList):
+        raise Exception("Wrong section kind for revocation lists.")
+
+    utc_now = utils.utc_now()
+
+    output_dir = os.path.abspath(args.output_dir)
+    os.makedirs(output_dir, exist_ok = True)
+
+    manifest_path = os.path.join(output_dir, manifest_name)
+    previous_manifest = load_manifest(manifest_path)
+    previous_files = dict() if previous_manifest is None else previous_manifest["files"]
+
+    with timings.phase("db.artifacts"):
+        artifacts = collect_artifacts(sign_section, crl_section)
+
+    files = dict()
+    changed_count = 0
+    for artifact in artifacts:
+        if artifact.name in files:
+            raise Exception("Two published files are named '" + artifact.name + "'.")
+
+        with timings.phase("disk.publish"):
+            entry, is_changed = publish_artifact(output_dir, artifact, previous_files.get(artifact.name))
+
+        files[artifact.name] = entry
+
+        if is_changed:
+            changed_count = changed_count + 1
+
+        print("{0:9} {1}: {2}, sha256 {3}".format(
+            "UPDATED" if is_changed else "UNCHANGED",
+            artifact.name,
+            artifact.source,
+            entry["sha256"]
+        ))
+
+    # The manifest changes with the files, so mirrors polling it only fetch
+    # the files whose hash differs from their copy.
+    if changed_count > 0 or previous_manifest is None or files != previous_files:
+        write_manifest(manifest_path, {
+            "version": manifest_version,
+            "updated": utc_now.isoformat(),
+            "files": files,
+        })
+
+    print("Published {0} file(s) to '{1}', {2} updated.".format(len(files), output_dir, changed_count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import datetime
+import os
+import sys
+import time
+
+from cryptography import x509
+from cryptography.x509.oid import ExtensionOID
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+from mini_py_ca import authority
+from mini_py_ca import config
+from mini_py_ca import common
+from mini_py_ca import dbaccess
+from mini_py_ca import timings
+from mini_py_ca import utils
+from mini_py_ca.commands import sign_csr
+
+
+# Extensions of the renewed certificate that the authority set itself, built
+# again from the section rather than copied.
+authority_extension_oids = set([
+    ExtensionOID.AUTHORITY_KEY_IDENTIFIER,
+    ExtensionOID.SUBJECT_KEY_IDENTIFIER,
+    ExtensionOID.CRL_DISTRIBUTION_POINTS,
+    ExtensionOID.FRESHEST_CRL,
+    ExtensionOID.AUTHORITY_INFORMATION_ACCESS,
+])
+
+class RenewalRequest:
+    # Stands for the certificate request in sign_csr.build_certificate, with
+    # the subject, public key and requested extensions of the renewed
+    # certificate.
+    def __init__(self, certificate):
+        self.subject = certificate.subject
+        self.certificate = certificate
+        self.extensions = [ ext for ext in certificate.extensions if not ext.oid in authority_extension_oids ]
+
+    def public_key(self):
+        return self.certificate.public_key()
+
+class RenewalResult:
+    def __init__(self, record, certificate = None, error = None):
+        self.record = record
+        self.certificate = certificate
+        self.error = error
+
+def renew_batch_item(certificate_der, serial_number, not_before, not_after):
+    # Runs with the state set by sign_csr.init_batch_worker.
+    section, crl_partitions, authority_context, authority_private_key = sign_csr.batch_worker_state
+
+    try:
+        renewed_certificate = x509.load_der_x509_certificate(certificate_der, default_backend())
+
+        certificate = sign_csr.build_certificate(
+            RenewalRequest(renewed_certificate),
+            section,
+            authority_context,
+            authority_private_key,
+            serial_number,
+            not_before,
+            not_after,
+            crl_partitions
+        )
+
+        return (certificate.public_bytes(serialization.Encoding.DER), None)
+    except Exception as e:
+        return (None, str(e))
+
+def renew_batch(records, section, crl_partitions, authority_context, authority_private_key, not_before, not_after, job_count):
+    conn = dbaccess.get_connection()
+
+    certificates_der = []
+    for record in records:
+        certificate_der = dbaccess.get_certificate_der(conn, record.formatted_serial)
+        if certificate_der is None:
+            certificate_der = dbaccess.load_certificate_by_serial(record.formatted_serial).public_bytes(serialization.Encoding.DER)
+
+        certificates_der.append(certificate_der)
+
+    serials = dbaccess.generate_certificate_serials(len(records))
+
+    raw_results = common.run_with_signing_pool(
+        sign_csr.init_batch_worker,
+        (section, crl_partitions, authority_context),
+        authority_private_key,
+        renew_batch_item,
+        certificates_der,
+        serials,
+        [ not_before ] * len(records),
+        [ not_after ] * len(records),
+        jobs = job_count,
+        chunksize = max(1, len(records) // (job_count * 4))
+    )
+
+    results = []
+    unused_serials = []
+    for record, serial, (certificate_bytes, error) in zip(records, serials, raw_results):
+        if certificate_bytes is None:
+            results.append(RenewalResult(record, error = error))
+            unused_serials.append(serial)
+        else:
+            certificate = x509.load_der_x509_certificate(certificate_bytes, default_backend())
+            results.append(RenewalResult(record, certificate = certificate))
+
+    if len(unused_serials) > 0:
+        dbaccess.release_certificate_serials(unused_serials)
+
+    return results
+
+def store_renewals(results, crl_partitions, write_files = True):
+    renewals = [ (result.record.id, result.certificate) for result in results if result.error is None ]
+
+    written = None
+
+    try:
+        if write_files:
+            written = common.write_certificates_to_disk([ renewal[1] for renewal in renewals ], is_self_signed = False)
+
+        dbaccess.add_renewed_certificates_to_db(renewals, crl_partitions)
+    except:
+        common.remove_written_certificates(written)
+        raise
+
+def write_report(report_path, results):
+    with open(report_path, "w", newline = "") as report:
+        writer = csv.writer(report)
+        writer.writerow([
+            "id",
+            "serial",
+            "subject",
+            "not_after",
+            "renewal_serial",
+            "renewal_not_after",
+            "error"
+        ])
+
+        for result in results:
+            renewal_serial = ""
+            renewal_not_after = ""
+            if result.error is None:
+                renewal_serial = utils.format_serial(result.certificate.serial_number)
+                renewal_not_after = utils.make_utc_datetime_aware(result.certificate.not_valid_after).isoformat()
+
+            writer.writerow([
+                result.record.id,
+                result.record.formatted_serial,
+                result.record.subject,
+                result.record.not_after_date.isoformat(),
+                renewal_serial,
+                renewal_not_after,
+                "" if result.error is None else result.error
+            ])
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--section",
+        help = "Section name to use"
+    )
+
+    parser.add_argument(
+        "--days",
+        type = int,
+        default = 30,
+        help = "Renew the certificates expiring within this number of days"
+    )
+
+    parser.add_argument(
+        "--expiring-before",
+        type = utils.parse_datetime,
+        help = "Renew the certificates expiring before this ISO 8601 date instead, local time unless an offset is given"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type = int,
+        help = "Number of processes used to sign the renewals (defaults to the CPU count)"
+    )
+
+    parser.add_argument(
+        "--no-files",
+        action = "store_true",
+        help = "Only record the certificates in the database, 'mca-cert-store export' writes the files on demand"
+    )
+
+    parser.add_argument(
+        "--report",
+        help = "CSV file receiving the renewed and renewal serials"
+    )
+
+    parser.add_argument(
+        "--dry-run",
+        action = "store_true",
+        help = "Only list the certificates that would be renewed"
+    )
+
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    section = config.get_section_for_context("sign_request", args.section)
+    if not isinstance(section, config.SignRequest):
+        raise Exception("Wrong section kind for renewing certificates.")
+
+    current_time = utils.utc_now()
+    not_before = utils.floor_time_minute(current_time)
+    not_after = not_before + section.duration
+
+    expiring_before = args.expiring_before
+    if expiring_before is None:
+        expiring_before = current_time + datetime.timedelta(days = args.days)
+
+    # Renewing a certificate must extend its validity, which also keeps the
+    # renewals of a previous run out of a wide window.
+    expiring_before = min(expiring_before, not_after)
+
+    with timings.phase("db.certificates"):
+        records = list(dbaccess.iter_certificates_expiring_between(current_time, expiring_before))
+
+    if len(records) < 1:
+        print("No certificates expiring before {0} to renew.".format(expiring_before.astimezone(tz = None)))
+        return
+
+    if args.dry_run:
+        for record in records:
+            print("{0} expires on {1} ({2})".format(
+                record.formatted_serial,
+                record.not_after_date.astimezone(tz = None),
+                record.subject
+            ))
+
+        print("Would renew {0} certificate(s).".format(len(records)))
+        return
+
+    crl_partitions = config.get_crl_partitions()
+
+    authority_context = authority.get_authority_context()
+    authority_private_key = common.load_private_key()
+
+    job_count = args.jobs if not args.jobs is None else (os.cpu_count() or 1)
+    job_count = max(1, min(job_count, len(records)))
+
+    start_time = time.perf_counter()
+    with timings.phase("crypto.sign_batch"):
+        results = renew_batch(
+            records,
+            section,
+            crl_partitions,
+            authority_context,
+            authority_private_key,
+            not_before,
+            not_after,
+            job_count
+        )
+    sign_time = time.perf_counter()
+
+    renewed_count = len([ result for result in results if result.error is None ])
+    if renewed_count > 0:
+        store_renewals(results, crl_partitions, not args.no_files)
+    end_time = time.perf_counter()
+
+    for result in results:
+        if result.error is None:
+            print("OK     {0} -> {1} ({2})".format(
+                result.record.formatted_serial,
+                utils.format_serial(result.certificate.serial_number),
+                result.record.subject
+            ))
+        else:
+            print("FAILED {0}: {1}".format(result.record.formatted_serial, result.error))
+
+    if not args.report is None:
+        write_report(args.report, results)
+
+    elapsed = end_time - start_time
+    summary_format = "Renewed {0} of {1} certificate(s) expiring before {2} with {3} job(s):\n" + \
+        " - valid on {4}\n" + \
+        " - expiring on {5}\n" + \
+        " - signing took {6:.3f}s, storing took {7:.3f}s\n" + \
+        " - throughput {8:.1f} certificate(s)/s"
+
+    print(summary_format.format(
+        renewed_count,
+        len(results),
+        expiring_before.astimezone(tz = None),
+        job_count,
+        not_before.astimezone(tz = None),
+        not_after.astimezone(tz = None),
+        sign_time - start_time,
+        end_time - sign_time,
+        renewed_count / elapsed if elapsed > 0 else 0.0
+    ))
+
+    if renewed_count != len(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
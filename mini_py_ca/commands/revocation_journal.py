@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+import time
+
+from mini_py_ca import dbaccess
+from mini_py_ca import timings
+from mini_py_ca import utils
+
+
+class JournalComparison:
+    def __init__(self):
+        self.matched_count = 0
+        self.pending = []
+        self.missing = []
+        self.mismatched = []
+        self.corrupt_offsets = []
+
+    def is_consistent(self):
+        return len(self.missing) + len(self.mismatched) + len(self.corrupt_offsets) == 0
+
+def compare_journal(journal, conn):
+    # Walks the journal and the table together, both being in
+    # revoked_certificate_id order.
+    comparison = JournalComparison()
+
+    rows = dbaccess.iter_revocation_rows(conn)
+    row = next(rows, None)
+
+    last_id = 0
+    for offset, record in journal.scan():
+        if record is None:
+            comparison.corrupt_offsets.append(offset)
+            continue
+
+        if record.revoked_certificate_id <= last_id:
+            raise Exception("Revocation journal out of order at offset {0}.".format(offset))
+
+        last_id = record.revoked_certificate_id
+
+        while not row is None and row[0] < record.revoked_certificate_id:
+            comparison.missing.append(row)
+            row = next(rows, None)
+
+        if not row is None and row[0] == record.revoked_certificate_id:
+            if record.to_row() == tuple(row):
+                comparison.matched_count = comparison.matched_count + 1
+            else:
+                comparison.mismatched.append((record, row))
+
+            row = next(rows, None)
+        else:
+            comparison.pending.append(record)
+
+    while not row is None:
+        comparison.missing.append(row)
+        row = next(rows, None)
+
+    return comparison
+
+def print_comparison(comparison, journal, show_pending):
+    for offset in comparison.corrupt_offsets:
+        print("CORRUPT    record at offset {0}".format(offset))
+
+    for row in comparison.missing:
+        print("MISSING    revocation {0} of certificate id {1} ({2}) is not in the journal".format(row[0], row[1], row[3]))
+
+    for record, row in comparison.mismatched:
+        print("MISMATCH   revocation {0}: journal {1}, database {2}".format(record.revoked_certificate_id, record.to_row(), tuple(row)))
+
+    if show_pending:
+        for record in comparison.pending:
+            print("PENDING    revocation {0} of certificate id {1} ({2}) is not in the database".format(
+                record.revoked_certificate_id,
+                record.issued_certificate_id,
+                utils.format_serial(record.serial)
+            ))
+
+    torn_size = journal.get_torn_size()
+    if torn_size > 0:
+        print("Ignored the torn record of {0} byte(s) at the end of the journal.".format(torn_size))
+
+    msg_format = "{0} journal record(s) match the database, {1} pending replay, " + \
+        "{2} revocation(s) missing from the journal, {3} mismatched, {4} corrupt record(s)."
+
+    print(msg_format.format(
+        comparison.matched_count,
+        len(comparison.pending),
+        len(comparison.missing),
+        len(comparison.mismatched),
+        len(comparison.corrupt_offsets)
+    ))
+
+def dump(journal):
+    print("revoked_certificate_id,issued_certificate_id,revocation_date,serial,reason")
+
+    for offset, record in journal.scan():
+        if record is None:
+            print("# corrupt record at offset {0}".format(offset))
+            continue
+
+        print("{0},{1},{2},{3},{4}".format(
+            record.revoked_certificate_id,
+            record.issued_certificate_id,
+            utils.from_timestamp_milis(record.revocation_date).isoformat(),
+            utils.format_serial(record.serial),
+            record.reason
+        ))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "operation",
+        choices = [ "init", "verify", "replay", "dump" ],
+        help = "The operation on the revocation journal"
+    )
+
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    journal = dbaccess.get_revocation_journal()
+
+    if args.operation == "init":
+        dbaccess.init_revocation_journal()
+        print("Wrote the revocation journal '{0}'.".format(journal.path))
+        return
+
+    if not journal.exists():
+        print("No revocation journal, run 'mca-revocation-journal init' first.")
+        sys.exit(1)
+
+    if args.operation == "dump":
+        dump(journal)
+        return
+
+    conn = dbaccess.get_connection()
+
+    start_time = time.perf_counter()
+    with timings.phase("journal.compare"):
+        comparison = compare_journal(journal, conn)
+
+    if args.operation == "verify":
+        print_comparison(comparison, journal, True)
+        print("Done in {0:.3f}s.".format(time.perf_counter() - start_time))
+
+        if not comparison.is_consistent() or len(comparison.pending) > 0:
+            sys.exit(1)
+
+        return
+
+    applied, skipped = dbaccess.replay_revocations(comparison.pending)
+    comparison.pending = []
+
+    for record, skip_reason in skipped:
+        print("SKIPPED    revocation {0} of certificate id {1}: {2}".format(
+            record.revoked_certificate_id,
+            record.issued_certificate_id,
+            skip_reason
+        ))
+
+    print_comparison(comparison, journal, False)
+    print("Replayed {0} revocation(s), skipped {1}, in {2:.3f}s.".format(
+        len(applied),
+        len(skipped),
+        time.perf_counter() - start_time
+    ))
+
+    if not comparison.is_consistent() or len(skipped) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
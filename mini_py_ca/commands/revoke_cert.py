@@ -5,37 +5,130 @@ import argparse
 import sys
 
 from mini_py_ca import dbaccess
+from mini_py_ca import timings
 from mini_py_ca import utils
 
 
+def read_target_lines(path):
+    # One target per line, '-' reading them from stdin.
+    lines = []
+
+    source = sys.stdin if path == "-" else open(path, "r")
+    try:
+        for line in source:
+            line = line.strip()
+            if len(line) < 1 or line.startswith("#"):
+                continue
+
+            lines.append(line)
+    finally:
+        if not source is sys.stdin:
+            source.close()
+
+    return lines
+
+def parse_serial(value):
+    return int(value.replace(":", ""), 16)
+
+def revoke_bulk(args, certificate_ids):
+    serials = []
+
+    if not args.ids_from is None:
+        certificate_ids = certificate_ids + [ int(line) for line in read_target_lines(args.ids_from) ]
+
+    if not args.serials_from is None:
+        serials = [ parse_serial(line) for line in read_target_lines(args.serials_from) ]
+
+    revoked, skipped = dbaccess.revoke_certificates(
+        utils.utc_now(),
+        certificate_ids = certificate_ids,
+        serials = serials,
+        subject_like = args.subject_like,
+        reason = args.reason,
+        dry_run = args.dry_run
+    )
+
+    for record in revoked:
+        print("{0} id {1}: serial {2} ({3})".format(
+            "WOULD REVOKE" if args.dry_run else "REVOKED",
+            record.id,
+            record.formatted_serial,
+            record.subject
+        ))
+
+    for target, skip_reason in skipped:
+        print("SKIPPED {0}: {1}".format(target, skip_reason))
+
+    print("{0} {1} certificate(s), skipped {2}.".format(
+        "Would revoke" if args.dry_run else "Revoked",
+        len(revoked),
+        len(skipped)
+    ))
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--reason",
-        choices = [ key for key in dbaccess.reason_flag_mapping.keys() ],
+        choices = [ key for key in dbaccess.reason_flag_names.keys() ],
         help = "The (optional) reason for the revocation"
     )
 
+    parser.add_argument(
+        "--ids-from",
+        help = "File listing one certificate id per line to revoke in bulk, '-' for stdin"
+    )
+
+    parser.add_argument(
+        "--serials-from",
+        help = "File listing one hexadecimal serial per line to revoke in bulk, '-' for stdin"
+    )
+
+    parser.add_argument(
+        "--subject-like",
+        help = "Revoke in bulk the certificates whose subject matches this SQL LIKE pattern"
+    )
+
+    parser.add_argument(
+        "--dry-run",
+        action = "store_true",
+        help = "Only report what a bulk revocation would revoke and skip"
+    )
+
     parser.add_argument(
         'certificate_id',
         type = int,
-        help = 'The certificate id to revoke'
+        nargs = "*",
+        help = 'The certificate id to revoke, several ones being revoked in bulk'
     )
 
+    timings.add_arguments(parser)
     args = parser.parse_args()
+    timings.start(parser, args)
+
+    is_bulk = len(args.certificate_id) > 1 or args.dry_run or \
+        not args.ids_from is None or \
+        not args.serials_from is None or \
+        not args.subject_like is None
+
+    if is_bulk:
+        revoke_bulk(args, args.certificate_id)
+        return
 
-    certificate_id = args.certificate_id
+    if len(args.certificate_id) < 1:
+        parser.error("a certificate id, --ids-from, --serials-from or --subject-like is required")
+
+    certificate_id = args.certificate_id[0]
     reason = args.reason
 
     cert = dbaccess.get_certificate_by_id(certificate_id)
     if cert is None:
-        print("Cannot find certificate with id {0}.".format(cert.id))
+        print("Cannot find certificate with id {0}.".format(certificate_id))
         sys.exit(1)
 
     if cert.is_self_signed:
         print("Cannot revoke self-signed certificate id {0}.".format(cert.id))
         sys.exit(1)
-        
+
 
     if cert.is_revoked:
         print("Certificate id {0} is already revoked.".format(cert.id))
@@ -66,4 +159,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
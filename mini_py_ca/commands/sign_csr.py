@@ -2,8 +2,11 @@
 
 import argparse
 import datetime
+import glob
+import os
 import re
 import sys
+import time
 
 from cryptography import x509
 from cryptography.x509.oid import NameOID
@@ -13,49 +16,48 @@ from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives import serialization
 
+from mini_py_ca import authority
 from mini_py_ca import config
 from mini_py_ca import common
 from mini_py_ca import dbaccess
 from mini_py_ca import x509ext
 from mini_py_ca import utils
+from mini_py_ca import timings
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "--section",
-        help = "Section name to use"
-    )
+csr_ext = ".csr"
 
-    parser.add_argument(
-        'csr_file',
-        help = 'The CSR to sign'
-    )
+class BatchResult:
+    def __init__(self, csr_path, certificate = None, error = None):
+        self.csr_path = csr_path
+        self.certificate = certificate
+        self.error = error
 
-    args = parser.parse_args()
+# Extension templates of this process, by section, authority and CRL
+# partition URI.
+extension_templates = dict()
 
-    section = config.get_section_for_context("sign_request", args.section)
-    if not isinstance(section, config.SignRequest):
-        raise Exception("Wrong section kind for signing certificate request.")
+def get_extension_template(section, authority_context, ext_ctx, partition_uri):
+    template_key = (id(section), id(authority_context), partition_uri)
 
-    authority_certificate_serial = dbaccess.find_current_authority_certificate_serial()
-    authority_certificate = common.load_certificate_by_serial(authority_certificate_serial)
+    cached = extension_templates.get(template_key)
+    if not cached is None and cached[0] is section and cached[1] is authority_context:
+        return cached[2]
 
-    request_bytes = utils.read_all_bytes(args.csr_file)
-    request = x509.load_pem_x509_csr(request_bytes, default_backend())
+    extension_config_list = section.extensions
+    if not partition_uri is None:
+        extension_config_list = x509ext.make_partition_distribution_points_config(extension_config_list, partition_uri)
 
-    duration = section.duration
-    hash_algorithm = utils.hash_algorithm_name_to_instance(section.signature_algorithm)
+    template = x509ext.ExtensionTemplate(ext_ctx, extension_config_list)
+    extension_templates[template_key] = (section, authority_context, template)
 
-    current_time = utils.utc_now()
-    not_before = utils.floor_time_minute(current_time)
-    not_after = not_before + duration
+    return template
 
-    authority_private_key = common.load_private_key()
+@timings.timed("crypto.sign_certificate")
+def build_certificate(request, section, authority_context, authority_private_key, serial_number, not_before, not_after, crl_partitions = None):
+    hash_algorithm = utils.hash_algorithm_name_to_instance(section.signature_algorithm)
     authority_public_key = authority_private_key.public_key()
 
-    serial_number = dbaccess.generate_certificate_serial()
-
     builder = x509.CertificateBuilder()
 
     builder = builder.not_valid_before(not_before)
@@ -63,30 +65,35 @@ def main():
     builder = builder.serial_number(serial_number)
 
     builder = builder.subject_name(request.subject)
-    builder = builder.issuer_name(authority_certificate.issuer)
+    builder = builder.issuer_name(authority_context.certificate.issuer)
     builder = builder.public_key(request.public_key())
 
     ext_ctx = x509ext.ExtensionContext(
         authority_key = authority_public_key,
-        subject_key = authority_public_key
+        subject_key = authority_public_key,
+        authority_key_identifier = authority_context.authority_key_identifier
     )
 
-    builder = x509ext.add_extensions(
-        builder,
-        ext_ctx,
-        extension_config_list = section.extensions,
-        existing_extensions = request.extensions
-    )
+    partition_uri = None
+    if not crl_partitions is None:
+        partition_uri = crl_partitions.uri_for_partition(crl_partitions.partition_for_serial(serial_number))
+
+    template = get_extension_template(section, authority_context, ext_ctx, partition_uri)
+    builder = template.add_extensions(builder, ext_ctx, existing_extensions = request.extensions)
 
-    certificate = builder.sign(
+    return builder.sign(
         private_key = authority_private_key,
         algorithm = hash_algorithm,
         backend = default_backend()
     )
 
-    common.write_certificate_to_disk(certificate, is_self_signed = False)
-    dbaccess.add_certificate_to_db(certificate, is_self_signed = False)
+@timings.timed("disk.read_request")
+def load_request(csr_path):
+    request_bytes = utils.read_all_bytes(csr_path)
+
+    return x509.load_pem_x509_csr(request_bytes, default_backend())
 
+def print_certificate_summary(certificate):
     msg_format = "Generated certificate with serial {0}:\n" + \
         " - valid on {1}\n" + \
         " - expiring on {2}\n" + \
@@ -94,12 +101,259 @@ def main():
 
     print(msg_format.format(
         utils.format_serial(certificate.serial_number),
+        utils.make_utc_datetime_aware(certificate.not_valid_before).astimezone(tz = None),
+        utils.make_utc_datetime_aware(certificate.not_valid_after).astimezone(tz = None),
+        utils.x509_name_to_ldap_string(certificate.subject)
+    ))
+
+def expand_csr_sources(sources, manifest_path):
+    csr_paths = []
+
+    for source in sources:
+        if os.path.isdir(source):
+            csr_paths.extend(sorted(glob.glob(os.path.join(source, "*" + csr_ext))))
+        elif glob.has_magic(source):
+            csr_paths.extend(sorted(glob.glob(source)))
+        else:
+            csr_paths.append(source)
+
+    if not manifest_path is None:
+        manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+
+        with open(manifest_path, "r") as manifest:
+            for line in manifest:
+                line = line.strip()
+                if len(line) < 1 or line.startswith("#"):
+                    continue
+
+                csr_paths.append(os.path.join(manifest_dir, line))
+
+    unique_paths = []
+    seen_paths = set()
+    for path in csr_paths:
+        full_path = os.path.abspath(path)
+        if full_path in seen_paths:
+            continue
+
+        seen_paths.add(full_path)
+        unique_paths.append(path)
+
+    return unique_paths
+
+# State shared by the batch signing workers, set once per process by
+# init_batch_worker so the key and section are not re-sent for every CSR.
+batch_worker_state = None
+
+def init_batch_worker(private_key_bytes, section, crl_partitions, authority_context):
+    global batch_worker_state
+
+    batch_worker_state = (
+        section,
+        crl_partitions,
+        authority_context,
+        common.load_signing_pool_key(private_key_bytes)
+    )
+
+def sign_batch_item(csr_path, serial_number, not_before, not_after):
+    section, crl_partitions, authority_context, authority_private_key = batch_worker_state
+
+    try:
+        certificate = build_certificate(
+            load_request(csr_path),
+            section,
+            authority_context,
+            authority_private_key,
+            serial_number,
+            not_before,
+            not_after,
+            crl_partitions
+        )
+
+        return (csr_path, certificate.public_bytes(serialization.Encoding.DER), None)
+    except Exception as e:
+        return (csr_path, None, str(e))
+
+def sign_batch(csr_paths, section, crl_partitions, authority_context, authority_private_key, not_before, not_after, job_count):
+    serials = dbaccess.generate_certificate_serials(len(csr_paths))
+
+    raw_results = common.run_with_signing_pool(
+        init_batch_worker,
+        (section, crl_partitions, authority_context),
+        authority_private_key,
+        sign_batch_item,
+        csr_paths,
+        serials,
+        [ not_before ] * len(csr_paths),
+        [ not_after ] * len(csr_paths),
+        jobs = job_count,
+        chunksize = max(1, len(csr_paths) // (job_count * 4))
+    )
+
+    results = []
+    unused_serials = []
+    for serial, (csr_path, certificate_bytes, error) in zip(serials, raw_results):
+        if certificate_bytes is None:
+            results.append(BatchResult(csr_path, error = error))
+            unused_serials.append(serial)
+        else:
+            certificate = x509.load_der_x509_certificate(certificate_bytes, default_backend())
+            results.append(BatchResult(csr_path, certificate = certificate))
+
+    if len(unused_serials) > 0:
+        dbaccess.release_certificate_serials(unused_serials)
+
+    return results
+
+def store_batch(certificates, crl_partitions, write_files = True):
+    written = None
+
+    try:
+        if write_files:
+            written = common.write_certificates_to_disk(certificates, is_self_signed = False)
+
+        dbaccess.add_certificates_to_db(certificates, is_self_signed = False, crl_partitions = crl_partitions)
+    except:
+        common.remove_written_certificates(written)
+        raise
+
+def run_batch(args, section, crl_partitions, authority_context, not_before, not_after):
+    csr_paths = expand_csr_sources(args.csr_file, args.manifest)
+    if len(csr_paths) < 1:
+        print("No certificate requests to sign.")
+        sys.exit(1)
+
+    job_count = args.jobs if not args.jobs is None else (os.cpu_count() or 1)
+    job_count = max(1, min(job_count, len(csr_paths)))
+
+    authority_private_key = common.load_private_key()
+
+    start_time = time.perf_counter()
+    with timings.phase("crypto.sign_batch"):
+        results = sign_batch(
+            csr_paths,
+            section,
+            crl_partitions,
+            authority_context,
+            authority_private_key,
+            not_before,
+            not_after,
+            job_count
+        )
+    sign_time = time.perf_counter()
+
+    certificates = [ result.certificate for result in results if result.error is None ]
+    if len(certificates) > 0:
+        store_batch(certificates, crl_partitions, not args.no_files)
+    end_time = time.perf_counter()
+
+    for result in results:
+        if result.error is None:
+            print("OK     {0} -> {1} ({2})".format(
+                result.csr_path,
+                utils.format_serial(result.certificate.serial_number),
+                utils.x509_name_to_ldap_string(result.certificate.subject)
+            ))
+        else:
+            print("FAILED {0}: {1}".format(result.csr_path, result.error))
+
+    elapsed = end_time - start_time
+    summary_format = "Signed {0} of {1} certificate request(s) with {2} job(s):\n" + \
+        " - valid on {3}\n" + \
+        " - expiring on {4}\n" + \
+        " - signing took {5:.3f}s, storing took {6:.3f}s\n" + \
+        " - throughput {7:.1f} certificate(s)/s"
+
+    print(summary_format.format(
+        len(certificates),
+        len(results),
+        job_count,
         not_before.astimezone(tz = None),
         not_after.astimezone(tz = None),
-        utils.x509_name_to_ldap_string(certificate.subject)
+        sign_time - start_time,
+        end_time - sign_time,
+        len(certificates) / elapsed if elapsed > 0 else 0.0
     ))
 
+    if len(certificates) != len(results):
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--section",
+        help = "Section name to use"
+    )
+
+    parser.add_argument(
+        "--manifest",
+        help = "File listing one CSR path per line to sign in batch"
+    )
+
+    parser.add_argument(
+        "--jobs",
+        type = int,
+        help = "Number of processes used to sign a batch (defaults to the CPU count)"
+    )
+
+    parser.add_argument(
+        "--no-files",
+        action = "store_true",
+        help = "Only record the certificates in the database, 'mca-cert-store export' writes the files on demand"
+    )
+
+    parser.add_argument(
+        'csr_file',
+        nargs = "*",
+        help = 'The CSR to sign, or directories and glob patterns of CSRs to sign in batch'
+    )
+
+    timings.add_arguments(parser)
+    args = parser.parse_args()
+    timings.start(parser, args)
+
+    if len(args.csr_file) < 1 and args.manifest is None:
+        parser.error("a CSR file, directory, glob pattern or manifest is required")
+
+    section = config.get_section_for_context("sign_request", args.section)
+    if not isinstance(section, config.SignRequest):
+        raise Exception("Wrong section kind for signing certificate request.")
+
+    crl_partitions = config.get_crl_partitions()
+
+    authority_context = authority.get_authority_context()
+
+    current_time = utils.utc_now()
+    not_before = utils.floor_time_minute(current_time)
+    not_after = not_before + section.duration
+
+    is_single_request = len(args.csr_file) == 1 and args.manifest is None and \
+        os.path.isfile(args.csr_file[0])
+
+    if not is_single_request:
+        run_batch(args, section, crl_partitions, authority_context, not_before, not_after)
+        return
+
+    request = load_request(args.csr_file[0])
+
+    authority_private_key = common.load_private_key()
+
+    serial_number = dbaccess.generate_certificate_serial()
+
+    certificate = build_certificate(
+        request,
+        section,
+        authority_context,
+        authority_private_key,
+        serial_number,
+        not_before,
+        not_after,
+        crl_partitions
+    )
+
+    store_batch([ certificate ], crl_partitions, write_files = not args.no_files)
+
+    print_certificate_summary(certificate)
+
 
 if __name__ == "__main__":
     main()
-
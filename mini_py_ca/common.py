@@ -1,4 +1,5 @@
 
+import concurrent.futures
 import datetime
 import re
 import os
@@ -6,28 +7,71 @@ import shutil
 import getpass
 import sys
 
-from cryptography import x509
-from cryptography.x509.oid import NameOID
-from cryptography.x509.oid import ExtensionOID
-
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives import serialization
-
+from mini_py_ca import certstore
 from mini_py_ca import config
-from mini_py_ca import x509ext
+from mini_py_ca import lazyimport
+from mini_py_ca import timings
 from mini_py_ca import utils
 
+x509 = lazyimport.lazy_import("cryptography.x509")
+backends = lazyimport.lazy_import("cryptography.hazmat.backends")
+serialization = lazyimport.lazy_import("cryptography.hazmat.primitives.serialization")
+
 
 cert_ext = ".crt"
 date_format = "{0.year:4d}-{0.month:02d}-{0.day:02d}_{0.hour:02d}h{0.minute:02d}"
 
 
+store_dir = "store"
+
+def get_certificate_store():
+    # The packed store is only used once 'mca-cert-store migrate' created it.
+    store = certstore.CertificateStore(store_dir)
+    if not store.exists():
+        return None
+
+    return store
+
+class WrittenCertificates:
+    # What write_certificates_to_disk wrote, for remove_written_certificates
+    # to undo when the certificates could not be recorded.
+    def __init__(self, store = None, store_mark = None):
+        self.store = store
+        self.store_mark = store_mark
+        self.paths = []
+
 def write_certificate_to_disk(certificate, is_self_signed):
-    if not os.path.exists("byserial"):
-        os.mkdir("byserial")
+    return write_certificates_to_disk([ certificate ], is_self_signed)
+
+@timings.timed("disk.write_certificates")
+def write_certificates_to_disk(certificates, is_self_signed):
+    written = WrittenCertificates()
 
-    target_dir = "cacert" if is_self_signed else "cert"
+    store = get_certificate_store()
+    if not store is None:
+        written.store = store
+        written.store_mark = store.add([ certificate.public_bytes(serialization.Encoding.DER) for certificate in certificates ])
+
+        # Authority certificates keep their files, as other tools look for
+        # them in 'cacert'.
+        if not is_self_signed:
+            return written
+
+    try:
+        for certificate in certificates:
+            written.paths.extend(write_certificate_files(certificate, is_self_signed))
+    except:
+        remove_written_certificates(written)
+        raise
+
+    return written
+
+def write_certificate_files(certificate, is_self_signed, base_dir = "."):
+    byserial_dir = os.path.join(base_dir, "byserial")
+    if not os.path.exists(byserial_dir):
+        os.mkdir(byserial_dir)
+
+    target_dir = os.path.join(base_dir, "cacert" if is_self_signed else "cert")
     if not os.path.exists(target_dir):
         os.mkdir(target_dir)
 
@@ -38,10 +82,10 @@ def write_certificate_to_disk(certificate, is_self_signed):
     full_serial = utils.format_serial(certificate.serial_number)
     short_serial = full_serial[:8]
 
-    byserial_path = os.path.join("byserial", full_serial + cert_ext)
+    byserial_path = os.path.join(byserial_dir, full_serial + cert_ext)
     utils.write_all_bytes(byserial_path, serialized_certificate)
 
-    common_name = certificate.subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value
+    common_name = certificate.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)[0].value
     safe_common_name = re.sub(r"[^a-zA-Z0-9-_]", "_", common_name)
 
     utc_not_valid_before = utils.make_utc_datetime_aware(certificate.not_valid_before)
@@ -67,32 +111,71 @@ def write_certificate_to_disk(certificate, is_self_signed):
     else:
         os.symlink(full_src, full_dst)
 
-def write_crl_to_disk(crl):
-    if not os.path.exists("crl"):
-        os.mkdir("crl")
+    return [ full_src, full_dst ]
 
+def remove_written_certificates(written):
+    if written is None:
+        return
+
+    for path in reversed(written.paths):
+        if os.path.lexists(path):
+            os.remove(path)
+
+    if not written.store is None:
+        written.store.remove_added(written.store_mark)
+
+@timings.timed("disk.write_crl")
+def write_crl_to_disk(crl, crl_partition = None):
     serialized_crl = crl.public_bytes(
         encoding = serialization.Encoding.PEM,
     )
 
+    utils.write_all_bytes(make_crl_path(crl, crl_partition), serialized_crl)
+
+def make_crl_path(crl, crl_partition = None):
+    if not os.path.exists("crl"):
+        os.mkdir("crl")
+
     utc_next_update = utils.make_utc_datetime_aware(crl.next_update)
     number = crl.extensions.get_extension_for_class(x509.CRLNumber).value.crl_number
 
-    crl_format = "{1:04d}_" + date_format + ".crl"
+    is_delta = False
+    try:
+        crl.extensions.get_extension_for_class(x509.DeltaCRLIndicator)
+        is_delta = True
+    except x509.ExtensionNotFound:
+        pass
+
+    kind_prefix = ""
+    if is_delta:
+        kind_prefix = "delta_"
+    elif not crl_partition is None:
+        kind_prefix = "p{0:d}_".format(crl_partition)
+
+    return make_crl_path_from_values(number, utc_next_update, kind_prefix)
+
+def make_crl_path_from_values(number, utc_next_update, kind_prefix = ""):
+    crl_format = "{1:04d}_" + kind_prefix + date_format + ".crl"
     crl_filename = crl_format.format(
         utc_next_update.astimezone(tz = None),
         number
     )
 
-    crl_path = os.path.join("crl", crl_filename) 
-    utils.write_all_bytes(crl_path, serialized_crl)
+    return os.path.join("crl", crl_filename)
 
 def load_certificate_by_serial(serial):
+    store = get_certificate_store()
+    if not store is None:
+        certificate = store.load_certificate(int(serial, 16))
+        if not certificate is None:
+            return certificate
+
     certificate_bytes = utils.read_all_bytes("byserial/" + serial + cert_ext)
 
-    return x509.load_pem_x509_certificate(certificate_bytes, default_backend())
+    return x509.load_pem_x509_certificate(certificate_bytes, backends.default_backend())
 
 
+@timings.timed("crypto.load_key")
 def load_private_key():
     private_key_bytes = utils.read_all_bytes(get_current_private_key_path())
 
@@ -100,7 +183,7 @@ def load_private_key():
         private_key = serialization.load_pem_private_key(
             private_key_bytes,
             password = None,
-            backend = default_backend()
+            backend = backends.default_backend()
         )
 
         return private_key
@@ -114,7 +197,7 @@ def load_encrypted_private_key_bytes(private_key_bytes):
         private_key = serialization.load_pem_private_key(
             private_key_bytes,
             password = password.encode(),
-            backend = default_backend()
+            backend = backends.default_backend()
         )
 
         return private_key
@@ -122,6 +205,31 @@ def load_encrypted_private_key_bytes(private_key_bytes):
         print("Invalid key password.")
         sys.exit(1)
 
+def load_signing_pool_key(private_key_bytes):
+    return serialization.load_der_private_key(private_key_bytes, password = None, backend = backends.default_backend())
+
+def run_with_signing_pool(initializer, init_args, private_key, func, *iterables, jobs = 1, chunksize = 1):
+    # Calls initializer(private_key_bytes, *init_args) once per worker, the
+    # key being exported as unencrypted PKCS#8 DER so it can be sent to the
+    # workers, which load it with load_signing_pool_key. With a single job,
+    # everything runs in this process.
+    private_key_bytes = private_key.private_bytes(
+        encoding = serialization.Encoding.DER,
+        format = serialization.PrivateFormat.PKCS8,
+        encryption_algorithm = serialization.NoEncryption()
+    )
+
+    if jobs == 1:
+        initializer(private_key_bytes, *init_args)
+        return list(map(func, *iterables))
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers = jobs,
+        initializer = initializer,
+        initargs = (private_key_bytes,) + tuple(init_args)
+    ) as executor:
+        return list(executor.map(func, *iterables, chunksize = chunksize))
+
 def make_path_from_config_dir(relative_path):
     dir_name = ".minipyca"
 
@@ -1,13 +1,15 @@
 
 
-from ruamel.yaml import YAML
-
 import datetime
+import hashlib
+import json
+import os
 import re
 import enum
 from enum import Enum
 
 from mini_py_ca import common
+from mini_py_ca import timings
 from mini_py_ca import utils
 
 supported_signature_algorithms = [ "sha256", "sha512" ]
@@ -29,6 +31,42 @@ class RevocationList:
     def __init__(self, section_dict, section_name):
         parse_signed_object(self, section_dict, section_name)
 
+        self.partitions = None
+        if "partitions" in section_dict:
+            self.partitions = CrlPartitions(section_dict["partitions"], section_name)
+
+class OcspResponse:
+    def __init__(self, section_dict, section_name):
+        parse_signed_object(self, section_dict, section_name)
+
+        # Cached responses are signed again once less than this remains of
+        # their validity.
+        self.refresh_before = self.duration / 4
+        if "refresh_before" in section_dict:
+            self.refresh_before = parse_duration(section_dict["refresh_before"])
+
+        if self.refresh_before >= self.duration:
+            raise Exception("Refresh delay must be shorter than the duration in section '" + section_name + "'.")
+
+class CrlPartitions:
+    def __init__(self, partitions_dict, section_name):
+        if not "count" in partitions_dict or not "uri" in partitions_dict:
+            raise Exception("Partitions need a count and an URI in section '" + section_name + "'.")
+
+        self.count = partitions_dict["count"]
+        if not isinstance(self.count, int) or self.count < 1:
+            raise Exception("Invalid partition count in section '" + section_name + "'.")
+
+        self.uri_format = partitions_dict["uri"]
+        if not "{partition}" in self.uri_format:
+            raise Exception("Partition URI must contain '{partition}' in section '" + section_name + "'.")
+
+    def partition_for_serial(self, serial):
+        return serial % self.count
+
+    def uri_for_partition(self, partition):
+        return self.uri_format.replace("{partition}", str(partition))
+
 class ExtensionAction(Enum):
     ADD = enum.auto
     REPLACE = enum.auto
@@ -133,12 +171,145 @@ def parse_distinguished_name(rdn_sequence):
     return dn
 
 def read_config_file():
+    return parse_config_bytes(utils.read_all_bytes(get_config_file_path()))
+
+def parse_config_bytes(config_bytes):
+    # Only imported when the compiled cache cannot be used, as it makes up a
+    # good part of the startup time of every command.
+    from ruamel.yaml import YAML
+
     parser = YAML(typ = "safe")
 
-    config_file_path = common.make_path_from_config_dir("config.yml")
+    return parser.load(config_bytes)
+
+def get_config_file_path():
+    return common.make_path_from_config_dir("config.yml")
+
+def get_config_cache_path():
+    return common.make_path_from_config_dir("config.cache")
+
+# Bumped whenever the cache format changes, so older caches are ignored.
+config_cache_version = 2
+
+class CompiledConfig:
+    def __init__(self, source_key, default_section, sections, errors):
+        self.version = config_cache_version
+        self.source_key = source_key
+        self.default_section = default_section
+        self.sections = sections
+        self.errors = errors
+
+    def get_section(self, context_name, override_section_name = None):
+        section_name = override_section_name
+        if section_name is None:
+            section_name = context_name
+
+            if context_name in self.default_section:
+                section_name = self.default_section[context_name]
+
+        if section_name in self.errors:
+            raise Exception(self.errors[section_name])
+
+        if not section_name in self.sections:
+            raise Exception("No section with name '" + section_name + "'.")
+
+        return self.sections[section_name]
+
+    def find_section(self, context_name):
+        # For optional contexts, None when no section is configured for them.
+        section_name = self.default_section.get(context_name, context_name)
+        if not section_name in self.sections and not section_name in self.errors:
+            return None
+
+        return self.get_section(context_name)
+
+def make_source_key(config_bytes, stat):
+    return (stat.st_mtime_ns, stat.st_size, hashlib.sha256(config_bytes).hexdigest())
+
+def compile_config(config, source_key):
+    default_section = dict()
+    if "_default_section" in config:
+        default_section = dict(config["_default_section"])
+
+    # Invalid sections are only reported when used, as when they were parsed
+    # on demand.
+    sections = dict()
+    errors = dict()
+    for section_name, section_dict in config.items():
+        if section_name == "_default_section":
+            continue
+
+        try:
+            sections[section_name] = parse_section(section_dict, section_name)
+        except Exception as e:
+            errors[section_name] = str(e)
+
+    return CompiledConfig(source_key, default_section, sections, errors)
+
+# The cache holds the YAML document as JSON, data only, which is compiled
+# again once its source key matches, so that a tampered cache cannot run code
+# in the commands loading the authority key.
+def read_config_cache(source_key):
+    try:
+        with open(get_config_cache_path(), "r") as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(cache, dict) or cache.get("version") != config_cache_version:
+        return None
+
+    if cache.get("source_key") != list(source_key) or not isinstance(cache.get("config"), dict):
+        return None
+
+    return compile_config(cache["config"], source_key)
+
+def write_config_cache(config, source_key):
+    # Documents JSON does not hold as is, such as YAML dates or non string
+    # keys, are not cached.
+    try:
+        cache_text = json.dumps({
+            "version": config_cache_version,
+            "source_key": list(source_key),
+            "config": config,
+        })
+    except (TypeError, ValueError):
+        return
+
+    if json.loads(cache_text)["config"] != config:
+        return
+
+    cache_path = get_config_cache_path()
+    temp_path = cache_path + ".tmp"
+
+    try:
+        with open(temp_path, "w") as file:
+            file.write(cache_text)
+
+        os.replace(temp_path, cache_path)
+    except OSError:
+        # The cache is only an optimization, the configuration directory may
+        # well be read-only.
+        pass
+
+@timings.timed("config")
+def load_compiled_config(use_cache = True):
+    config_file_path = get_config_file_path()
 
     with open(config_file_path, "rb") as file:
-        return parser.load(file)
+        config_bytes = file.read()
+        source_key = make_source_key(config_bytes, os.fstat(file.fileno()))
+
+    compiled_config = None
+    if use_cache:
+        compiled_config = read_config_cache(source_key)
+
+    if compiled_config is None:
+        config = parse_config_bytes(config_bytes)
+        write_config_cache(config, source_key)
+        compiled_config = compile_config(config, source_key)
+
+    return compiled_config
 
 def parse_section(section_dict, section_name):
 
@@ -153,22 +324,20 @@ def parse_section(section_dict, section_name):
         return SignRequest(section_dict, section_name)
     elif kind == "revocation_list":
         return RevocationList(section_dict, section_name)
+    elif kind == "ocsp_response":
+        return OcspResponse(section_dict, section_name)
 
 def get_section_for_context(context_name, override_section_name = None):
-    config = read_config_file()
-
-    section_name = override_section_name
-    if section_name is None:
-        section_name = context_name
-
-        if "_default_section" in config:
-            default_section = config["_default_section"]
+    return load_compiled_config().get_section(context_name, override_section_name)
 
-            if context_name in default_section:
-                section_name = default_section[context_name]
+def find_section_for_context(context_name):
+    return load_compiled_config().find_section(context_name)
 
-    if not section_name in config:
-        raise Exception("No section with name '" + section_name + "'.")
+def get_crl_partitions():
+    # Partitioning is opt-in, authorities without CRLs sign certificates too.
+    section = find_section_for_context("revocation_list")
+    if not isinstance(section, RevocationList):
+        return None
 
-    return parse_section(config[section_name], section_name)
+    return section.partitions
 
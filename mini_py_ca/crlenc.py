@@ -0,0 +1,223 @@
+import base64
+import os
+import tempfile
+
+from mini_py_ca import der
+from mini_py_ca import lazyimport
+from mini_py_ca import timings
+from mini_py_ca import utils
+
+x509 = lazyimport.lazy_import("cryptography.x509")
+backends = lazyimport.lazy_import("cryptography.hazmat.backends")
+hashes = lazyimport.lazy_import("cryptography.hazmat.primitives.hashes")
+serialization = lazyimport.lazy_import("cryptography.hazmat.primitives.serialization")
+ec = lazyimport.lazy_import("cryptography.hazmat.primitives.asymmetric.ec")
+padding = lazyimport.lazy_import("cryptography.hazmat.primitives.asymmetric.padding")
+rsa = lazyimport.lazy_import("cryptography.hazmat.primitives.asymmetric.rsa")
+asym_utils = lazyimport.lazy_import("cryptography.hazmat.primitives.asymmetric.utils")
+
+# CRLReason codes from RFC 5280 5.3.1.
+reason_code_mapping = {
+    "unspecified": 0,
+    "keyCompromise": 1,
+    "caCompromise": 2,
+    "affiliationChanged": 3,
+    "superseded": 4,
+    "cessationOfOperation": 5,
+    "certificateHold": 6,
+    "removeFromCRL": 8,
+    "privilegeWithdrawn": 9,
+    "aaCompromise": 10,
+}
+
+def encode_extension(oid, value):
+    return der.encode_sequence(
+        der.encode_oid(oid.dotted_string),
+        der.encode_tlv(der.tag_octet_string, value)
+    )
+
+def encode_revoked_entry(serial, revocation_date, reason, invalidity_date = None):
+    # Encodes the revokedCertificates entry exactly as the CRL builder of
+    # cryptography would, so cached entries can be spliced into a CRL.
+    elements = [
+        der.encode_integer(serial),
+        der.encode_time(utils.floor_time_minute(revocation_date))
+    ]
+
+    extensions = []
+    if reason != "unspecified":
+        extensions.append(encode_extension(
+            x509.CRLEntryExtensionOID.CRL_REASON,
+            der.encode_enumerated(reason_code_mapping[reason])
+        ))
+
+    # The builder always encodes the invalidity date as GeneralizedTime.
+    if not invalidity_date is None:
+        extensions.append(encode_extension(
+            x509.CRLEntryExtensionOID.INVALIDITY_DATE,
+            der.encode_generalized_time(invalidity_date)
+        ))
+
+    if len(extensions) > 0:
+        elements.append(der.encode_sequence(*extensions))
+
+    return der.encode_sequence(*elements)
+
+stream_chunk_size = 64 * 1024
+
+def sign_data(private_key, data, hash_algorithm):
+    if isinstance(private_key, rsa.RSAPrivateKey):
+        return private_key.sign(data, padding.PKCS1v15(), hash_algorithm)
+    elif isinstance(private_key, ec.EllipticCurvePrivateKey):
+        return private_key.sign(data, ec.ECDSA(hash_algorithm))
+    else:
+        raise Exception("Unsupported private key type for signing a CRL.")
+
+def sign_digest(private_key, digest, hash_algorithm):
+    return sign_data(private_key, digest, asym_utils.Prehashed(hash_algorithm))
+
+class CrlTemplate:
+    # Splits a CRL signed without revoked certificates into the parts of its
+    # TBSCertList around the revokedCertificates position.
+    def __init__(self, builder, private_key, hash_algorithm):
+        template_crl = builder.sign(
+            private_key = private_key,
+            algorithm = hash_algorithm,
+            backend = backends.default_backend()
+        )
+
+        crl_bytes = template_crl.public_bytes(encoding = serialization.Encoding.DER)
+        tag, crl_start, crl_end = der.read_tlv(crl_bytes, 0)
+        crl_elements = der.split_elements(crl_bytes, crl_start, crl_end)
+
+        tbs_tag, tbs_start, tbs_end = der.read_tlv(crl_bytes, crl_elements[0][1])
+        tbs_elements = der.split_elements(crl_bytes, tbs_start, tbs_end)
+
+        # The revoked certificates go right before the crlExtensions, if any.
+        split_offset = tbs_end
+        for element_tag, element_start, element_end in tbs_elements:
+            if element_tag == der.tag_context_0:
+                split_offset = element_start
+                break
+
+        self.template_crl = template_crl
+        self.tbs_prefix = crl_bytes[tbs_start:split_offset]
+        self.tbs_suffix = crl_bytes[split_offset:tbs_end]
+        self.signature_algorithm = crl_bytes[crl_elements[1][1]:crl_elements[1][2]]
+        self.private_key = private_key
+        self.hash_algorithm = hash_algorithm
+
+    def encode_tbs(self, entries_bytes):
+        revoked_certificates = b""
+        if len(entries_bytes) > 0:
+            revoked_certificates = der.encode_tlv(der.tag_sequence, entries_bytes)
+
+        return der.encode_tlv(
+            der.tag_sequence,
+            self.tbs_prefix + revoked_certificates + self.tbs_suffix
+        )
+
+    def sign_tbs(self, tbs_bytes):
+        signature = sign_data(self.private_key, tbs_bytes, self.hash_algorithm)
+
+        return der.encode_sequence(
+            tbs_bytes,
+            self.signature_algorithm,
+            der.encode_bit_string(signature)
+        )
+
+    def iter_streamed_crl(self, entries_file, entries_length):
+        revoked_header = b""
+        if entries_length > 0:
+            revoked_header = der.encode_header(der.tag_sequence, entries_length)
+
+        tbs_length = len(self.tbs_prefix) + len(revoked_header) + entries_length + len(self.tbs_suffix)
+        tbs_header = der.encode_header(der.tag_sequence, tbs_length)
+
+        def iter_tbs():
+            yield tbs_header
+            yield self.tbs_prefix
+            yield revoked_header
+
+            entries_file.seek(0)
+            chunk = entries_file.read(stream_chunk_size)
+            while len(chunk) > 0:
+                yield chunk
+                chunk = entries_file.read(stream_chunk_size)
+
+            yield self.tbs_suffix
+
+        with timings.phase("crypto.hash_and_sign"):
+            hasher = hashes.Hash(self.hash_algorithm, backends.default_backend())
+            for chunk in iter_tbs():
+                hasher.update(chunk)
+
+            signature = sign_digest(self.private_key, hasher.finalize(), self.hash_algorithm)
+        crl_suffix = self.signature_algorithm + der.encode_bit_string(signature)
+
+        yield der.encode_header(der.tag_sequence, len(tbs_header) + tbs_length + len(crl_suffix))
+
+        for chunk in iter_tbs():
+            yield chunk
+
+        yield crl_suffix
+
+    def write_streamed_crl(self, entries, output_path, encoding = None):
+        # Spools the entries to a temporary file, as the TBSCertList header
+        # needs their total length, then hashes and writes the CRL in chunks.
+        if encoding is None:
+            encoding = serialization.Encoding.PEM
+
+        with tempfile.TemporaryFile() as entries_file:
+            entry_count = 0
+            entries_length = 0
+            with timings.phase("crl.spool_entries"):
+                for entry in entries:
+                    entries_file.write(entry)
+                    entry_count = entry_count + 1
+                    entries_length = entries_length + len(entry)
+
+            with timings.phase("disk.write_crl"):
+                temp_output_path = output_path + ".tmp"
+                with open(temp_output_path, "wb") as output:
+                    writer = PemWriter(output, "X509 CRL") if encoding == serialization.Encoding.PEM else output
+
+                    for chunk in self.iter_streamed_crl(entries_file, entries_length):
+                        writer.write(chunk)
+
+                    if writer is not output:
+                        writer.finish()
+
+                os.replace(temp_output_path, output_path)
+
+        return entry_count
+
+class PemWriter:
+    def __init__(self, output, label):
+        self.output = output
+        self.label = label
+        self.pending = b""
+
+        self.output.write(("-----BEGIN " + label + "-----\n").encode("ascii"))
+
+    def write(self, data):
+        data = self.pending + data
+        line_count = len(data) // 48
+
+        for i in range(line_count):
+            self.output.write(base64.b64encode(data[i * 48:(i + 1) * 48]) + b"\n")
+
+        self.pending = data[line_count * 48:]
+
+    def finish(self):
+        if len(self.pending) > 0:
+            self.output.write(base64.b64encode(self.pending) + b"\n")
+
+        self.output.write(("-----END " + self.label + "-----\n").encode("ascii"))
+
+def sign_crl(builder, entries, private_key, hash_algorithm):
+    template = CrlTemplate(builder, private_key, hash_algorithm)
+
+    crl_bytes = template.sign_tbs(template.encode_tbs(b"".join(entries)))
+
+    return x509.load_der_x509_crl(crl_bytes, backends.default_backend())
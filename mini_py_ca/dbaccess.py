@@ -1,27 +1,79 @@
 
 
 import datetime
+import random
 import sqlite3
-
-from cryptography import x509
+import sys
+import time
 
 from mini_py_ca import common
+from mini_py_ca import crlenc
+from mini_py_ca import lazyimport
+from mini_py_ca import revjournal
+from mini_py_ca import timings
 from mini_py_ca import utils
 
+x509 = lazyimport.lazy_import("cryptography.x509")
+backends = lazyimport.lazy_import("cryptography.hazmat.backends")
+serialization = lazyimport.lazy_import("cryptography.hazmat.primitives.serialization")
+
 database_connection = None
 
+# Callables invoked with (revoked_certificate_id, serial) after a revocation is
+# committed by this process, for in-process caches of certificate status.
+revocation_listeners = []
+
 class IssuedCertificate:
-    def __init__(self, issued_certificate_id, date_created, not_before_date, not_after_date, serial, subject, is_self_signed, is_revoked, revocation_date, revocation_reason):
-        self.id = issued_certificate_id
-        self.date_created = date_created
-        self.not_before_date = not_before_date
-        self.not_after_date = not_after_date
-        self.serial = serial
-        self.subject = subject
-        self.is_self_signed = is_self_signed
-        self.is_revoked = is_revoked
-        self.revocation_date = revocation_date
-        self.revocation_reason = revocation_reason
+    # Wraps a row of get_certificates_by_filter, decoding the dates and the
+    # serial only when they are accessed.
+    __slots__ = ("row",)
+
+    def __init__(self, row):
+        self.row = row
+
+    @property
+    def id(self):
+        return self.row[0]
+
+    @property
+    def date_created(self):
+        return utils.from_timestamp_milis(self.row[1])
+
+    @property
+    def not_before_date(self):
+        return utils.from_timestamp_milis(self.row[2])
+
+    @property
+    def not_after_date(self):
+        return utils.from_timestamp_milis(self.row[3])
+
+    @property
+    def serial(self):
+        return int(self.row[4], 16)
+
+    @property
+    def formatted_serial(self):
+        return self.row[4]
+
+    @property
+    def subject(self):
+        return self.row[5]
+
+    @property
+    def is_self_signed(self):
+        return bool(self.row[6])
+
+    @property
+    def is_revoked(self):
+        return not self.row[7] is None
+
+    @property
+    def revocation_date(self):
+        return None if self.row[8] is None else utils.from_timestamp_milis(self.row[8])
+
+    @property
+    def revocation_reason(self):
+        return self.row[9]
 
 issued_certificate_create = """CREATE TABLE issued_certificate (
     issued_certificate_id INTEGER NOT NULL PRIMARY KEY,
@@ -48,69 +100,209 @@ revocation_list_create = """CREATE TABLE revocation_list (
     next_update_date INT NOT NULL
 );"""
 
-reason_flag_mapping = {
-    "unspecified": x509.ReasonFlags.unspecified,
-    "keyCompromise": x509.ReasonFlags.key_compromise,
-    "caCompromise": x509.ReasonFlags.ca_compromise,
-    "affiliationChanged": x509.ReasonFlags.affiliation_changed,
-    "superseded": x509.ReasonFlags.superseded,
-    "cessationOfOperation": x509.ReasonFlags.cessation_of_operation,
-#    "certificateHold": x509.ReasonFlags.certificate_hold,
-    "privilegeWithdrawn": x509.ReasonFlags.privilege_withdrawn,
-    "aaCompromise": x509.ReasonFlags.aa_compromise,
-#    "removeFromCRL": x509.ReasonFlags.remove_from_crl,
+# Width of the expiry buckets of certificate_expiry_summary, in milliseconds.
+expiry_bucket_size = 60 * 60 * 1000
+
+# Kinds of CRLs whose latest one is kept in revocation_list_summary, with
+# their filter on the revocation_list row.
+crl_summary_kinds = [
+    ("complete", "{0}base_crl_number IS NULL AND {0}crl_partition IS NULL"),
+    ("delta", "{0}base_crl_number IS NOT NULL"),
+]
+
+# Names of the x509.ReasonFlags members, looked up by get_reason_flag.
+reason_flag_names = {
+    "unspecified": "unspecified",
+    "keyCompromise": "key_compromise",
+    "caCompromise": "ca_compromise",
+    "affiliationChanged": "affiliation_changed",
+    "superseded": "superseded",
+    "cessationOfOperation": "cessation_of_operation",
+#    "certificateHold": "certificate_hold",
+    "privilegeWithdrawn": "privilege_withdrawn",
+    "aaCompromise": "aa_compromise",
+#    "removeFromCRL": "remove_from_crl",
 }
 
+def get_reason_flag(reason):
+    return getattr(x509.ReasonFlags, reason_flag_names[reason])
+
+# Reserved serials that are neither used nor released are deleted after this
+# delay, on the next reservation.
+serial_reservation_lifetime = datetime.timedelta(hours = 1)
+
 def generate_certificate_serial():
+    return reserve_certificate_serials(1)[0]
+
+def generate_certificate_serials(count):
+    return reserve_certificate_serials(count)
+
+@timings.timed("db.reserve_serials")
+def reserve_certificate_serials(count, lifetime = None):
+    # Claims the serials before anything is signed with them, so concurrent
+    # issuers can never pick the same one: the UNIQUE constraint of
+    # serial_reservation settles races, and the whole batch costs a single
+    # write transaction.
+    if lifetime is None:
+        lifetime = serial_reservation_lifetime
+
     conn = get_connection()
 
-    attempt_count = 0
-    while attempt_count < 10:
-        serial = x509.random_serial_number()
+    now = datetime.datetime.now(tz = datetime.timezone.utc)
+    values = {
+        "reserved_date": utils.to_timestamp_milis(now),
+        "expiry_date": utils.to_timestamp_milis(now + lifetime)
+    }
+
+    begin_write_transaction(conn)
 
-        if not serial_exists(conn, serial):
-            return serial
+    cur = conn.cursor()
+    with AutoClose(cur):
+        try:
+            cur.execute("DELETE FROM serial_reservation WHERE expiry_date <= :reserved_date;", values)
+
+            serials = []
+            failure_count = 0
+            while len(serials) < count:
+                if failure_count >= 10:
+                    raise Exception("Failed to get new random serial 10 times ?!")
+
+                serial = x509.random_serial_number()
+                values["serial"] = utils.format_serial(serial)
+
+                cur.execute("""INSERT OR IGNORE INTO serial_reservation (serial, reserved_date, expiry_date)
+SELECT :serial, :reserved_date, :expiry_date
+WHERE NOT EXISTS (SELECT 1 FROM issued_certificate WHERE serial = :serial);""",
+                    values
+                )
+
+                if cur.rowcount == 1:
+                    serials.append(serial)
+                    failure_count = 0
+                else:
+                    failure_count = failure_count + 1
+
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+    return serials
+
+@timings.timed("db.release_serials")
+def release_certificate_serials(serials):
+    conn = get_connection()
 
-        attempt_count = attempt_count + 1
+    begin_write_transaction(conn)
 
-    raise Exception("Failed to get new random serial 10 times ?!")
+    try:
+        conn.executemany(
+            "DELETE FROM serial_reservation WHERE serial = ?;",
+            [ (utils.format_serial(serial),) for serial in serials ]
+        )
 
-def add_certificate_to_db(certificate, is_self_signed):
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+
+def add_certificate_to_db(certificate, is_self_signed, crl_partitions = None):
+    add_certificates_to_db([ certificate ], is_self_signed, crl_partitions)
+
+@timings.timed("db.add_certificates")
+def add_certificates_to_db(certificates, is_self_signed, crl_partitions = None):
     conn = get_connection()
 
     now = datetime.datetime.now(tz = datetime.timezone.utc)
+
+    begin_write_transaction(conn)
+
+    insert_cur = conn.cursor()
+    with AutoClose(insert_cur):
+        try:
+            for certificate in certificates:
+                insert_certificate(insert_cur, certificate, is_self_signed, now, crl_partitions)
+
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+@timings.timed("db.add_certificates")
+def add_renewed_certificates_to_db(renewals, crl_partitions = None):
+    # Records the (renewed issued_certificate_id, certificate) pairs in one
+    # transaction, each renewed certificate pointing to its replacement.
+    conn = get_connection()
+
+    now = datetime.datetime.now(tz = datetime.timezone.utc)
+
+    begin_write_transaction(conn)
+
+    insert_cur = conn.cursor()
+    with AutoClose(insert_cur):
+        try:
+            for renewed_certificate_id, certificate in renewals:
+                insert_certificate(insert_cur, certificate, False, now, crl_partitions)
+
+                insert_cur.execute("""INSERT INTO certificate_renewal (
+    issued_certificate_id,
+    renewal_certificate_id,
+    date_created
+) VALUES(
+    :issued_certificate_id,
+    :renewal_certificate_id,
+    :date_created
+);""",
+                    {
+                        "issued_certificate_id": renewed_certificate_id,
+                        "renewal_certificate_id": insert_cur.lastrowid,
+                        "date_created": utils.to_timestamp_milis(now)
+                    }
+                )
+
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+def insert_certificate(cur, certificate, is_self_signed, date_created, crl_partitions = None):
     utc_not_valid_before = utils.make_utc_datetime_aware(certificate.not_valid_before)
     utc_not_valid_after = utils.make_utc_datetime_aware(certificate.not_valid_after)
     values = {
-        "date_created": utils.to_timestamp_milis(now),
+        "date_created": utils.to_timestamp_milis(date_created),
         "not_before_date": utils.to_timestamp_milis(utc_not_valid_before),
         "not_after_date": utils.to_timestamp_milis(utc_not_valid_after),
         "serial": utils.format_serial(certificate.serial_number),
         "subject": utils.x509_name_to_ldap_string(certificate.subject),
-        "is_self_signed": is_self_signed
+        "is_self_signed": is_self_signed,
+        "crl_partition": None if crl_partitions is None else crl_partitions.partition_for_serial(certificate.serial_number),
+        "der": certificate.public_bytes(serialization.Encoding.DER)
     }
 
-    insert_cur = conn.cursor()
-    insert_cur.execute("""INSERT INTO issued_certificate (
+    cur.execute("""INSERT INTO issued_certificate (
     date_created,
     not_before_date,
     not_after_date,
     serial,
     subject,
-    is_self_signed
+    is_self_signed,
+    crl_partition,
+    der
 ) VALUES(
     :date_created,
     :not_before_date,
     :not_after_date,
     :serial,
     :subject,
-    :is_self_signed
+    :is_self_signed,
+    :crl_partition,
+    :der
 );""",
         values
     )
 
-    conn.commit()
-    insert_cur.close()
+    # The serial is now held by the UNIQUE constraint of issued_certificate.
+    cur.execute("DELETE FROM serial_reservation WHERE serial = :serial;", values)
 
 def find_current_authority_certificate_serial():
     conn = get_connection()
@@ -126,6 +318,98 @@ WHERE ic.issued_certificate_id = (SELECT MAX(issued_certificate_id)
 
         return cur.fetchone()[0]
 
+def get_certificate_der(conn, serial):
+    cur = conn.cursor()
+
+    with AutoClose(cur):
+        cur.execute("""SELECT ic.issued_certificate_id
+FROM issued_certificate AS ic
+WHERE ic.serial = :serial AND ic.der IS NOT NULL;""",
+            {"serial": serial}
+        )
+
+        row = cur.fetchone()
+        if row is None:
+            return None
+
+        if not hasattr(conn, "blobopen"):
+            cur.execute("SELECT der FROM issued_certificate WHERE issued_certificate_id = :id;", {"id": row[0]})
+            return cur.fetchone()[0]
+
+    # Reads the BLOB in place rather than through a result row.
+    with conn.blobopen("issued_certificate", "der", row[0], readonly = True) as blob:
+        return blob.read()
+
+def load_certificate_by_serial(serial):
+    # Certificates issued before the der column, or whose backfill found no
+    # file, are still read from the disk.
+    certificate_der = get_certificate_der(get_connection(), serial)
+    if certificate_der is None:
+        return common.load_certificate_by_serial(serial)
+
+    return x509.load_der_x509_certificate(certificate_der, backends.default_backend())
+
+def find_current_authority_context():
+    conn = get_connection()
+
+    cur = conn.cursor()
+    with AutoClose(cur):
+        cur.execute("""SELECT
+    ic.issued_certificate_id,
+    ic.serial,
+    ic.der,
+    ac.key_identifier,
+    ac.spki_sha256,
+    ac.ocsp_sha1_name_hash,
+    ac.ocsp_sha1_key_hash,
+    ac.ocsp_sha256_name_hash,
+    ac.ocsp_sha256_key_hash
+FROM issued_certificate AS ic
+LEFT JOIN authority_context AS ac ON ac.issued_certificate_id = ic.issued_certificate_id
+WHERE ic.issued_certificate_id = (SELECT MAX(issued_certificate_id)
+	FROM issued_certificate AS ic_max
+	WHERE ic_max.is_self_signed = 1
+);""")
+
+        return cur.fetchone()
+
+@timings.timed("db.record_authority")
+def record_authority_context(serial, values):
+    conn = get_connection()
+
+    values = dict(values)
+    values["serial"] = utils.format_serial(serial)
+
+    begin_write_transaction(conn)
+
+    try:
+        cur = conn.execute("""INSERT OR REPLACE INTO authority_context (
+    issued_certificate_id,
+    key_identifier,
+    spki_sha256,
+    ocsp_sha1_name_hash,
+    ocsp_sha1_key_hash,
+    ocsp_sha256_name_hash,
+    ocsp_sha256_key_hash
+) SELECT
+    ic.issued_certificate_id,
+    :key_identifier,
+    :spki_sha256,
+    :ocsp_sha1_name_hash,
+    :ocsp_sha1_key_hash,
+    :ocsp_sha256_name_hash,
+    :ocsp_sha256_key_hash
+FROM issued_certificate AS ic
+WHERE ic.serial = :serial;""",
+            values
+        )
+        cur.close()
+
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+
 def serial_exists(conn, serial):
     check_cur = conn.cursor()
 
@@ -139,6 +423,7 @@ WHERE ic.serial = :serial;
         
         return not check_cur.fetchone() is None
 
+@timings.timed("db.find_certificate")
 def get_certificate_by_id(certificate_id):
     conn = get_connection()
 
@@ -153,46 +438,560 @@ def get_certificate_by_id(certificate_id):
 
     return array[0]
 
+@timings.timed("db.find_certificate")
+def get_certificate_by_serial(serial):
+    conn = get_connection()
+
+    array = get_certificates_by_filter(
+        conn,
+        "ic.serial = :serial",
+        {"serial": utils.format_serial(serial)}
+    )
+
+    if len(array) < 1:
+        return None
+
+    return array[0]
+
+def get_certificates_by_serials(serials):
+    # Records by serial, looked up in one query. The serials missing from the
+    # database are left out.
+    conn = get_connection()
+
+    values = dict()
+    for index, serial in enumerate(serials):
+        values["serial_{0:d}".format(index)] = utils.format_serial(serial)
+
+    if len(values) < 1:
+        return dict()
+
+    records = iter_certificates_by_filter(
+        conn,
+        "ic.serial IN (" + ", ".join([ ":" + name for name in values.keys() ]) + ")",
+        values
+    )
+
+    return { record.serial: record for record in records }
+
+def get_last_revoked_certificate_id():
+    # Revocations are inserted one writer at a time, so their ids follow the
+    # commit order and the ones above this id were not visible yet.
+    conn = get_connection()
+
+    cur = conn.cursor()
+    with AutoClose(cur):
+        cur.execute("""SELECT MAX(rc.revoked_certificate_id)
+FROM revoked_certificate AS rc;""")
+
+        value = cur.fetchone()[0]
+
+        return 0 if value is None else value
+
+def get_revocations_since(revoked_certificate_id):
+    conn = get_connection()
+
+    cur = conn.cursor()
+    with AutoClose(cur):
+        cur.execute("""SELECT rc.revoked_certificate_id, ic.serial
+FROM revoked_certificate AS rc
+INNER JOIN issued_certificate AS ic ON ic.issued_certificate_id = rc.issued_certificate_id
+WHERE rc.revoked_certificate_id > :revoked_certificate_id
+ORDER BY rc.revoked_certificate_id;""",
+            {"revoked_certificate_id": revoked_certificate_id}
+        )
+
+        return [ (row[0], int(row[1], 16)) for row in cur.fetchall() ]
+
+def get_data_version():
+    # Changes whenever another connection commits to the database.
+    conn = get_connection()
+
+    cur = conn.execute("PRAGMA data_version;")
+    with AutoClose(cur):
+        return cur.fetchone()[0]
+
+@timings.timed("db.revoke")
 def revoke_certificate_by_id(revocation_time, certificate_id, serial, reason = None):
     if reason is None:
         reason = "unspecified"
 
+    conn = get_connection()
+
+    begin_write_transaction(conn)
+
+    insert_cur = conn.cursor()
+    with AutoClose(insert_cur):
+        journal_position = None
+
+        try:
+            record = insert_revocation(insert_cur, certificate_id, serial, revocation_time, reason)
+            journal_position = journal_revocations(conn, [ record ])
+
+            conn.commit()
+        except sqlite3.IntegrityError:
+            # The UNIQUE index on issued_certificate_id, when another process
+            # revoked the certificate first.
+            conn.rollback()
+            undo_journal_revocations(journal_position)
+            raise Exception("Certificate id {0} is already revoked.".format(certificate_id))
+        except:
+            conn.rollback()
+            undo_journal_revocations(journal_position)
+            raise
+
+    for listener in revocation_listeners:
+        listener(record.revoked_certificate_id, record.serial)
+
+def insert_revocation(cur, certificate_id, serial, revocation_time, reason):
+    # Returns the journal record of the revocation.
     values = {
         "issued_certificate_id": certificate_id,
         "reason": reason,
         "revocation_date": utils.to_timestamp_milis(revocation_time)
     }
 
-    add_plaintext_revocation_entry(serial, revocation_time, reason)
+    cur.execute("""INSERT INTO revoked_certificate (
+    issued_certificate_id,
+    revocation_date,
+    reason
+) VALUES(
+    :issued_certificate_id,
+    :revocation_date,
+    :reason
+);""",
+        values
+    )
+
+    record = revjournal.JournalRecord(cur.lastrowid, certificate_id, values["revocation_date"], int(serial, 16), reason)
+
+    insert_revoked_entry(
+        cur.connection,
+        record.revoked_certificate_id,
+        record.serial,
+        utils.from_timestamp_milis(record.revocation_date),
+        reason
+    )
+
+    return record
 
+def get_revocation_journal():
+    return revjournal.RevocationJournal(common.make_path_from_config_dir(revjournal.journal_name))
+
+def make_journal_record(row):
+    return revjournal.JournalRecord(row[0], row[1], row[2], int(row[3], 16), row[4])
+
+def journal_revocations(conn, records):
+    # Appends the records of the current write transaction to the journal
+    # before it is committed, see revjournal. Returns what
+    # undo_journal_revocations needs if the commit fails.
+    journal = get_revocation_journal()
+
+    if not journal.exists():
+        # The first journaled transaction also records the earlier
+        # revocations, its own being already in the table.
+        records = [ make_journal_record(row) for row in iter_revocation_rows(conn) ]
+
+    return (journal, journal.append(records))
+
+def undo_journal_revocations(journal_position):
+    if journal_position is None:
+        return
+
+    journal, size = journal_position
+    journal.truncate(size)
+
+def iter_revocation_rows(conn):
+    # In the order of the journal, with the values of its records.
+    cur = conn.execute("""SELECT
+    rc.revoked_certificate_id,
+    rc.issued_certificate_id,
+    rc.revocation_date,
+    ic.serial,
+    rc.reason
+FROM revoked_certificate AS rc
+INNER JOIN issued_certificate AS ic ON ic.issued_certificate_id = rc.issued_certificate_id
+ORDER BY rc.revoked_certificate_id;""")
+
+    with AutoClose(cur):
+        rows = cur.fetchmany(fetch_chunk_size)
+        while len(rows) > 0:
+            for row in rows:
+                yield row
+
+            rows = cur.fetchmany(fetch_chunk_size)
+
+@timings.timed("db.init_journal")
+def init_revocation_journal():
+    # Writes the journal of the revocations made before it existed.
     conn = get_connection()
-    insert_cur = conn.cursor()
-    insert_cur.execute("""INSERT INTO revoked_certificate (
+
+    begin_write_transaction(conn)
+
+    try:
+        if get_revocation_journal().exists():
+            raise Exception("The revocation journal already exists.")
+
+        journal_revocations(conn, [])
+
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+
+@timings.timed("db.replay")
+def replay_revocations(records):
+    # Inserts the journaled revocations missing from the database with their
+    # original ids. Returns the applied records and the skipped ones with the
+    # reason they were skipped.
+    conn = get_connection()
+
+    begin_write_transaction(conn)
+
+    applied = []
+    skipped = []
+
+    cur = conn.cursor()
+    with AutoClose(cur):
+        try:
+            for record in records:
+                cur.execute(
+                    "SELECT serial FROM issued_certificate WHERE issued_certificate_id = :id;",
+                    {"id": record.issued_certificate_id}
+                )
+
+                row = cur.fetchone()
+                if row is None or int(row[0], 16) != record.serial:
+                    skipped.append((record, "certificate not found"))
+                    continue
+
+                cur.execute(
+                    "SELECT 1 FROM revoked_certificate WHERE revoked_certificate_id = :revoked_id OR issued_certificate_id = :id;",
+                    {"revoked_id": record.revoked_certificate_id, "id": record.issued_certificate_id}
+                )
+
+                if not cur.fetchone() is None:
+                    skipped.append((record, "conflicting revocation"))
+                    continue
+
+                cur.execute("""INSERT INTO revoked_certificate (
+    revoked_certificate_id,
     issued_certificate_id,
     revocation_date,
     reason
 ) VALUES(
+    :revoked_certificate_id,
     :issued_certificate_id,
     :revocation_date,
     :reason
 );""",
-        values
+                    {
+                        "revoked_certificate_id": record.revoked_certificate_id,
+                        "issued_certificate_id": record.issued_certificate_id,
+                        "revocation_date": record.revocation_date,
+                        "reason": record.reason
+                    }
+                )
+
+                insert_revoked_entry(
+                    conn,
+                    record.revoked_certificate_id,
+                    record.serial,
+                    utils.from_timestamp_milis(record.revocation_date),
+                    record.reason
+                )
+
+                applied.append(record)
+
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+    return (applied, skipped)
+
+def find_revocation_targets(conn, certificate_ids, serials, subject_like):
+    # Matches every target in one query, the ids and serials going through a
+    # temporary table rather than one lookup each.
+    execute_schema_statement(conn, "CREATE TEMP TABLE IF NOT EXISTS revocation_target (kind TEXT NOT NULL, value NOT NULL);")
+    execute_schema_statement(conn, "DELETE FROM temp.revocation_target;")
+
+    conn.executemany(
+        "INSERT INTO temp.revocation_target (kind, value) VALUES('id', ?);",
+        [ (certificate_id,) for certificate_id in certificate_ids ]
+    )
+    conn.executemany(
+        "INSERT INTO temp.revocation_target (kind, value) VALUES('serial', ?);",
+        [ (utils.format_serial(serial),) for serial in serials ]
+    )
+
+    conditions = [
+        "ic.issued_certificate_id IN (SELECT value FROM temp.revocation_target WHERE kind = 'id')",
+        "ic.serial IN (SELECT value FROM temp.revocation_target WHERE kind = 'serial')",
+    ]
+    values = dict()
+
+    if not subject_like is None:
+        conditions.append("ic.subject LIKE :subject_like")
+        values["subject_like"] = subject_like
+
+    return list(iter_certificates_by_filter(
+        conn,
+        "(" + " OR ".join(conditions) + ")",
+        values,
+        order_by = "ic.issued_certificate_id"
+    ))
+
+@timings.timed("db.revoke")
+def revoke_certificates(revocation_time, certificate_ids = None, serials = None, subject_like = None, reason = None, dry_run = False):
+    # Validates and revokes all the targets in a single write transaction.
+    # Returns the revoked records and the skipped targets with the reason they
+    # were skipped.
+    if reason is None:
+        reason = "unspecified"
+
+    certificate_ids = [] if certificate_ids is None else certificate_ids
+    serials = [] if serials is None else serials
+
+    conn = get_connection()
+
+    begin_write_transaction(conn)
+
+    revoked = []
+    skipped = []
+    revocations = []
+    journal_position = None
+
+    insert_cur = conn.cursor()
+    with AutoClose(insert_cur):
+        try:
+            records = find_revocation_targets(conn, certificate_ids, serials, subject_like)
+
+            found_ids = set([ record.id for record in records ])
+            found_serials = set([ record.serial for record in records ])
+
+            for certificate_id in certificate_ids:
+                if not certificate_id in found_ids:
+                    skipped.append(("id {0}".format(certificate_id), "not found"))
+
+            for serial in serials:
+                if not serial in found_serials:
+                    skipped.append(("serial " + utils.format_serial(serial), "not found"))
+
+            for record in records:
+                target = "id {0}".format(record.id)
+
+                if record.is_self_signed:
+                    skipped.append((target, "self-signed"))
+                elif record.is_revoked:
+                    skipped.append((target, "already revoked"))
+                elif revocation_time > record.not_after_date:
+                    skipped.append((target, "expired"))
+                else:
+                    revoked.append(record)
+
+            if dry_run:
+                conn.rollback()
+                return (revoked, skipped)
+
+            for record in revoked:
+                revocations.append(insert_revocation(insert_cur, record.id, record.formatted_serial, revocation_time, reason))
+
+            # One journal write and fsync for the whole transaction.
+            if len(revocations) > 0:
+                journal_position = journal_revocations(conn, revocations)
+
+            conn.commit()
+        except:
+            conn.rollback()
+            undo_journal_revocations(journal_position)
+            raise
+
+    for journal_record in revocations:
+        for listener in revocation_listeners:
+            listener(journal_record.revoked_certificate_id, journal_record.serial)
+
+    return (revoked, skipped)
+
+def insert_revoked_entry(conn, revoked_certificate_id, serial, revocation_date, reason):
+    entry = crlenc.encode_revoked_entry(serial, revocation_date, reason)
+
+    cur = conn.execute("""INSERT INTO revoked_certificate_entry (
+    revoked_certificate_id,
+    der
+) VALUES(
+    :revoked_certificate_id,
+    :der
+);""",
+        {"revoked_certificate_id": revoked_certificate_id, "der": entry}
     )
+    cur.close()
 
-    conn.commit()
-    insert_cur.close()
+    return entry
 
-def get_certificates_for_crl(time_ref):
+def iter_crl_entries(time_ref, base_revoked_certificate_id = None, last_revoked_certificate_id = None, crl_partition = None):
+    # A delta CRL lists the revocations above the last one covered by its
+    # base CRL, whatever their date, as a revocation may be committed after
+    # the base CRL while being dated before it.
     conn = get_connection()
 
-    array = get_certificates_by_filter(
+    sql_filter = ":time_ref < ic.not_after_date"
+    values = {"time_ref": utils.to_timestamp_milis(time_ref)}
+
+    if not base_revoked_certificate_id is None:
+        sql_filter = sql_filter + " AND rc.revoked_certificate_id > :base_revoked_certificate_id"
+        values["base_revoked_certificate_id"] = base_revoked_certificate_id
+
+    if not last_revoked_certificate_id is None:
+        sql_filter = sql_filter + " AND rc.revoked_certificate_id <= :last_revoked_certificate_id"
+        values["last_revoked_certificate_id"] = last_revoked_certificate_id
+
+    if not crl_partition is None:
+        sql_filter = sql_filter + " AND ic.crl_partition = :crl_partition"
+        values["crl_partition"] = crl_partition
+
+    cur = conn.cursor()
+    with AutoClose(cur):
+        cur.execute("""SELECT
+    rce.der,
+    rc.revoked_certificate_id,
+    ic.serial,
+    rc.revocation_date,
+    rc.reason
+FROM issued_certificate AS ic
+INNER JOIN revoked_certificate AS rc ON ic.issued_certificate_id = rc.issued_certificate_id
+LEFT JOIN revoked_certificate_entry AS rce ON rc.revoked_certificate_id = rce.revoked_certificate_id
+WHERE """ + sql_filter + ";",
+            values
+        )
+
+        rows = cur.fetchmany(fetch_chunk_size)
+        while len(rows) > 0:
+            for row in rows:
+                if not row[0] is None:
+                    yield row[0]
+                else:
+                    yield crlenc.encode_revoked_entry(int(row[2], 16), utils.from_timestamp_milis(row[3]), row[4])
+
+            rows = cur.fetchmany(fetch_chunk_size)
+
+def iter_certificates_expiring_between(start, end, include_revoked = False, include_renewed = False):
+    # Range over ix_issued_certificate_not_after_date. Authority certificates
+    # are left out, and by default so are the revoked and already renewed ones.
+    conn = get_connection()
+
+    # The unary + keeps the planner off ix_issued_certificate_is_self_signed,
+    # which would read and sort every certificate.
+    sql_filter = ":start <= ic.not_after_date AND ic.not_after_date < :end AND +ic.is_self_signed = 0"
+    if not include_revoked:
+        sql_filter = sql_filter + " AND rc.revoked_certificate_id IS NULL"
+
+    if not include_renewed:
+        sql_filter = sql_filter + """ AND NOT EXISTS (SELECT 1
+    FROM certificate_renewal AS cr
+    WHERE cr.issued_certificate_id = ic.issued_certificate_id
+)"""
+
+    return iter_certificates_by_filter(
+        conn,
+        sql_filter,
+        {
+            "start": utils.to_timestamp_milis(start),
+            "end": utils.to_timestamp_milis(end)
+        },
+        order_by = "ic.not_after_date"
+    )
+
+def iter_certificates_for_static_ocsp(time_ref, include_current = False):
+    conn = get_connection()
+
+    sql_filter = ":time_ref < ic.not_after_date"
+    if not include_current:
+        sql_filter = sql_filter + """ AND NOT EXISTS (SELECT 1
+    FROM static_ocsp_response AS sor
+    WHERE sor.issued_certificate_id = ic.issued_certificate_id
+        AND sor.refresh_date > :time_ref
+        AND sor.is_revoked = (rc.revoked_certificate_id IS NOT NULL)
+)"""
+
+    return iter_certificates_by_filter(
         conn,
-        ":time_ref < ic.not_after_date AND rc.revoked_certificate_id IS NOT NULL",
+        sql_filter,
         {"time_ref": utils.to_timestamp_milis(time_ref)}
     )
 
-    return array
+@timings.timed("db.record_ocsp")
+def record_static_ocsp_responses(responses):
+    conn = get_connection()
+
+    values = []
+    for certificate_id, is_revoked, this_update, refresh_time in responses:
+        values.append({
+            "issued_certificate_id": certificate_id,
+            "is_revoked": is_revoked,
+            "this_update_date": utils.to_timestamp_milis(this_update),
+            "refresh_date": utils.to_timestamp_milis(refresh_time)
+        })
 
+    begin_write_transaction(conn)
+
+    cur = conn.cursor()
+    with AutoClose(cur):
+        try:
+            cur.executemany("""INSERT OR REPLACE INTO static_ocsp_response (
+    issued_certificate_id,
+    is_revoked,
+    this_update_date,
+    refresh_date
+) VALUES(
+    :issued_certificate_id,
+    :is_revoked,
+    :this_update_date,
+    :refresh_date
+);""",
+                values
+            )
+
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+@timings.timed("db.find_base_crl")
+def find_latest_base_crl():
+    conn = get_connection()
+
+    cur = conn.cursor()
+    with AutoClose(cur):
+        cur.execute("""SELECT rl.revocation_list_id, rl.date_created, rl.last_revoked_certificate_id
+FROM revocation_list AS rl
+WHERE rl.base_crl_number IS NULL AND rl.crl_partition IS NULL
+ORDER BY rl.revocation_list_id DESC
+LIMIT 1;""")
+
+        row = cur.fetchone()
+        if row is None:
+            return None
+
+        return (row[0], utils.from_timestamp_milis(row[1]), row[2])
+
+def find_latest_partition_crls():
+    # (partition, number, next update date) of the latest CRL of each
+    # partition.
+    conn = get_connection()
+
+    cur = conn.cursor()
+    with AutoClose(cur):
+        cur.execute("""SELECT rl.crl_partition, rl.revocation_list_id, rl.next_update_date
+FROM revocation_list AS rl
+WHERE rl.crl_partition IS NOT NULL AND rl.revocation_list_id = (SELECT MAX(rl2.revocation_list_id)
+    FROM revocation_list AS rl2
+    WHERE rl2.crl_partition = rl.crl_partition
+)
+ORDER BY rl.crl_partition;""")
+
+        return [ (row[0], row[1], utils.from_timestamp_milis(row[2])) for row in cur.fetchall() ]
+
+@timings.timed("db.crl_number")
 def get_next_crl_number():
     conn = get_connection()
 
@@ -209,49 +1008,173 @@ FROM revocation_list AS rl;""")
 
         return value + 1
 
-def add_crl_to_db(crl, date_created):
+@timings.timed("db.add_crl")
+def add_crl_to_db(crl, date_created, last_revoked_certificate_id, crl_partition = None):
     conn = get_connection()
 
     number = crl.extensions.get_extension_for_class(x509.CRLNumber).value.crl_number
     utc_next_update = utils.make_utc_datetime_aware(crl.next_update)
     utc_last_update = utils.make_utc_datetime_aware(crl.last_update)
 
+    base_crl_number = None
+    try:
+        base_crl_number = crl.extensions.get_extension_for_class(x509.DeltaCRLIndicator).value.crl_number
+    except x509.ExtensionNotFound:
+        pass
+
     values = {
         "revocation_list_id": number,
         "date_created": utils.to_timestamp_milis(date_created),
         "update_date": utils.to_timestamp_milis(utc_last_update),
         "next_update_date": utils.to_timestamp_milis(utc_next_update),
+        "base_crl_number": base_crl_number,
+        "crl_partition": crl_partition,
+        "last_revoked_certificate_id": last_revoked_certificate_id,
     }
 
+    begin_write_transaction(conn)
+
     cur = conn.cursor()
-    cur.execute("""INSERT INTO revocation_list (
+    with AutoClose(cur):
+        try:
+            cur.execute("""INSERT INTO revocation_list (
     revocation_list_id,
     date_created,
     update_date,
-    next_update_date
+    next_update_date,
+    base_crl_number,
+    crl_partition,
+    last_revoked_certificate_id
 ) VALUES(
     :revocation_list_id,
     :date_created,
     :update_date,
-    :next_update_date
+    :next_update_date,
+    :base_crl_number,
+    :crl_partition,
+    :last_revoked_certificate_id
 );""",
-        values
-    )
+                values
+            )
 
-    conn.commit()
-    cur.close()
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
 
 def get_active_certificates():
+    return list(iter_active_certificates())
+
+def get_certificate_counts(time_ref, expiring_before):
+    # Read from the summary maintained by triggers, so the cost depends on the
+    # number of expiry hours, not of certificates. A certificate is counted
+    # as active until the end of the hour it expires in.
     conn = get_connection()
 
-    array = get_certificates_by_filter(
+    cur = conn.cursor()
+    with AutoClose(cur):
+        cur.execute("""SELECT
+    COALESCE(SUM(ces.issued_count), 0),
+    COALESCE(SUM(ces.revoked_count), 0),
+    COALESCE(SUM(CASE WHEN ces.expiry_bucket >= :current_bucket THEN ces.issued_count - ces.revoked_count END), 0),
+    COALESCE(SUM(CASE WHEN ces.expiry_bucket >= :current_bucket THEN ces.revoked_count END), 0),
+    COALESCE(SUM(CASE WHEN ces.expiry_bucket >= :current_bucket AND ces.expiry_bucket < :expiring_bucket
+        THEN ces.issued_count - ces.revoked_count END), 0)
+FROM certificate_expiry_summary AS ces;""",
+            {
+                "current_bucket": utils.to_timestamp_milis(time_ref) // expiry_bucket_size,
+                "expiring_bucket": utils.to_timestamp_milis(expiring_before) // expiry_bucket_size,
+            }
+        )
+
+        return cur.fetchone()
+
+def get_crl_summaries():
+    # (kind, number, update date, next update date) of the latest CRL of each
+    # kind.
+    conn = get_connection()
+
+    cur = conn.cursor()
+    with AutoClose(cur):
+        cur.execute("""SELECT rls.kind, rls.revocation_list_id, rls.update_date, rls.next_update_date
+FROM revocation_list_summary AS rls
+ORDER BY rls.kind;""")
+
+        return [ (row[0], row[1], utils.from_timestamp_milis(row[2]), utils.from_timestamp_milis(row[3])) for row in cur.fetchall() ]
+
+def rebuild_metrics_summary(conn):
+    # Recomputes the summaries from the tables, within the transaction of the
+    # caller.
+    execute_schema_statement(conn, "DELETE FROM certificate_expiry_summary;")
+    execute_schema_statement(conn, """INSERT INTO certificate_expiry_summary (expiry_bucket, issued_count, revoked_count)
+SELECT ic.not_after_date / {0:d}, COUNT(*), COUNT(rc.revoked_certificate_id)
+FROM issued_certificate AS ic
+LEFT JOIN revoked_certificate AS rc ON rc.issued_certificate_id = ic.issued_certificate_id
+GROUP BY ic.not_after_date / {0:d};""".format(expiry_bucket_size))
+
+    execute_schema_statement(conn, "DELETE FROM revocation_list_summary;")
+    for kind, kind_filter in crl_summary_kinds:
+        execute_schema_statement(conn, """INSERT INTO revocation_list_summary (kind, revocation_list_id, update_date, next_update_date)
+SELECT '{0}', rl.revocation_list_id, rl.update_date, rl.next_update_date
+FROM revocation_list AS rl
+WHERE {1}
+ORDER BY rl.revocation_list_id DESC
+LIMIT 1;""".format(kind, kind_filter.format("rl.")))
+
+def rebuild_metrics():
+    conn = get_connection()
+
+    begin_write_transaction(conn)
+    try:
+        rebuild_metrics_summary(conn)
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+
+def iter_active_certificates(
+    revoked = None,
+    expiring_before = None,
+    subject_like = None,
+    self_signed = None,
+    after_id = None,
+    limit = None
+):
+    # The filters left to None are not applied. Pages come in id order, so a
+    # page ends at the id to pass as after_id for the next one, while a full
+    # listing ranges over ix_issued_certificate_not_after_date instead.
+    conn = get_connection()
+
+    sql_filter = ":current_utc_date < ic.not_after_date"
+    values = {"current_utc_date": utils.to_timestamp_milis(utils.utc_now())}
+
+    if not revoked is None:
+        sql_filter = sql_filter + " AND rc.revoked_certificate_id IS " + ("NOT NULL" if revoked else "NULL")
+
+    if not expiring_before is None:
+        sql_filter = sql_filter + " AND ic.not_after_date < :expiring_before"
+        values["expiring_before"] = utils.to_timestamp_milis(expiring_before)
+
+    if not subject_like is None:
+        sql_filter = sql_filter + " AND ic.subject LIKE :subject_like"
+        values["subject_like"] = subject_like
+
+    if not self_signed is None:
+        sql_filter = sql_filter + " AND ic.is_self_signed = :self_signed"
+        values["self_signed"] = 1 if self_signed else 0
+
+    if not after_id is None:
+        sql_filter = sql_filter + " AND ic.issued_certificate_id > :after_id"
+        values["after_id"] = after_id
+
+    return iter_certificates_by_filter(
         conn,
-        ":current_utc_date < ic.not_after_date",
-        {"current_utc_date": utils.to_timestamp_milis(utils.utc_now())}
+        sql_filter,
+        values,
+        order_by = None if after_id is None and limit is None else "ic.issued_certificate_id",
+        limit = limit
     )
 
-    return array
-
 class AutoClose:
 
     def __init__(self, obj):
@@ -263,18 +1186,14 @@ class AutoClose:
     def __exit__(self, exec_type, exec_value, traceback):
         self.obj.close()
 
-def add_plaintext_revocation_entry(serial, time, reason):
-    entry = [ \
-       str(utils.to_timestamp_milis(time)), \
-       serial, \
-       reason \
-    ]
+fetch_chunk_size = 1024
 
-    log_path = common.make_path_from_config_dir("revocation.log")
-    with open(log_path, "a") as log:
-        log.write((",".join(entry)) + "\n")
+def get_certificates_by_filter(conn, sql_filter, values, order_by = None, limit = None):
+    return list(iter_certificates_by_filter(conn, sql_filter, values, order_by = order_by, limit = limit))
 
-def get_certificates_by_filter(conn, sql_filter, values):
+def iter_certificates_by_filter(conn, sql_filter, values, order_by = None, limit = None, chunk_size = fetch_chunk_size):
+    # order_by is a list of columns of the query, while limit is bound as a
+    # parameter.
     cur = conn.cursor()
 
     full_query = """SELECT
@@ -290,44 +1209,72 @@ def get_certificates_by_filter(conn, sql_filter, values):
     rc.reason
 FROM issued_certificate AS ic
 LEFT JOIN revoked_certificate AS rc ON ic.issued_certificate_id = rc.issued_certificate_id
-WHERE """ + sql_filter +  ";"
+WHERE """ + sql_filter
+
+    if not order_by is None:
+        full_query = full_query + "\nORDER BY " + order_by
+
+    if not limit is None:
+        full_query = full_query + "\nLIMIT :limit"
+        values = dict(values, limit = limit)
+
+    full_query = full_query + ";"
 
     with AutoClose(cur):
         cur.execute(full_query, values);
 
-        results = []
+        rows = cur.fetchmany(chunk_size)
+        while len(rows) > 0:
+            for row in rows:
+                yield IssuedCertificate(row)
 
-        row = cur.fetchone()
-        while not row is None:
-            ic = IssuedCertificate(
-                issued_certificate_id = row[0],
-                date_created = utils.from_timestamp_milis(row[1]),
-                not_before_date = utils.from_timestamp_milis(row[2]),
-                not_after_date = utils.from_timestamp_milis(row[3]),
-                serial = int(row[4], 16),
-                subject = row[5],
-                is_self_signed = bool(row[6]),
-                is_revoked = not row[7] is None,
-                revocation_date = None if row[8] is None else utils.from_timestamp_milis(row[8]),
-                revocation_reason = row[9]
-            )
+            rows = cur.fetchmany(chunk_size)
+
+# Seconds sqlite3 waits for the lock of another writer, then attempts of
+# begin_write_transaction, whose backoff comes on top of it.
+busy_timeout = 5.0
+begin_attempts = 5
+begin_backoff = 0.05
+
+def is_busy_error(e):
+    message = str(e)
+
+    return "database is locked" in message or "database is busy" in message
+
+def begin_write_transaction(conn):
+    # Takes the write lock up front, so a transaction never fails half way
+    # through when upgrading its lock, and waits for the other writers.
+    attempt = 1
+    while True:
+        try:
+            begin_cur = conn.execute("BEGIN IMMEDIATE;")
+            begin_cur.close()
 
-            results.append(ic)
-            row = cur.fetchone()
+            return
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt >= begin_attempts:
+                raise
 
-        return results
+        time.sleep(begin_backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+        attempt = attempt + 1
 
 def get_connection():
     global database_connection
 
     if database_connection is None:
-        db_path = common.make_path_from_config_dir("db.sqlite")
-        database_connection = sqlite3.connect(db_path)
-        
-        pragma_cur = database_connection.execute("PRAGMA foreign_keys = ON;")
-        pragma_cur.close()
+        with timings.phase("db.connect"):
+            db_path = common.make_path_from_config_dir("db.sqlite")
+            database_connection = sqlite3.connect(db_path, timeout = busy_timeout)
+
+            pragma_cur = database_connection.execute("PRAGMA foreign_keys = ON;")
+            pragma_cur.close()
+
+            # Readers no longer block the writer and the other way around. The
+            # mode is persistent, so this only converts the database once.
+            pragma_cur = database_connection.execute("PRAGMA journal_mode = WAL;")
+            pragma_cur.close()
 
-        create_tables(database_connection)
+            create_tables(database_connection)
 
     return database_connection
 
@@ -346,14 +1293,319 @@ WHERE type = 'table' AND name = :table_name;
             return False
 
         create_cur = conn.execute(create_statement)
-        conn.commit()
         create_cur.close()
 
         return True
 
-def create_tables(conn):
+def execute_schema_statement(conn, statement):
+    cur = conn.execute(statement)
+    cur.close()
+
+def migrate_to_v1(conn):
     create_table_if_not_exists(conn, "issued_certificate", issued_certificate_create)
     create_table_if_not_exists(conn, "revoked_certificate", revoked_certificate_create)
     create_table_if_not_exists(conn, "revocation_list", revocation_list_create)
 
+def migrate_to_v2(conn):
+    # The original column had no type, so joins against the INTEGER primary key
+    # of issued_certificate could not use an index on it.
+    execute_schema_statement(conn, """CREATE TABLE revoked_certificate_v2 (
+    revoked_certificate_id INTEGER NOT NULL PRIMARY KEY,
+    issued_certificate_id INTEGER NOT NULL,
+    revocation_date INT NOT NULL,
+    reason TEXT NOT NULL,
+    FOREIGN KEY (issued_certificate_id) REFERENCES issued_certificate(issued_certificate_id)
+);""")
+    execute_schema_statement(conn, """INSERT INTO revoked_certificate_v2
+SELECT revoked_certificate_id, issued_certificate_id, revocation_date, reason
+FROM revoked_certificate;""")
+    execute_schema_statement(conn, "DROP TABLE revoked_certificate;")
+    execute_schema_statement(conn, "ALTER TABLE revoked_certificate_v2 RENAME TO revoked_certificate;")
+
+    # Range scans over the expiry date for active certificates and CRLs.
+    execute_schema_statement(conn, """CREATE INDEX IF NOT EXISTS ix_issued_certificate_not_after_date
+ON issued_certificate (not_after_date);""")
+
+    # Covers the MAX(issued_certificate_id) lookup of the current authority.
+    execute_schema_statement(conn, """CREATE INDEX IF NOT EXISTS ix_issued_certificate_is_self_signed
+ON issued_certificate (is_self_signed, issued_certificate_id);""")
+
+    # Covers the revocation columns of the LEFT JOIN in get_certificates_by_filter.
+    execute_schema_statement(conn, """CREATE INDEX IF NOT EXISTS ix_revoked_certificate_issued_certificate_id
+ON revoked_certificate (issued_certificate_id, revoked_certificate_id, revocation_date, reason);""")
+
+def migrate_to_v3(conn):
+    # Delta CRLs record the number of the base CRL they were generated against.
+    execute_schema_statement(conn, "ALTER TABLE revocation_list ADD COLUMN base_crl_number INT;")
+
+def migrate_to_v4(conn):
+    # Cache of the DER-encoded revokedCertificates entries, which never change
+    # once written, so CRL generation only has to concatenate them.
+    execute_schema_statement(conn, """CREATE TABLE revoked_certificate_entry (
+    revoked_certificate_id INTEGER NOT NULL PRIMARY KEY,
+    der BLOB NOT NULL,
+    FOREIGN KEY (revoked_certificate_id) REFERENCES revoked_certificate(revoked_certificate_id)
+);""")
+
+    cur = conn.execute("""SELECT rc.revoked_certificate_id, ic.serial, rc.revocation_date, rc.reason
+FROM revoked_certificate AS rc
+INNER JOIN issued_certificate AS ic ON ic.issued_certificate_id = rc.issued_certificate_id;""")
+
+    with AutoClose(cur):
+        for row in cur.fetchall():
+            insert_revoked_entry(conn, row[0], int(row[1], 16), utils.from_timestamp_milis(row[2]), row[3])
+
+def migrate_to_v5(conn):
+    # Partition of the CRL each certificate is listed in, and the partition
+    # each CRL covers, NULL standing for the complete CRL.
+    execute_schema_statement(conn, "ALTER TABLE issued_certificate ADD COLUMN crl_partition INT;")
+    execute_schema_statement(conn, "ALTER TABLE revocation_list ADD COLUMN crl_partition INT;")
+
+    execute_schema_statement(conn, """CREATE INDEX IF NOT EXISTS ix_issued_certificate_crl_partition
+ON issued_certificate (crl_partition, not_after_date);""")
+
+def migrate_to_v6(conn):
+    # State of the pre-generated responses written by mca-gen-ocsp, so only
+    # the due or changed ones are signed again.
+    execute_schema_statement(conn, """CREATE TABLE static_ocsp_response (
+    issued_certificate_id INTEGER NOT NULL PRIMARY KEY,
+    is_revoked INT NOT NULL,
+    this_update_date INT NOT NULL,
+    refresh_date INT NOT NULL,
+    FOREIGN KEY (issued_certificate_id) REFERENCES issued_certificate(issued_certificate_id)
+);""")
+
+def migrate_to_v7(conn):
+    # Serials handed out by reserve_certificate_serials and not yet used by an
+    # issued certificate.
+    execute_schema_statement(conn, """CREATE TABLE serial_reservation (
+    serial TEXT NOT NULL PRIMARY KEY,
+    reserved_date INT NOT NULL,
+    expiry_date INT NOT NULL
+);""")
+
+    execute_schema_statement(conn, """CREATE INDEX IF NOT EXISTS ix_serial_reservation_expiry_date
+ON serial_reservation (expiry_date);""")
+
+def migrate_to_v8(conn):
+    # The certificates themselves, so they can be loaded without the files.
+    execute_schema_statement(conn, "ALTER TABLE issued_certificate ADD COLUMN der BLOB;")
+
+    cur = conn.execute("SELECT issued_certificate_id, serial FROM issued_certificate;")
+
+    with AutoClose(cur):
+        for row in cur.fetchall():
+            try:
+                certificate = common.load_certificate_by_serial(row[1])
+            except FileNotFoundError:
+                continue
+
+            update_cur = conn.execute(
+                "UPDATE issued_certificate SET der = :der WHERE issued_certificate_id = :id;",
+                {"der": certificate.public_bytes(serialization.Encoding.DER), "id": row[0]}
+            )
+            update_cur.close()
+
+def migrate_to_v9(conn):
+    # Values derived from the authority certificates, filled by gen_ca_cert or
+    # on first use by authority.get_authority_context.
+    execute_schema_statement(conn, """CREATE TABLE authority_context (
+    issued_certificate_id INTEGER NOT NULL PRIMARY KEY,
+    key_identifier BLOB NOT NULL,
+    spki_sha256 BLOB NOT NULL,
+    ocsp_sha1_name_hash BLOB NOT NULL,
+    ocsp_sha1_key_hash BLOB NOT NULL,
+    ocsp_sha256_name_hash BLOB NOT NULL,
+    ocsp_sha256_key_hash BLOB NOT NULL,
+    FOREIGN KEY (issued_certificate_id) REFERENCES issued_certificate(issued_certificate_id)
+);""")
 
+def migrate_to_v10(conn):
+    # Certificates re-issued by mca-renew, so a renewal wave run again skips
+    # the certificates it already replaced.
+    execute_schema_statement(conn, """CREATE TABLE certificate_renewal (
+    issued_certificate_id INTEGER NOT NULL PRIMARY KEY,
+    renewal_certificate_id INTEGER NOT NULL,
+    date_created INT NOT NULL,
+    FOREIGN KEY (issued_certificate_id) REFERENCES issued_certificate(issued_certificate_id),
+    FOREIGN KEY (renewal_certificate_id) REFERENCES issued_certificate(issued_certificate_id)
+);""")
+
+def migrate_to_v11(conn):
+    # A certificate is revoked once. Duplicates left by concurrent
+    # revocations keep their earliest revocation.
+    duplicate_filter = """revoked_certificate_id NOT IN (SELECT MIN(revoked_certificate_id)
+    FROM revoked_certificate
+    GROUP BY issued_certificate_id
+)"""
+
+    # The removed rows are reported, so no revocation disappears untraced.
+    cur = conn.execute("""SELECT
+    rc.revoked_certificate_id,
+    rc.issued_certificate_id,
+    ic.serial,
+    rc.revocation_date,
+    rc.reason,
+    (SELECT MIN(rc_kept.revoked_certificate_id)
+        FROM revoked_certificate AS rc_kept
+        WHERE rc_kept.issued_certificate_id = rc.issued_certificate_id
+    )
+FROM revoked_certificate AS rc
+LEFT JOIN issued_certificate AS ic ON ic.issued_certificate_id = rc.issued_certificate_id
+WHERE rc.""" + duplicate_filter + """
+ORDER BY rc.revoked_certificate_id;""")
+
+    with AutoClose(cur):
+        for row in cur.fetchall():
+            print("Schema migration: removing duplicate revocation id {0} of certificate id {1} (serial {2}, revoked on {3}, reason {4}), keeping revocation id {5}.".format(
+                row[0],
+                row[1],
+                row[2],
+                utils.from_timestamp_milis(row[3]).isoformat(),
+                row[4],
+                row[5]
+            ), file = sys.stderr)
+
+    execute_schema_statement(conn, """DELETE FROM revoked_certificate_entry
+WHERE revoked_certificate_id IN (SELECT revoked_certificate_id FROM revoked_certificate WHERE """ + duplicate_filter + ");")
+    execute_schema_statement(conn, "DELETE FROM revoked_certificate WHERE " + duplicate_filter + ";")
+
+    execute_schema_statement(conn, """CREATE UNIQUE INDEX IF NOT EXISTS ux_revoked_certificate_issued_certificate_id
+ON revoked_certificate (issued_certificate_id);""")
+
+def migrate_to_v12(conn):
+    # Counts of certificates by expiry hour and the latest CRLs, maintained by
+    # triggers so mca-metrics reads them in constant time.
+    execute_schema_statement(conn, """CREATE TABLE certificate_expiry_summary (
+    expiry_bucket INTEGER NOT NULL PRIMARY KEY,
+    issued_count INT NOT NULL,
+    revoked_count INT NOT NULL
+);""")
+
+    execute_schema_statement(conn, """CREATE TABLE revocation_list_summary (
+    kind TEXT NOT NULL PRIMARY KEY,
+    revocation_list_id INT NOT NULL,
+    update_date INT NOT NULL,
+    next_update_date INT NOT NULL
+);""")
+
+    issued_bucket = "NEW.not_after_date / {0:d}".format(expiry_bucket_size)
+    deleted_bucket = "OLD.not_after_date / {0:d}".format(expiry_bucket_size)
+    revoked_bucket = """(SELECT ic.not_after_date / {0:d}
+        FROM issued_certificate AS ic
+        WHERE ic.issued_certificate_id = {1}.issued_certificate_id)"""
+
+    execute_schema_statement(conn, """CREATE TRIGGER tr_issued_certificate_insert_summary
+AFTER INSERT ON issued_certificate
+BEGIN
+    INSERT INTO certificate_expiry_summary (expiry_bucket, issued_count, revoked_count)
+    VALUES (""" + issued_bucket + """, 1, 0)
+    ON CONFLICT (expiry_bucket) DO UPDATE SET issued_count = issued_count + 1;
+END;""")
+
+    execute_schema_statement(conn, """CREATE TRIGGER tr_issued_certificate_delete_summary
+AFTER DELETE ON issued_certificate
+BEGIN
+    UPDATE certificate_expiry_summary SET issued_count = issued_count - 1
+    WHERE expiry_bucket = """ + deleted_bucket + """;
+END;""")
+
+    execute_schema_statement(conn, """CREATE TRIGGER tr_revoked_certificate_insert_summary
+AFTER INSERT ON revoked_certificate
+BEGIN
+    UPDATE certificate_expiry_summary SET revoked_count = revoked_count + 1
+    WHERE expiry_bucket = """ + revoked_bucket.format(expiry_bucket_size, "NEW") + """;
+END;""")
+
+    execute_schema_statement(conn, """CREATE TRIGGER tr_revoked_certificate_delete_summary
+AFTER DELETE ON revoked_certificate
+BEGIN
+    UPDATE certificate_expiry_summary SET revoked_count = revoked_count - 1
+    WHERE expiry_bucket = """ + revoked_bucket.format(expiry_bucket_size, "OLD") + """;
+END;""")
+
+    for kind, kind_filter in crl_summary_kinds:
+        execute_schema_statement(conn, """CREATE TRIGGER tr_revocation_list_insert_{0}_summary
+AFTER INSERT ON revocation_list
+WHEN {1}
+BEGIN
+    INSERT INTO revocation_list_summary (kind, revocation_list_id, update_date, next_update_date)
+    VALUES ('{0}', NEW.revocation_list_id, NEW.update_date, NEW.next_update_date)
+    ON CONFLICT (kind) DO UPDATE SET
+        revocation_list_id = excluded.revocation_list_id,
+        update_date = excluded.update_date,
+        next_update_date = excluded.next_update_date
+    WHERE excluded.revocation_list_id > revocation_list_id;
+END;""".format(kind, kind_filter.format("NEW.")))
+
+    rebuild_metrics_summary(conn)
+
+def migrate_to_v13(conn):
+    # Delta CRLs select the revocations above the last one covered by their
+    # base CRL. The CRLs generated before are assumed to cover the revocations
+    # dated before them, as their delta CRLs did.
+    execute_schema_statement(conn, "ALTER TABLE revocation_list ADD COLUMN last_revoked_certificate_id INT;")
+    execute_schema_statement(conn, """UPDATE revocation_list
+SET last_revoked_certificate_id = (SELECT COALESCE(MAX(rc.revoked_certificate_id), 0)
+    FROM revoked_certificate AS rc
+    WHERE rc.revocation_date < revocation_list.date_created
+);""")
+
+# Each entry upgrades the schema from version N to N + 1, as recorded in
+# "PRAGMA user_version". New migrations must only ever be appended.
+migrations = [
+    migrate_to_v1,
+    migrate_to_v2,
+    migrate_to_v3,
+    migrate_to_v4,
+    migrate_to_v5,
+    migrate_to_v6,
+    migrate_to_v7,
+    migrate_to_v8,
+    migrate_to_v9,
+    migrate_to_v10,
+    migrate_to_v11,
+    migrate_to_v12,
+    migrate_to_v13,
+]
+
+def get_schema_version(conn):
+    cur = conn.execute("PRAGMA user_version;")
+
+    with AutoClose(cur):
+        return cur.fetchone()[0]
+
+def set_schema_version(conn, version):
+    cur = conn.execute("PRAGMA user_version = {0:d};".format(version))
+    cur.close()
+
+def migrate_database(conn):
+    current_version = get_schema_version(conn)
+    target_version = len(migrations)
+
+    if current_version > target_version:
+        raise Exception("Database schema version {0} is newer than the supported version {1}.".format(
+            current_version,
+            target_version
+        ))
+
+    for version in range(current_version, target_version):
+        begin_write_transaction(conn)
+
+        # Another process may have run the migration while this one waited.
+        if get_schema_version(conn) > version:
+            conn.rollback()
+            continue
+
+        try:
+            migrations[version](conn)
+            set_schema_version(conn, version + 1)
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+
+    return target_version
+
+def create_tables(conn):
+    migrate_database(conn)
@@ -0,0 +1,102 @@
+import datetime
+
+
+tag_integer = 0x02
+tag_bit_string = 0x03
+tag_octet_string = 0x04
+tag_null = 0x05
+tag_oid = 0x06
+tag_enumerated = 0x0a
+tag_utc_time = 0x17
+tag_generalized_time = 0x18
+tag_sequence = 0x30
+tag_set = 0x31
+tag_context_0 = 0xa0
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes([ length ])
+
+    length_bytes = length.to_bytes((length.bit_length() + 7) // 8, "big")
+
+    return bytes([ 0x80 | len(length_bytes) ]) + length_bytes
+
+def encode_header(tag, length):
+    return bytes([ tag ]) + encode_length(length)
+
+def encode_tlv(tag, value):
+    return encode_header(tag, len(value)) + value
+
+def encode_sequence(*elements):
+    return encode_tlv(tag_sequence, b"".join(elements))
+
+def encode_set_of(*elements):
+    # DER orders the elements of a SET OF by their encoding.
+    return encode_tlv(tag_set, b"".join(sorted(elements)))
+
+def encode_integer(value):
+    length = (value.bit_length() + 8) // 8
+
+    return encode_tlv(tag_integer, value.to_bytes(length, "big", signed = True))
+
+def encode_enumerated(value):
+    length = (value.bit_length() + 8) // 8
+
+    return encode_tlv(tag_enumerated, value.to_bytes(length, "big", signed = True))
+
+def encode_oid(dotted_string):
+    arcs = [ int(arc) for arc in dotted_string.split(".") ]
+
+    encoded = bytearray()
+    for arc in [ arcs[0] * 40 + arcs[1] ] + arcs[2:]:
+        arc_bytes = [ arc & 0x7f ]
+        arc = arc >> 7
+
+        while arc > 0:
+            arc_bytes.append(0x80 | (arc & 0x7f))
+            arc = arc >> 7
+
+        encoded.extend(reversed(arc_bytes))
+
+    return encode_tlv(tag_oid, bytes(encoded))
+
+def encode_time(value):
+    # As in RFC 5280 4.1.2.5, UTCTime up to 2049 and GeneralizedTime afterwards.
+    utc_value = value.astimezone(datetime.timezone.utc)
+
+    if utc_value.year < 2050:
+        return encode_tlv(tag_utc_time, utc_value.strftime("%y%m%d%H%M%SZ").encode("ascii"))
+
+    return encode_generalized_time(utc_value)
+
+def encode_generalized_time(value):
+    utc_value = value.astimezone(datetime.timezone.utc)
+
+    return encode_tlv(tag_generalized_time, utc_value.strftime("%Y%m%d%H%M%SZ").encode("ascii"))
+
+def encode_bit_string(value):
+    return encode_tlv(tag_bit_string, b"\x00" + value)
+
+# Returns the tag of the element at offset and the bounds of its value.
+def read_tlv(data, offset):
+    tag = data[offset]
+    length = data[offset + 1]
+    offset = offset + 2
+
+    if length & 0x80:
+        length_size = length & 0x7f
+        length = int.from_bytes(data[offset:offset + length_size], "big")
+        offset = offset + length_size
+
+    return (tag, offset, offset + length)
+
+def split_elements(data, start, end):
+    elements = []
+
+    offset = start
+    while offset < end:
+        tag, value_start, value_end = read_tlv(data, offset)
+        elements.append((tag, offset, value_end))
+        offset = value_end
+
+    return elements
@@ -0,0 +1,18 @@
+import importlib
+
+
+class LazyModule:
+    # Stands for a module that is only imported on first attribute access,
+    # so commands that never reach cryptography do not pay for importing it.
+    def __init__(self, name):
+        self.name = name
+        self.module = None
+
+    def __getattr__(self, attribute):
+        if self.module is None:
+            self.module = importlib.import_module(self.name)
+
+        return getattr(self.module, attribute)
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -0,0 +1,336 @@
+import collections
+import datetime
+import heapq
+import random
+
+from cryptography import x509
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.x509 import ocsp
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+
+from mini_py_ca import dbaccess
+from mini_py_ca import der
+from mini_py_ca import utils
+
+
+def get_public_key_bits(certificate):
+    spki = certificate.public_key().public_bytes(
+        encoding = serialization.Encoding.DER,
+        format = serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+
+    tag, spki_start, spki_end = der.read_tlv(spki, 0)
+    elements = der.split_elements(spki, spki_start, spki_end)
+    tag, bits_start, bits_end = der.read_tlv(spki, elements[1][1])
+
+    # Skips the unused bits count of the BIT STRING.
+    return spki[bits_start + 1:bits_end]
+
+def compute_issuer_hashes(authority_certificate, hash_algorithm):
+    name_hasher = hashes.Hash(hash_algorithm, default_backend())
+    name_hasher.update(authority_certificate.subject.public_bytes(default_backend()))
+
+    key_hasher = hashes.Hash(hash_algorithm, default_backend())
+    key_hasher.update(get_public_key_bits(authority_certificate))
+
+    return (name_hasher.finalize(), key_hasher.finalize())
+
+sha1_oid = "1.3.14.3.2.26"
+
+def encode_sha1_request(issuer_name_hash, issuer_key_hash, serial):
+    # The OCSPRequest without nonce that RFC 5019 clients send for a single
+    # certificate, whose base64 encoding makes up the GET request path.
+    cert_id = der.encode_sequence(
+        der.encode_sequence(der.encode_oid(sha1_oid), der.encode_tlv(der.tag_null, b"")),
+        der.encode_tlv(der.tag_octet_string, issuer_name_hash),
+        der.encode_tlv(der.tag_octet_string, issuer_key_hash),
+        der.encode_integer(serial)
+    )
+
+    return der.encode_sequence(der.encode_sequence(der.encode_sequence(der.encode_sequence(cert_id))))
+
+def make_unsuccessful_response(status):
+    return ocsp.OCSPResponseBuilder.build_unsuccessful(status).public_bytes(serialization.Encoding.DER)
+
+malformed_request_response = make_unsuccessful_response(ocsp.OCSPResponseStatus.MALFORMED_REQUEST)
+unauthorized_response = make_unsuccessful_response(ocsp.OCSPResponseStatus.UNAUTHORIZED)
+try_later_response = make_unsuccessful_response(ocsp.OCSPResponseStatus.TRY_LATER)
+
+# Responses signed again by each call of refresh_due, so requests are still
+# answered while a large cache is being refreshed.
+refresh_batch_size = 64
+
+# Fraction of refresh_before by which refreshes are brought forward at
+# random, so the responses signed together at startup come due at different
+# times.
+refresh_jitter_ratio = 0.5
+
+# Anybody can ask for random serials, so the responses for serials missing
+# from the database are kept in a small LRU cache, and signed at a bounded
+# rate per second with bursts, tryLater being answered beyond it.
+unknown_cache_size = 4096
+unknown_sign_rate = 20.0
+unknown_sign_burst = 100
+
+class SignedResponse:
+    __slots__ = ("der", "this_update", "next_update", "refresh_time", "status")
+
+    def __init__(self, der, this_update, next_update, refresh_time, status):
+        self.der = der
+        self.this_update = this_update
+        self.next_update = next_update
+        self.refresh_time = refresh_time
+        self.status = status
+
+def make_unsigned_response(response_der, now):
+    # Due at once, so GET responses are not kept by HTTP caches.
+    return SignedResponse(response_der, now, now, now, None)
+
+class OcspResponder:
+    def __init__(self, section, authority_context, private_key):
+        self.section = section
+        self.authority_context = authority_context
+        self.private_key = private_key
+        self.hash_algorithm = utils.hash_algorithm_name_to_instance(section.signature_algorithm)
+
+        self.issuer_hashes = dict(authority_context.ocsp_issuer_hashes)
+        self.algorithms = dict()
+
+        # Signed responses by serial, then by CertID hash algorithm name, and
+        # a heap of their (refresh_time, serial, name). Entries of responses
+        # signed again since are skipped when popped.
+        self.cache = dict()
+        self.refresh_queue = []
+
+        # Responses for unknown serials by (serial, name), and the tokens left
+        # to sign new ones.
+        self.unknown_cache = collections.OrderedDict()
+        self.unknown_tokens = unknown_sign_burst
+        self.unknown_tokens_time = None
+
+        self.data_version = None
+        self.last_revoked_certificate_id = None
+
+    def get_issuer_hashes(self, algorithm):
+        if not algorithm.name in self.issuer_hashes:
+            self.issuer_hashes[algorithm.name] = compute_issuer_hashes(self.authority_context.certificate, algorithm)
+
+        if not algorithm.name in self.algorithms:
+            self.algorithms[algorithm.name] = algorithm
+
+        return self.issuer_hashes[algorithm.name]
+
+    def respond(self, request_bytes, now = None):
+        # Returns None for requests about other issuers.
+        if now is None:
+            now = utils.utc_now()
+
+        try:
+            request = ocsp.load_der_ocsp_request(request_bytes)
+            algorithm = request.hash_algorithm
+        except (ValueError, UnsupportedAlgorithm):
+            return make_unsigned_response(malformed_request_response, now)
+
+        name_hash, key_hash = self.get_issuer_hashes(algorithm)
+        if request.issuer_name_hash != name_hash or request.issuer_key_hash != key_hash:
+            return None
+
+        return self.get_response(request.serial_number, algorithm, now)
+
+    def get_response(self, serial, algorithm, now = None):
+        if now is None:
+            now = utils.utc_now()
+
+        responses = self.cache.get(serial)
+        if not responses is None:
+            response = responses.get(algorithm.name)
+
+            if not response is None and now < response.refresh_time:
+                return response
+
+        unknown_key = (serial, algorithm.name)
+        response = self.unknown_cache.get(unknown_key)
+        if not response is None and now < response.refresh_time:
+            self.unknown_cache.move_to_end(unknown_key)
+            return response
+
+        record = dbaccess.get_certificate_by_serial(serial)
+        if record is None:
+            return self.get_unknown_response(unknown_key, algorithm, now)
+
+        response = self.sign_response(serial, record, algorithm, now)
+        self.store_response(serial, algorithm, response)
+
+        return response
+
+    def get_unknown_response(self, unknown_key, algorithm, now):
+        if not self.take_unknown_token(now):
+            return make_unsigned_response(try_later_response, now)
+
+        response = self.sign_response(unknown_key[0], None, algorithm, now)
+
+        self.unknown_cache[unknown_key] = response
+        self.unknown_cache.move_to_end(unknown_key)
+        if len(self.unknown_cache) > unknown_cache_size:
+            self.unknown_cache.popitem(last = False)
+
+        return response
+
+    def take_unknown_token(self, now):
+        # Token bucket refilled at unknown_sign_rate per second.
+        if not self.unknown_tokens_time is None:
+            elapsed = max(0.0, (now - self.unknown_tokens_time).total_seconds())
+            self.unknown_tokens = min(unknown_sign_burst, self.unknown_tokens + elapsed * unknown_sign_rate)
+
+        self.unknown_tokens_time = now
+
+        if self.unknown_tokens < 1:
+            return False
+
+        self.unknown_tokens = self.unknown_tokens - 1
+        return True
+
+    def store_response(self, serial, algorithm, response):
+        self.cache.setdefault(serial, dict())[algorithm.name] = response
+        heapq.heappush(self.refresh_queue, (response.refresh_time, serial, algorithm.name))
+
+    def presign(self, records, algorithm, now = None):
+        if now is None:
+            now = utils.utc_now()
+
+        self.get_issuer_hashes(algorithm)
+
+        count = 0
+        for record in records:
+            response = self.sign_response(record.serial, record, algorithm, now)
+            self.store_response(record.serial, algorithm, response)
+            count = count + 1
+
+        return count
+
+    def sign_response(self, serial, record, algorithm, now):
+        this_update = utils.floor_time_minute(now)
+        next_update = this_update + self.section.duration
+
+        status = ocsp.OCSPCertStatus.UNKNOWN
+        revocation_time = None
+        revocation_reason = None
+        if not record is None:
+            status = ocsp.OCSPCertStatus.GOOD
+
+            if record.is_revoked:
+                status = ocsp.OCSPCertStatus.REVOKED
+                revocation_time = utils.floor_time_minute(record.revocation_date)
+
+                if record.revocation_reason != "unspecified":
+                    revocation_reason = dbaccess.get_reason_flag(record.revocation_reason)
+
+        builder = ocsp.OCSPResponseBuilder()
+
+        if hasattr(builder, "add_response_by_hash"):
+            name_hash, key_hash = self.get_issuer_hashes(algorithm)
+
+            builder = builder.add_response_by_hash(
+                issuer_name_hash = name_hash,
+                issuer_key_hash = key_hash,
+                serial_number = serial,
+                algorithm = algorithm,
+                cert_status = status,
+                this_update = this_update,
+                next_update = next_update,
+                revocation_time = revocation_time,
+                revocation_reason = revocation_reason
+            )
+        elif not record is None:
+            builder = builder.add_response(
+                cert = dbaccess.load_certificate_by_serial(utils.format_serial(serial)),
+                issuer = self.authority_context.certificate,
+                algorithm = algorithm,
+                cert_status = status,
+                this_update = this_update,
+                next_update = next_update,
+                revocation_time = revocation_time,
+                revocation_reason = revocation_reason
+            )
+        else:
+            # Older versions of cryptography need the certificate itself.
+            return SignedResponse(unauthorized_response, this_update, this_update, this_update, status)
+
+        builder = builder.responder_id(ocsp.OCSPResponderEncoding.HASH, self.authority_context.certificate)
+
+        response = builder.sign(self.private_key, self.hash_algorithm)
+
+        jitter = datetime.timedelta(seconds = random.uniform(0, self.section.refresh_before.total_seconds() * refresh_jitter_ratio))
+        refresh_time = max(now, next_update - self.section.refresh_before - jitter)
+
+        return SignedResponse(
+            response.public_bytes(serialization.Encoding.DER),
+            this_update,
+            next_update,
+            refresh_time,
+            status
+        )
+
+    def invalidate(self, serial):
+        # Marks the responses as due, so they are signed again by the next
+        # request or refresh.
+        responses = self.cache.get(serial)
+        if responses is None:
+            return
+
+        for name, response in responses.items():
+            response.refresh_time = response.this_update
+            heapq.heappush(self.refresh_queue, (response.refresh_time, serial, name))
+
+    def poll_revocations(self):
+        # Picks up the revocations committed by other processes, such as
+        # mca-revoke-cert, since the last call.
+        if self.last_revoked_certificate_id is None:
+            self.last_revoked_certificate_id = dbaccess.get_last_revoked_certificate_id()
+
+        data_version = dbaccess.get_data_version()
+        if data_version == self.data_version:
+            return 0
+
+        self.data_version = data_version
+
+        revocations = dbaccess.get_revocations_since(self.last_revoked_certificate_id)
+        for revoked_certificate_id, serial in revocations:
+            self.invalidate(serial)
+            self.last_revoked_certificate_id = revoked_certificate_id
+
+        return len(revocations)
+
+    def on_revocation(self, revoked_certificate_id, serial):
+        self.invalidate(serial)
+
+    def refresh_due(self, now = None, limit = refresh_batch_size):
+        # Signs again at most 'limit' of the responses due before 'now', the
+        # earliest due first, and returns their count. The responses signed
+        # again are not due before 'now', so repeated calls with the same
+        # 'now' run out of work.
+        if now is None:
+            now = utils.utc_now()
+
+        due = []
+        while len(self.refresh_queue) > 0 and len(due) < limit and self.refresh_queue[0][0] < now:
+            refresh_time, serial, name = heapq.heappop(self.refresh_queue)
+
+            response = self.cache.get(serial, dict()).get(name)
+            if response is None or response.refresh_time != refresh_time:
+                continue
+
+            due.append((serial, name))
+
+        if len(due) < 1:
+            return 0
+
+        records = dbaccess.get_certificates_by_serials(set([ serial for serial, name in due ]))
+        for serial, name in due:
+            algorithm = self.algorithms[name]
+            self.store_response(serial, algorithm, self.sign_response(serial, records.get(serial), algorithm, now))
+
+        return len(due)
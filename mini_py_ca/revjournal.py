@@ -0,0 +1,165 @@
+import os
+import struct
+import zlib
+
+from mini_py_ca import crlenc
+
+
+# The journal is written ahead of the database: the records of a revocation
+# transaction are appended and synced with one fsync before the SQLite
+# commit, and cut off again if the commit fails. Every committed revocation
+# is thus in the journal, and records past the last commit, left by a crash,
+# are the ones that a replay applies.
+journal_name = "revocation.journal"
+journal_magic = b"MCAREVJ1"
+
+# revoked_certificate_id, issued_certificate_id, revocation date in
+# milliseconds, serial and CRLReason code, followed by their CRC-32.
+record_body = struct.Struct(">QQq20sB")
+record_crc = struct.Struct(">I")
+record_size = record_body.size + record_crc.size
+record_values = struct.Struct(">QQq20sBI")
+
+scan_chunk_records = 65536
+
+reason_names = dict()
+for name, code in crlenc.reason_code_mapping.items():
+    reason_names[code] = name
+
+class JournalRecord:
+    __slots__ = ("revoked_certificate_id", "issued_certificate_id", "revocation_date", "serial", "reason")
+
+    def __init__(self, revoked_certificate_id, issued_certificate_id, revocation_date, serial, reason):
+        self.revoked_certificate_id = revoked_certificate_id
+        self.issued_certificate_id = issued_certificate_id
+        self.revocation_date = revocation_date
+        self.serial = serial
+        self.reason = reason
+
+    def to_row(self):
+        # Same layout as dbaccess.iter_revocation_rows.
+        return (
+            self.revoked_certificate_id,
+            self.issued_certificate_id,
+            self.revocation_date,
+            "{0:040x}".format(self.serial),
+            self.reason
+        )
+
+def encode_record(record):
+    body = record_body.pack(
+        record.revoked_certificate_id,
+        record.issued_certificate_id,
+        record.revocation_date,
+        record.serial.to_bytes(20, "big"),
+        crlenc.reason_code_mapping[record.reason]
+    )
+
+    return body + record_crc.pack(zlib.crc32(body))
+
+class RevocationJournal:
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def get_valid_size(self, size):
+        # Drops the end of a record torn by a crash during its write.
+        if size < len(journal_magic):
+            return 0
+
+        return size - (size - len(journal_magic)) % record_size
+
+    def append(self, records):
+        # Returns the size of the journal before the append, for truncate.
+        data = b"".join([ encode_record(record) for record in records ])
+
+        is_new = not self.exists()
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            size = self.get_valid_size(os.fstat(fd).st_size)
+            if size == 0:
+                data = journal_magic + data
+
+            os.ftruncate(fd, size)
+            os.lseek(fd, size, os.SEEK_SET)
+
+            try:
+                written = 0
+                while written < len(data):
+                    written = written + os.write(fd, data[written:])
+
+                os.fsync(fd)
+            except:
+                os.ftruncate(fd, size)
+                raise
+        finally:
+            os.close(fd)
+
+        if is_new:
+            sync_directory(os.path.dirname(self.path))
+
+        return size
+
+    def truncate(self, size):
+        if size == 0:
+            # The journal was created by the append being undone.
+            os.remove(self.path)
+            return
+
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            os.ftruncate(fd, size)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def scan(self):
+        # Yields (offset, record), record being None when its checksum does
+        # not match. Records have a fixed size, so one corrupt record does not
+        # hide the following ones.
+        with open(self.path, "rb") as file:
+            if file.read(len(journal_magic)) != journal_magic:
+                raise Exception("Invalid revocation journal '" + self.path + "'.")
+
+            offset = len(journal_magic)
+            body_size = record_body.size
+
+            chunk = file.read(record_size * scan_chunk_records)
+            while len(chunk) >= record_size:
+                whole_size = len(chunk) - len(chunk) % record_size
+
+                for chunk_offset, values in zip(range(0, whole_size, record_size), record_values.iter_unpack(chunk[:whole_size])):
+                    revoked_certificate_id, issued_certificate_id, revocation_date, serial, reason_code, crc = values
+
+                    if zlib.crc32(chunk[chunk_offset:chunk_offset + body_size]) != crc or not reason_code in reason_names:
+                        yield (offset + chunk_offset, None)
+                        continue
+
+                    yield (offset + chunk_offset, JournalRecord(
+                        revoked_certificate_id,
+                        issued_certificate_id,
+                        revocation_date,
+                        int.from_bytes(serial, "big"),
+                        reason_names[reason_code]
+                    ))
+
+                offset = offset + len(chunk)
+                chunk = file.read(record_size * scan_chunk_records)
+
+    def get_torn_size(self):
+        size = os.path.getsize(self.path)
+
+        return size - self.get_valid_size(size)
+
+def sync_directory(path):
+    if os.name == "nt":
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,211 @@
+import atexit
+import json
+import os
+import sys
+import time
+
+from mini_py_ca import lazyimport
+
+cProfile = lazyimport.lazy_import("cProfile")
+
+# Named phase timers for the commands. Phases nest, a phase started inside
+# another one being reported under it, and cost a single check while timings
+# are disabled. They are enabled by the --timings, --timings-json and
+# --profile arguments, or the MCA_TIMINGS, MCA_TIMINGS_JSON and MCA_PROFILE
+# environment variables.
+timings_env = "MCA_TIMINGS"
+timings_json_env = "MCA_TIMINGS_JSON"
+profile_env = "MCA_PROFILE"
+
+enabled = False
+command_name = None
+start_time = None
+start_date = None
+phase_stack = []
+phase_totals = dict()
+json_path = None
+print_breakdown = False
+profiler = None
+
+class NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+null_phase = NullPhase()
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+        self.key = None
+        self.phase_start = None
+
+    def __enter__(self):
+        phase_stack.append(self.name)
+        self.key = "/".join(phase_stack)
+
+        # Inserted on entry, so that phases are reported in start order.
+        if not self.key in phase_totals:
+            phase_totals[self.key] = [ 0.0, 0 ]
+
+        self.phase_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self.phase_start
+        phase_stack.pop()
+
+        totals = phase_totals[self.key]
+        totals[0] = totals[0] + elapsed
+        totals[1] = totals[1] + 1
+
+        return False
+
+def phase(name):
+    if not enabled:
+        return null_phase
+
+    return Phase(name)
+
+def timed(name):
+    # Decorator timing every call of a function as the phase 'name'.
+    def decorate(fn):
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+
+            with Phase(name):
+                return fn(*args, **kwargs)
+
+        wrapper.__name__ = fn.__name__
+        wrapper.__wrapped__ = fn
+        return wrapper
+
+    return decorate
+
+def timed_iter(name, iterable):
+    # Times the production of the items of a streamed iterable, such as rows
+    # fetched while they are being written, each next() counting as a call.
+    if not enabled:
+        return iterable
+
+    return iter_phase(name, iter(iterable))
+
+end_marker = object()
+
+def iter_phase(name, iterator):
+    while True:
+        with Phase(name):
+            item = next(iterator, end_marker)
+
+        if item is end_marker:
+            return
+
+        yield item
+
+def add_arguments(parser):
+    parser.add_argument(
+        "--timings",
+        action = "store_true",
+        help = "Print the time spent in each phase of the command to stderr (or set " + timings_env + ")"
+    )
+
+    parser.add_argument(
+        "--timings-json",
+        metavar = "PATH",
+        help = "Append the phase timings as JSON lines to PATH, '-' for stderr (or set " + timings_json_env + ")"
+    )
+
+    parser.add_argument(
+        "--profile",
+        metavar = "PATH",
+        help = "Write a cProfile statistics file, readable with pstats, to PATH (or set " + profile_env + ")"
+    )
+
+def start(parser, args):
+    global enabled
+    global command_name
+    global start_time
+    global start_date
+    global json_path
+    global print_breakdown
+    global profiler
+
+    print_breakdown = args.timings or len(os.environ.get(timings_env, "")) > 0
+    json_path = args.timings_json if not args.timings_json is None else os.environ.get(timings_json_env)
+    profile_path = args.profile if not args.profile is None else os.environ.get(profile_env)
+
+    if not print_breakdown and json_path is None and profile_path is None:
+        return
+
+    enabled = True
+    command_name = parser.prog
+    start_time = time.perf_counter()
+    start_date = time.time()
+
+    if not profile_path is None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    atexit.register(finish, profile_path)
+
+def finish(profile_path):
+    # Runs at exit, so commands leaving with sys.exit are reported as well.
+    total = time.perf_counter() - start_time
+
+    if not profiler is None:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+
+    if print_breakdown:
+        write_breakdown(total, sys.stderr)
+
+    if not json_path is None:
+        write_json_lines(total)
+
+def write_breakdown(total, output):
+    print("Phase timings of '{0}':".format(command_name), file = output)
+
+    accounted = 0.0
+    for key, totals in phase_totals.items():
+        depth = key.count("/")
+        if depth == 0:
+            accounted = accounted + totals[0]
+
+        print("  {0:40} {1:>10.4f}s {2:>6.1%} {3:>9d}x".format(
+            "  " * depth + key.rsplit("/", 1)[-1],
+            totals[0],
+            totals[0] / total if total > 0 else 0.0,
+            totals[1]
+        ), file = output)
+
+    print("  {0:40} {1:>10.4f}s {2:>6.1%}".format(
+        "(outside phases)",
+        total - accounted,
+        (total - accounted) / total if total > 0 else 0.0
+    ), file = output)
+
+    print("  {0:40} {1:>10.4f}s".format("total", total), file = output)
+
+def write_json_lines(total):
+    lines = []
+    for key, totals in list(phase_totals.items()) + [ ("total", [ total, 1 ]) ]:
+        lines.append(json.dumps({
+            "command": command_name,
+            "pid": os.getpid(),
+            "started": start_date,
+            "phase": key,
+            "seconds": totals[0],
+            "count": totals[1],
+        }) + "\n")
+
+    if json_path == "-":
+        sys.stderr.write("".join(lines))
+        return
+
+    # One write per run, so that concurrent runs appending to the same file
+    # do not interleave their lines.
+    with open(json_path, "a") as output:
+        output.write("".join(lines))
@@ -2,25 +2,27 @@
 import datetime
 import re
 
-from cryptography import x509
-from cryptography.x509.oid import NameOID
+from mini_py_ca import lazyimport
 
-from cryptography.hazmat.primitives import hashes
+x509 = lazyimport.lazy_import("cryptography.x509")
+hashes = lazyimport.lazy_import("cryptography.hazmat.primitives.hashes")
 
+# Dotted strings of the NameOID attributes, cryptography only being imported
+# when a name is built.
 short_rdn_type_mapping = {
-    "dc": NameOID.DOMAIN_COMPONENT,
-    "c": NameOID.COUNTRY_NAME,
-    "st": NameOID.STATE_OR_PROVINCE_NAME,
-    "l": NameOID.LOCALITY_NAME,
-    "o": NameOID.ORGANIZATION_NAME,
-    "ou": NameOID.ORGANIZATIONAL_UNIT_NAME,
-    "cn": NameOID.COMMON_NAME,
-    "e": NameOID.EMAIL_ADDRESS
+    "dc": "0.9.2342.19200300.100.1.25",
+    "c": "2.5.4.6",
+    "st": "2.5.4.8",
+    "l": "2.5.4.7",
+    "o": "2.5.4.10",
+    "ou": "2.5.4.11",
+    "cn": "2.5.4.3",
+    "e": "1.2.840.113549.1.9.1"
 }
 
 reverse_short_rdn_type_mapping = dict()
 for k, v in short_rdn_type_mapping.items():
-    reverse_short_rdn_type_mapping[v.dotted_string] = k
+    reverse_short_rdn_type_mapping[v] = k
 
 unix_epoch = datetime.datetime(1970, 1, 1, tzinfo = datetime.timezone.utc)
 
@@ -40,7 +42,7 @@ def distinguished_name_to_x509_name(dn):
         value = rdn[1]
 
         if rdn_type in short_rdn_type_mapping:
-            name_list.append(x509.NameAttribute(short_rdn_type_mapping[rdn_type], value))
+            name_list.append(x509.NameAttribute(x509.ObjectIdentifier(short_rdn_type_mapping[rdn_type]), value))
         else:
             name_list.append(x509.NameAttribute(rdn_type, value))
 
@@ -69,6 +71,14 @@ def floor_time_minute(value):
         microseconds = value.microsecond
     )
 
+def parse_datetime(value):
+    # ISO 8601 date or date and time, local time unless an offset is given.
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.astimezone()
+
+    return parsed.astimezone(datetime.timezone.utc)
+
 def make_utc_datetime_aware(value):
     return value.replace(tzinfo = datetime.timezone.utc)
 
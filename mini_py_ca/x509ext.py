@@ -2,72 +2,95 @@
 import ipaddress
 import datetime
 
-from cryptography import x509
-from cryptography.x509.oid import NameOID
-from cryptography.x509.oid import ExtensionOID
-
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives import serialization
-
 from mini_py_ca import config
+from mini_py_ca import lazyimport
 from mini_py_ca import utils
 
+x509 = lazyimport.lazy_import("cryptography.x509")
+
 def add_extensions(builder, context, extension_config_list, existing_extensions):
-    remaining_configs = None
+    template = ExtensionTemplate(context, extension_config_list)
 
-    if len(existing_extensions) > 0:
-        ext_config_map = dict()
+    return template.add_extensions(builder, context, existing_extensions)
 
-        for config_ext in extension_config_list:
-            ext_config_map[extension_oid_mapping[config_ext.name]] = config_ext
+# Extensions whose value depends on the certificate being built, all others
+# being built once by ExtensionTemplate.
+per_certificate_extensions = [ "subjectKeyIdentifier" ]
 
-        for ext in existing_extensions:
-            if not ext.value.oid in ext_config_map:
-                builder = builder.add_extension(ext.value, ext.critical)
+class ExtensionTemplate:
+    def __init__(self, context, extension_config_list):
+        self.extension_config_list = extension_config_list
 
+        self.ext_config_map = dict()
+        for config_ext in extension_config_list:
+            self.ext_config_map[get_extension_oid(config_ext.name)] = config_ext
+
+        self.prebuilt_extensions = dict()
+        for ext_config in extension_config_list:
+            if ext_config.action is None or ext_config.name in per_certificate_extensions:
                 continue
 
-            ext_config = ext_config_map[ext.value.oid]
-            del ext_config_map[ext.value.oid]
+            self.prebuilt_extensions[ext_config.name] = extension_handlers[ext_config.name](context, ext_config)
 
-            if ext_config.action == config.ExtensionAction.ADD:
-                builder = builder.add_extension(ext.value, ext.critical)
+    def build_extension(self, context, ext_config):
+        if ext_config.name in self.prebuilt_extensions:
+            return self.prebuilt_extensions[ext_config.name]
 
-            elif ext_config.action == config.ExtensionAction.REPLACE:
-                ext_override = extension_handlers[ext_config.name](context, ext_config)
-                builder = builder.add_extension(ext_override, ext_config.critical)
+        return extension_handlers[ext_config.name](context, ext_config)
 
-            elif ext_config.action is None and not ext_config.forced_critical_value is None:
-                builder = builder.add_extension(ext.value, ext_config.forced_critical_value)
+    def add_extensions(self, builder, context, existing_extensions):
+        remaining_configs = None
 
-        remaining_configs = ext_config_map.values()
-    else:
-        remaining_configs = extension_config_list
+        if len(existing_extensions) > 0:
+            ext_config_map = dict(self.ext_config_map)
 
-    for ext_config in remaining_configs:
-        if ext_config.action is None:
-            continue
+            for ext in existing_extensions:
+                if not ext.value.oid in ext_config_map:
+                    builder = builder.add_extension(ext.value, ext.critical)
 
-        ext = extension_handlers[ext_config.name](context, ext_config)
-        critical = False
-    
-        if ext_config.action == config.ExtensionAction.REPLACE:
-            critical = ext_config.critical
-        elif ext_config.action == config.ExtensionAction.ADD:
-            if not ext_config.critical is None:
+                    continue
+
+                ext_config = ext_config_map[ext.value.oid]
+                del ext_config_map[ext.value.oid]
+
+                if ext_config.action == config.ExtensionAction.ADD:
+                    builder = builder.add_extension(ext.value, ext.critical)
+
+                elif ext_config.action == config.ExtensionAction.REPLACE:
+                    ext_override = self.build_extension(context, ext_config)
+                    builder = builder.add_extension(ext_override, ext_config.critical)
+
+                elif ext_config.action is None and not ext_config.forced_critical_value is None:
+                    builder = builder.add_extension(ext.value, ext_config.forced_critical_value)
+
+            remaining_configs = ext_config_map.values()
+        else:
+            remaining_configs = self.extension_config_list
+
+        for ext_config in remaining_configs:
+            if ext_config.action is None:
+                continue
+
+            ext = self.build_extension(context, ext_config)
+            critical = False
+
+            if ext_config.action == config.ExtensionAction.REPLACE:
                 critical = ext_config.critical
-            else:
-                critical = ext_config.forced_critical_value
+            elif ext_config.action == config.ExtensionAction.ADD:
+                if not ext_config.critical is None:
+                    critical = ext_config.critical
+                else:
+                    critical = ext_config.forced_critical_value
 
-        builder = builder.add_extension(ext, critical)
+            builder = builder.add_extension(ext, critical)
 
-    return builder
+        return builder
 
 class ExtensionContext:
-    def __init__(self, authority_key, subject_key):
+    def __init__(self, authority_key, subject_key, authority_key_identifier = None):
         self.authority_key = authority_key
         self.subject_key = subject_key
+        self.authority_key_identifier = authority_key_identifier
 
 def parse_general_name(general_name):
     if len(general_name) > 1:
@@ -151,9 +174,43 @@ def handle_authority_key_identifier(ctx, ext):
     if "authorityCertIssuer" in ext.dict or "authorityCertSerialNumber" in ext.dict:
         raise Exception("Certificate-based authority identifier not supported.")
 
+    if not ctx.authority_key_identifier is None:
+        return ctx.authority_key_identifier
+
     return x509.AuthorityKeyIdentifier.from_issuer_public_key(ctx.authority_key)
 
 def handle_crl_distribution_points(ctx, ext):
+    return x509.CRLDistributionPoints(parse_distribution_points(ext))
+
+def make_partition_distribution_points_config(extension_config_list, partition_uri):
+    partition_config = config.Extension(
+        {
+            "critical": False,
+            "distributionPoints": [ { "fullName": [ { "URI": partition_uri } ] } ]
+        },
+        "crlDistributionPoints"
+    )
+
+    config_list = []
+    for ext_config in extension_config_list:
+        if ext_config.name != "crlDistributionPoints":
+            config_list.append(ext_config)
+            continue
+
+        if not ext_config.critical is None:
+            partition_config.critical = ext_config.critical
+
+        config_list.append(partition_config)
+
+    if not partition_config in config_list:
+        config_list.append(partition_config)
+
+    return config_list
+
+def handle_freshest_crl(ctx, ext):
+    return x509.FreshestCRL(parse_distribution_points(ext))
+
+def parse_distribution_points(ext):
 
     distribution_points = []
     for point in ext.dict["distributionPoints"]:
@@ -174,7 +231,7 @@ def handle_crl_distribution_points(ctx, ext):
             crl_issuer = None
         ))
 
-    return x509.CRLDistributionPoints(distribution_points)
+    return distribution_points
 
 def handle_authority_access_info(ctx, ext):
 
@@ -206,17 +263,23 @@ extension_handlers = {
     "subjectKeyIdentifier": handle_subject_key_identifier,
     "authorityKeyIdentifier": handle_authority_key_identifier,
     "crlDistributionPoints": handle_crl_distribution_points,
-    "authorityInfoAccess": handle_authority_access_info
+    "authorityInfoAccess": handle_authority_access_info,
+    "freshestCRL": handle_freshest_crl
 }
 
-extension_oid_mapping = {
-    "keyUsage": ExtensionOID.KEY_USAGE,
-    "basicConstraints": ExtensionOID.BASIC_CONSTRAINTS,
-    "subjectKeyIdentifier": ExtensionOID.SUBJECT_KEY_IDENTIFIER,
-    "authorityKeyIdentifier": ExtensionOID.AUTHORITY_KEY_IDENTIFIER,
-    "crlDistributionPoints": ExtensionOID.CRL_DISTRIBUTION_POINTS,
-    "authorityInfoAccess": ExtensionOID.AUTHORITY_INFORMATION_ACCESS
+# Names of the x509.ExtensionOID members, looked up by get_extension_oid.
+extension_oid_names = {
+    "keyUsage": "KEY_USAGE",
+    "basicConstraints": "BASIC_CONSTRAINTS",
+    "subjectKeyIdentifier": "SUBJECT_KEY_IDENTIFIER",
+    "authorityKeyIdentifier": "AUTHORITY_KEY_IDENTIFIER",
+    "crlDistributionPoints": "CRL_DISTRIBUTION_POINTS",
+    "authorityInfoAccess": "AUTHORITY_INFORMATION_ACCESS",
+    "freshestCRL": "FRESHEST_CRL"
 }
 
+def get_extension_oid(name):
+    return getattr(x509.ExtensionOID, extension_oid_names[name])
+
 
 
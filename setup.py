@@ -28,11 +28,12 @@ setup(
     packages = [ "mini_py_ca", "mini_py_ca.commands" ],
     setup_requires = [ 'wheel' ],
     install_requires = [
-        "cryptography>=2.2.2",
+        "cryptography>=2.5",
         "ruamel.yaml>=0.15.42",
     ],
     entry_points = {
         "console_scripts": [
+            "mca=mini_py_ca.commands.mca:main",
             "mca-gen-key=mini_py_ca.commands.gen_key:main",
             "mca-key-mgr=mini_py_ca.commands.key_mgr:main",
             "mca-gen-ca-cert=mini_py_ca.commands.gen_ca_cert:main",
@@ -40,6 +41,14 @@ setup(
             "mca-revoke-cert=mini_py_ca.commands.revoke_cert:main",
             "mca-gen-crl=mini_py_ca.commands.gen_crl:main",
             "mca-active-certs=mini_py_ca.commands.active_certificates:main",
+            "mca-ocsp-server=mini_py_ca.commands.ocsp_server:main",
+            "mca-gen-ocsp=mini_py_ca.commands.gen_ocsp:main",
+            "mca-cert-store=mini_py_ca.commands.cert_store:main",
+            "mca-compile-config=mini_py_ca.commands.compile_config:main",
+            "mca-renew=mini_py_ca.commands.renew:main",
+            "mca-revocation-journal=mini_py_ca.commands.revocation_journal:main",
+            "mca-metrics=mini_py_ca.commands.metrics:main",
+            "mca-publish=mini_py_ca.commands.publish:main",
         ]
     },
 )
@@ -0,0 +1,128 @@
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from mini_py_ca import authority
+from mini_py_ca import dbaccess
+
+
+package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+example_config_path = os.path.join(package_dir, "example_config.yml")
+
+def run_command_process(module_name, *args):
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = package_dir
+
+    subprocess.run(
+        [ sys.executable, "-W", "ignore", "-m", "mini_py_ca.commands." + module_name ] + list(args),
+        env = environment,
+        check = True,
+        stdout = subprocess.DEVNULL
+    )
+
+def write_csr(path, common_name):
+    private_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+
+    builder = x509.CertificateSigningRequestBuilder()
+    builder = builder.subject_name(x509.Name([
+        x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Acme"),
+        x509.NameAttribute(NameOID.COMMON_NAME, common_name),
+    ]))
+
+    csr = builder.sign(private_key, hashes.SHA256(), default_backend())
+
+    with open(path, "wb") as file:
+        file.write(csr.public_bytes(serialization.Encoding.PEM))
+
+class AuthorityTestCase(unittest.TestCase):
+    # Creates an authority from the example configuration once per test
+    # class, with the commands as in a fresh installation, and runs every test
+    # in its own copy of it, the configuration directory being relative to
+    # the working directory.
+    @classmethod
+    def setUpClass(cls):
+        cls.template_dir = tempfile.mkdtemp()
+
+        previous_dir = os.getcwd()
+        os.chdir(cls.template_dir)
+        try:
+            os.mkdir(".minipyca")
+            shutil.copy(example_config_path, os.path.join(".minipyca", "config.yml"))
+
+            run_command_process("gen_key", "--size", "2048", "--algorithm", "rsa")
+            run_command_process("gen_ca_cert")
+        finally:
+            os.chdir(previous_dir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.template_dir)
+
+    def setUp(self):
+        self.previous_dir = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        self.ca_dir = os.path.join(self.temp_dir, "ca")
+
+        shutil.copytree(self.template_dir, self.ca_dir, symlinks = True)
+        os.chdir(self.ca_dir)
+
+        self.reset_state()
+
+    def tearDown(self):
+        self.reset_state()
+
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.temp_dir)
+
+    def reset_state(self):
+        if not dbaccess.database_connection is None:
+            dbaccess.database_connection.close()
+
+        dbaccess.database_connection = None
+        authority.current_context = None
+
+    def make_csrs(self, count, name_prefix = "Test"):
+        csr_dir = os.path.join(self.temp_dir, "csrs")
+        os.makedirs(csr_dir, exist_ok = True)
+
+        paths = []
+        for i in range(count):
+            path = os.path.join(csr_dir, "{0}{1}.csr".format(name_prefix.lower(), i))
+            write_csr(path, "{0} {1}".format(name_prefix, i))
+            paths.append(path)
+
+        return paths
+
+    def run_command(self, command_module, *args):
+        # Runs the main function of a command in this process, returning what
+        # it printed.
+        previous_argv = sys.argv
+        sys.argv = [ command_module.__name__ ] + list(args)
+
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                command_module.main()
+        finally:
+            sys.argv = previous_argv
+
+        return output.getvalue()
+
+    def query_all(self, statement, values = ()):
+        cur = dbaccess.get_connection().execute(statement, values)
+        rows = cur.fetchall()
+        cur.close()
+
+        return rows
@@ -0,0 +1,142 @@
+import os
+import unittest
+import unittest.mock
+
+from cryptography.hazmat.primitives import serialization
+
+from mini_py_ca import authority
+from mini_py_ca import certstore
+from mini_py_ca import common
+from mini_py_ca import config
+from mini_py_ca import dbaccess
+from mini_py_ca import utils
+from mini_py_ca.commands import cert_store
+from mini_py_ca.commands import sign_csr
+
+from authority_fixture import AuthorityTestCase
+
+
+class StoreRollbackTest(AuthorityTestCase):
+    # The certificates are appended to the store before being recorded in
+    # the database, and must leave the store again when recording fails.
+    def setUp(self):
+        super().setUp()
+
+        self.run_command(sign_csr, "--jobs", "1", *self.make_csrs(2, "Stored"))
+        self.run_command(cert_store, "migrate")
+
+        self.store = common.get_certificate_store()
+        self.assertIsNotNone(self.store)
+
+    def sign_certificates(self, count, name_prefix):
+        not_before = utils.floor_time_minute(utils.utc_now())
+        section = config.get_section_for_context("sign_request")
+
+        results = sign_csr.sign_batch(
+            self.make_csrs(count, name_prefix),
+            section,
+            None,
+            authority.get_authority_context(),
+            common.load_private_key(),
+            not_before,
+            not_before + section.duration,
+            1
+        )
+
+        return [ result.certificate for result in results ]
+
+    def store_failing(self, certificates):
+        with unittest.mock.patch.object(dbaccess, "add_certificates_to_db", side_effect = Exception("Insert failed")):
+            with self.assertRaises(Exception):
+                sign_csr.store_batch(certificates, None)
+
+    def get_index_keys(self):
+        with open(self.store.index_path, "rb") as file:
+            data = file.read()
+
+        return set([
+            index_entry[0]
+            for index_entry in certstore.index_entry.iter_unpack(data[len(certstore.index_magic):])
+        ])
+
+    def get_log_keys(self):
+        return set(certstore.read_log(self.store.log_path).keys())
+
+    def get_keys(self, certificates):
+        return set([ certstore.make_serial_key(certificate.serial_number) for certificate in certificates ])
+
+    def assert_not_stored(self, certificates):
+        store = common.get_certificate_store()
+
+        for certificate in certificates:
+            self.assertIsNone(store.get_der(certificate.serial_number))
+
+        self.assertEqual(
+            [ serial for serial, certificate_der in store.iter_entries() if serial in [ c.serial_number for c in certificates ] ],
+            []
+        )
+
+    def test_failed_insert_leaves_index_and_log(self):
+        index_keys = self.get_index_keys()
+        log_keys = self.get_log_keys()
+        pack_size = os.path.getsize(self.store.pack_path)
+        count = self.store.count()
+
+        certificates = self.sign_certificates(2, "Failed")
+        self.store_failing(certificates)
+
+        self.assertEqual(self.get_index_keys(), index_keys)
+        self.assertEqual(self.get_log_keys(), log_keys)
+        self.assertTrue(self.get_keys(certificates).isdisjoint(self.get_log_keys() | self.get_index_keys()))
+        self.assertEqual(os.path.getsize(self.store.pack_path), pack_size)
+
+        self.assert_not_stored(certificates)
+        self.assertEqual(common.get_certificate_store().count(), count)
+        self.assertEqual(self.store.rebuild_index(), count)
+
+    def test_failed_insert_after_other_writer(self):
+        certificates = self.sign_certificates(1, "Failed")
+        other_certificates = self.sign_certificates(1, "Other")
+
+        # Another process adds its certificate between the append and the
+        # failed insert, so the log and pack cannot be cut back.
+        add = self.store.add
+        def add_then_other(certificates_der):
+            mark = add(certificates_der)
+            certstore.CertificateStore(self.store.directory).add([
+                certificate.public_bytes(serialization.Encoding.DER) for certificate in other_certificates
+            ])
+
+            return mark
+
+        with unittest.mock.patch.object(common, "get_certificate_store", return_value = self.store):
+            with unittest.mock.patch.object(self.store, "add", side_effect = add_then_other):
+                self.store_failing(certificates)
+
+        self.assert_not_stored(certificates)
+        self.assertIsNotNone(common.get_certificate_store().get_der(other_certificates[0].serial_number))
+
+        # The removal is a log entry until the log is merged, and the blanked
+        # certificate is skipped when the index is rebuilt.
+        self.store.merge_log()
+        self.assertTrue(self.get_keys(certificates).isdisjoint(self.get_index_keys() | self.get_log_keys()))
+        self.assertTrue(self.get_keys(other_certificates).issubset(self.get_index_keys()))
+
+        self.store.rebuild_index()
+        self.assertTrue(self.get_keys(certificates).isdisjoint(self.get_index_keys()))
+        self.assert_not_stored(certificates)
+
+    def test_failed_insert_after_merge(self):
+        # The append merges the log into the index right away.
+        with unittest.mock.patch.object(certstore, "log_merge_threshold", 1):
+            certificates = self.sign_certificates(2, "Failed")
+            self.store_failing(certificates)
+
+        self.assert_not_stored(certificates)
+
+        self.store.merge_log()
+        self.assertTrue(self.get_keys(certificates).isdisjoint(self.get_index_keys() | self.get_log_keys()))
+
+
+if __name__ == "__main__":
+    unittest.main()
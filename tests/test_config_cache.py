@@ -0,0 +1,74 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from mini_py_ca import config
+
+
+example_config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "example_config.yml")
+
+class ConfigCacheTest(unittest.TestCase):
+    # The configuration directory is relative to the working directory.
+    def setUp(self):
+        self.previous_dir = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+
+        os.mkdir(".minipyca")
+        shutil.copy(example_config_path, config.get_config_file_path())
+
+    def tearDown(self):
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.temp_dir)
+
+    def read_cache(self):
+        with open(config.get_config_cache_path(), "r") as file:
+            return json.load(file)
+
+    def test_cache_is_json_data(self):
+        compiled_config = config.load_compiled_config()
+        cache = self.read_cache()
+
+        self.assertEqual(cache["version"], config.config_cache_version)
+        self.assertEqual(cache["source_key"], list(compiled_config.source_key))
+        self.assertEqual(cache["config"], config.read_config_file())
+
+    def test_cache_is_used_when_unchanged(self):
+        compiled_config = config.load_compiled_config()
+
+        cached_config = config.read_config_cache(compiled_config.source_key)
+        self.assertIsNotNone(cached_config)
+        self.assertEqual(sorted(cached_config.sections), sorted(compiled_config.sections))
+        self.assertEqual(cached_config.default_section, compiled_config.default_section)
+
+    def test_cache_with_other_source_key_is_ignored(self):
+        compiled_config = config.load_compiled_config()
+
+        source_key = list(compiled_config.source_key)
+        source_key[2] = "0" * 64
+        self.assertIsNone(config.read_config_cache(tuple(source_key)))
+
+    def test_pickled_cache_is_not_loaded(self):
+        compiled_config = config.load_compiled_config()
+
+        # Unpickling this would raise when called, before the source key
+        # could be checked.
+        class Payload:
+            def __reduce__(self):
+                return (exec, ("raise Exception('unpickled')",))
+
+        with open(config.get_config_cache_path(), "wb") as file:
+            pickle.dump(Payload(), file)
+
+        self.assertIsNone(config.read_config_cache(compiled_config.source_key))
+
+        reloaded_config = config.load_compiled_config()
+        self.assertEqual(sorted(reloaded_config.sections), sorted(compiled_config.sections))
+        self.assertEqual(self.read_cache()["source_key"], list(compiled_config.source_key))
+
+
+if __name__ == "__main__":
+    unittest.main()
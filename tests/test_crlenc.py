@@ -0,0 +1,139 @@
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from mini_py_ca import crlenc
+
+
+def make_date(*args):
+    return datetime.datetime(*args, tzinfo = datetime.timezone.utc)
+
+# Serial, revocation date, reason and invalidity date. The revocation dates
+# are on whole minutes, as the encoder floors them.
+revoked_entries = [
+    (0x1234, make_date(2024, 3, 1, 10, 20), "unspecified", None),
+    (0x7f00ff, make_date(2024, 3, 2, 11, 0), "keyCompromise", None),
+    (0x00c0ffee_0000_0000_0000_0001, make_date(2024, 3, 3, 12, 30), "superseded", make_date(2024, 2, 28, 8, 15, 42)),
+    (1, make_date(2051, 1, 1, 0, 0), "cessationOfOperation", make_date(2050, 12, 31, 23, 59, 59)),
+]
+
+class CrlEncodingTest(unittest.TestCase):
+    # RSA PKCS#1 v1.5 signatures are deterministic, so the streamed CRL must
+    # equal the one signed by the cryptography builder byte for byte.
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key = rsa.generate_private_key(
+            public_exponent = 65537,
+            key_size = 2048,
+            backend = default_backend()
+        )
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_builder(self):
+        builder = x509.CertificateRevocationListBuilder()
+        builder = builder.issuer_name(x509.Name([
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "Acme Corporation"),
+            x509.NameAttribute(NameOID.COMMON_NAME, "Acme Corporation Authority"),
+        ]))
+        builder = builder.last_update(make_date(2024, 3, 4, 0, 0))
+        builder = builder.next_update(make_date(2024, 3, 11, 0, 0))
+        builder = builder.add_extension(x509.CRLNumber(42), critical = False)
+        builder = builder.add_extension(
+            x509.AuthorityKeyIdentifier.from_issuer_public_key(self.private_key.public_key()),
+            critical = False
+        )
+
+        return builder
+
+    def sign_with_builder(self, entries):
+        builder = self.make_builder()
+
+        for serial, revocation_date, reason, invalidity_date in entries:
+            revoked_cert_builder = x509.RevokedCertificateBuilder()
+            revoked_cert_builder = revoked_cert_builder.serial_number(serial)
+            revoked_cert_builder = revoked_cert_builder.revocation_date(revocation_date)
+
+            if reason != "unspecified":
+                revoked_cert_builder = revoked_cert_builder.add_extension(
+                    x509.CRLReason(x509.ReasonFlags(reason)),
+                    critical = False
+                )
+
+            if not invalidity_date is None:
+                revoked_cert_builder = revoked_cert_builder.add_extension(
+                    x509.InvalidityDate(invalidity_date.replace(tzinfo = None)),
+                    critical = False
+                )
+
+            builder = builder.add_revoked_certificate(revoked_cert_builder.build(default_backend()))
+
+        crl = builder.sign(
+            private_key = self.private_key,
+            algorithm = hashes.SHA256(),
+            backend = default_backend()
+        )
+
+        return crl.public_bytes(serialization.Encoding.DER)
+
+    def write_streamed(self, entries, encoding):
+        template = crlenc.CrlTemplate(self.make_builder(), self.private_key, hashes.SHA256())
+        output_path = os.path.join(self.temp_dir, "test.crl")
+
+        entry_count = template.write_streamed_crl(
+            [ crlenc.encode_revoked_entry(*entry) for entry in entries ],
+            output_path,
+            encoding = encoding
+        )
+        self.assertEqual(entry_count, len(entries))
+
+        with open(output_path, "rb") as file:
+            return file.read()
+
+    def test_streamed_der_matches_builder(self):
+        self.assertEqual(
+            self.write_streamed(revoked_entries, serialization.Encoding.DER),
+            self.sign_with_builder(revoked_entries)
+        )
+
+    def test_streamed_pem_matches_builder(self):
+        expected_crl = x509.load_der_x509_crl(self.sign_with_builder(revoked_entries), default_backend())
+
+        self.assertEqual(
+            self.write_streamed(revoked_entries, serialization.Encoding.PEM),
+            expected_crl.public_bytes(serialization.Encoding.PEM)
+        )
+
+    def test_streamed_empty_matches_builder(self):
+        self.assertEqual(
+            self.write_streamed([], serialization.Encoding.DER),
+            self.sign_with_builder([])
+        )
+
+    def test_sign_crl_matches_builder(self):
+        crl = crlenc.sign_crl(
+            self.make_builder(),
+            [ crlenc.encode_revoked_entry(*entry) for entry in revoked_entries ],
+            self.private_key,
+            hashes.SHA256()
+        )
+
+        self.assertEqual(crl.public_bytes(serialization.Encoding.DER), self.sign_with_builder(revoked_entries))
+        self.assertTrue(crl.is_signature_valid(self.private_key.public_key()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import glob
+import unittest
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+
+from mini_py_ca import common
+from mini_py_ca import config
+from mini_py_ca.commands import gen_crl
+from mini_py_ca.commands import revoke_cert
+from mini_py_ca.commands import sign_csr
+
+from authority_fixture import AuthorityTestCase
+
+
+partitions_config = """  partitions:
+    count: 3
+    uri: http://pki.acme.corp/acme-{partition}.crl
+"""
+
+class PartitionCrlTest(AuthorityTestCase):
+    def setUp(self):
+        super().setUp()
+
+        # Enables the partitions of the example revocation_list section.
+        config_path = config.get_config_file_path()
+        with open(config_path, "r") as file:
+            config_text = file.read()
+
+        config_text = config_text.replace("revocation_list:\n  kind: revocation_list\n", "revocation_list:\n  kind: revocation_list\n" + partitions_config, 1)
+        with open(config_path, "w") as file:
+            file.write(config_text)
+
+        self.partitions = config.get_crl_partitions()
+        self.assertEqual(self.partitions.count, 3)
+
+        self.run_command(sign_csr, "--jobs", "1", *self.make_csrs(12))
+        self.run_command(revoke_cert, "--subject-like", "CN=Test 1%")
+
+        self.revoked_serials = set([
+            int(row[0], 16)
+            for row in self.query_all("""SELECT ic.serial
+FROM revoked_certificate AS rc
+INNER JOIN issued_certificate AS ic ON ic.issued_certificate_id = rc.issued_certificate_id;""")
+        ])
+        self.assertEqual(len(self.revoked_serials), 3)
+
+    def load_partition_crls(self):
+        crls = dict()
+        for path in glob.glob("crl/*_p*.crl"):
+            with open(path, "rb") as file:
+                crl = x509.load_pem_x509_crl(file.read(), default_backend())
+
+            partition = int(path.split("_p")[1].split("_")[0])
+            crls[partition] = crl
+
+        return crls
+
+    def check_partition_crls(self, jobs):
+        output = self.run_command(gen_crl, "--jobs", str(jobs))
+
+        crls = self.load_partition_crls()
+        self.assertEqual(sorted(crls.keys()), list(range(self.partitions.count)))
+
+        public_key = common.load_private_key().public_key()
+        listed_serials = set()
+        for partition, crl in crls.items():
+            self.assertTrue(crl.is_signature_valid(public_key))
+
+            serials = set([ revoked.serial_number for revoked in crl ])
+            for serial in serials:
+                self.assertEqual(self.partitions.partition_for_serial(serial), partition)
+
+            listed_serials = listed_serials | serials
+
+            issuing_distribution_point = crl.extensions.get_extension_for_class(x509.IssuingDistributionPoint).value
+            self.assertEqual(issuing_distribution_point.full_name[0].value, self.partitions.uri_for_partition(partition))
+
+            summary = "for partition {0} with {1} revoked certificate(s)".format(partition, len(serials)) if len(serials) > 0 else \
+                "for partition {0} with no revoked certificates".format(partition)
+            self.assertIn(summary, output)
+
+        self.assertEqual(listed_serials, self.revoked_serials)
+
+        recorded = self.query_all("SELECT crl_partition FROM revocation_list WHERE crl_partition IS NOT NULL ORDER BY crl_partition;")
+        self.assertEqual([ row[0] for row in recorded ], list(range(self.partitions.count)))
+
+    def test_single_job(self):
+        self.check_partition_crls(1)
+
+    def test_worker_processes(self):
+        self.check_partition_crls(2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import contextlib
+import datetime
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from mini_py_ca import dbaccess
+from mini_py_ca import utils
+
+
+base_date = datetime.datetime(2090, 1, 1, tzinfo = datetime.timezone.utc)
+
+def make_certificate(serial, not_after):
+    private_key = ec.generate_private_key(ec.SECP256R1(), default_backend())
+    name = x509.Name([ x509.NameAttribute(NameOID.COMMON_NAME, "Summary {0}".format(serial)) ])
+
+    builder = x509.CertificateBuilder()
+    builder = builder.subject_name(name)
+    builder = builder.issuer_name(name)
+    builder = builder.public_key(private_key.public_key())
+    builder = builder.serial_number(serial)
+    builder = builder.not_valid_before(base_date - datetime.timedelta(days = 1))
+    builder = builder.not_valid_after(not_after)
+
+    return builder.sign(private_key, hashes.SHA256(), default_backend())
+
+class MetricsSummaryTest(unittest.TestCase):
+    # Migrates a database with duplicate revocations, then checks that the
+    # summaries maintained by the triggers match the tables as rows change.
+    def setUp(self):
+        self.previous_dir = os.getcwd()
+        self.temp_dir = tempfile.mkdtemp()
+        os.chdir(self.temp_dir)
+
+        self.conn = sqlite3.connect(":memory:")
+
+        for create_statement in [
+            dbaccess.issued_certificate_create,
+            dbaccess.revoked_certificate_create,
+            dbaccess.revocation_list_create,
+        ]:
+            self.conn.execute(create_statement)
+
+        # Two certificates per expiry hour, over three hours.
+        for certificate_id in range(1, 7):
+            self.conn.execute(
+                "INSERT INTO issued_certificate VALUES(:id, 0, 0, :not_after_date, :serial, :subject, 0);",
+                {
+                    "id": certificate_id,
+                    "not_after_date": utils.to_timestamp_milis(base_date + datetime.timedelta(hours = (certificate_id - 1) // 2, minutes = certificate_id)),
+                    "serial": "{0:040x}".format(certificate_id),
+                    "subject": "CN=Test {0}".format(certificate_id),
+                }
+            )
+
+        # Certificate 2 was revoked twice, and certificate 3 three times, by
+        # concurrent revocations.
+        for revoked_certificate_id, issued_certificate_id in [ (1, 2), (2, 3), (3, 2), (4, 3), (5, 3), (6, 5) ]:
+            self.conn.execute(
+                "INSERT INTO revoked_certificate VALUES(:id, :issued_id, 0, 'keyCompromise');",
+                {"id": revoked_certificate_id, "issued_id": issued_certificate_id}
+            )
+
+        self.conn.commit()
+
+        self.previous_connection = dbaccess.database_connection
+        dbaccess.database_connection = self.conn
+
+    def tearDown(self):
+        dbaccess.database_connection = self.previous_connection
+        self.conn.close()
+
+        os.chdir(self.previous_dir)
+        shutil.rmtree(self.temp_dir)
+
+    def migrate(self):
+        # The v11 migration reports the removed duplicates on stderr.
+        with contextlib.redirect_stderr(io.StringIO()):
+            dbaccess.migrate_database(self.conn)
+
+    def assert_summary_matches(self):
+        expected = self.conn.execute("""SELECT ic.not_after_date / :bucket_size, COUNT(*), COUNT(rc.revoked_certificate_id)
+FROM issued_certificate AS ic
+LEFT JOIN revoked_certificate AS rc ON rc.issued_certificate_id = ic.issued_certificate_id
+GROUP BY 1
+ORDER BY 1;""", {"bucket_size": dbaccess.expiry_bucket_size}).fetchall()
+
+        # Buckets whose certificates were all deleted stay with zero counts.
+        summary = self.conn.execute("""SELECT expiry_bucket, issued_count, revoked_count
+FROM certificate_expiry_summary
+WHERE issued_count <> 0 OR revoked_count <> 0
+ORDER BY expiry_bucket;""").fetchall()
+
+        self.assertEqual(summary, expected)
+
+        totals = self.conn.execute("SELECT SUM(issued_count), SUM(revoked_count) FROM certificate_expiry_summary;").fetchone()
+        self.assertEqual(totals[0], self.conn.execute("SELECT COUNT(*) FROM issued_certificate;").fetchone()[0])
+        self.assertEqual(totals[1], self.conn.execute("SELECT COUNT(*) FROM revoked_certificate;").fetchone()[0])
+
+    def test_migration_dedupe(self):
+        self.migrate()
+
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM revoked_certificate;").fetchone()[0], 3)
+        self.assert_summary_matches()
+
+    def test_insert_and_revoke(self):
+        self.migrate()
+
+        certificates = [
+            make_certificate(0x100 + i, base_date + datetime.timedelta(hours = i, minutes = 30))
+            for i in range(5)
+        ]
+        dbaccess.add_certificates_to_db(certificates[:3], is_self_signed = False)
+        dbaccess.add_certificates_to_db(certificates[3:], is_self_signed = False)
+        self.assert_summary_matches()
+
+        revoked, skipped = dbaccess.revoke_certificates(
+            utils.utc_now(),
+            serials = [ certificate.serial_number for certificate in certificates[1:4] ] + [ 2 ],
+            reason = "superseded"
+        )
+        self.assertEqual(len(revoked), 3)
+        self.assertEqual(len(skipped), 1)
+        self.assert_summary_matches()
+
+        dbaccess.revoke_certificate_by_id(utils.utc_now(), 1, utils.format_serial(1), "unspecified")
+        self.assert_summary_matches()
+
+    def test_delete(self):
+        self.migrate()
+
+        self.conn.execute("DELETE FROM revoked_certificate_entry WHERE revoked_certificate_id = 6;")
+        self.conn.execute("DELETE FROM revoked_certificate WHERE revoked_certificate_id = 6;")
+        self.conn.execute("DELETE FROM issued_certificate WHERE issued_certificate_id IN (5, 6);")
+        self.conn.commit()
+
+        self.assert_summary_matches()
+
+    def test_rebuild_matches_triggers(self):
+        self.migrate()
+        dbaccess.add_certificates_to_db([ make_certificate(0x200, base_date) ], is_self_signed = False)
+
+        summary = self.conn.execute("SELECT * FROM certificate_expiry_summary ORDER BY expiry_bucket;").fetchall()
+        dbaccess.rebuild_metrics()
+
+        self.assertEqual(self.conn.execute("SELECT * FROM certificate_expiry_summary ORDER BY expiry_bucket;").fetchall(), summary)
+
+
+if __name__ == "__main__":
+    unittest.main()
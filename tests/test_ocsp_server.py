@@ -0,0 +1,73 @@
+import base64
+import unittest
+import urllib.parse
+
+from mini_py_ca import ocspresp
+from mini_py_ca.commands import ocsp_server
+
+
+def find_request_with_slashes():
+    # A request whose base64 encoding holds slashes and plus signs, which RFC
+    # 6960 clients URL encode.
+    for serial in range(1, 100000):
+        request_bytes = ocspresp.encode_sha1_request(b"\x11" * 20, b"\x22" * 20, serial)
+        encoded_request = base64.b64encode(request_bytes).decode("ascii")
+
+        if "/" in encoded_request and "+" in encoded_request:
+            return (request_bytes, encoded_request)
+
+    raise Exception("No request with slashes in its base64 encoding.")
+
+class DecodeGetRequestTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.request_bytes, cls.encoded_request = find_request_with_slashes()
+        cls.url_encoded_request = urllib.parse.quote(cls.encoded_request, safe = "")
+
+    def test_root_path(self):
+        self.assertEqual(ocsp_server.decode_get_request("/" + self.url_encoded_request), self.request_bytes)
+
+    def test_sub_path(self):
+        for target in [
+            "/ocsp/" + self.url_encoded_request,
+            "/pki/acme/ocsp/" + self.url_encoded_request,
+            "http://pki.acme.corp/ocsp/" + self.url_encoded_request,
+            "/ocsp/" + self.url_encoded_request + "?cache=1",
+        ]:
+            self.assertEqual(ocsp_server.decode_get_request(target), self.request_bytes, target)
+
+    def test_lowercase_escapes(self):
+        target = "/ocsp/" + self.url_encoded_request.replace("%2F", "%2f").replace("%2B", "%2b")
+
+        self.assertEqual(ocsp_server.decode_get_request(target), self.request_bytes)
+
+    def test_unencoded_slashes(self):
+        for target in [
+            "/" + self.encoded_request,
+            "/ocsp/" + self.encoded_request,
+            "http://pki.acme.corp/ocsp/" + self.encoded_request,
+        ]:
+            self.assertEqual(ocsp_server.decode_get_request(target), self.request_bytes, target)
+
+    def test_malformed_requests(self):
+        for target in [
+            "/",
+            "/ocsp/",
+            "/ocsp/not*base64",
+            "/ocsp/" + self.encoded_request[:-8],
+            "/ocsp/" + base64.b64encode(b"\x04\x02ab").decode("ascii"),
+        ]:
+            self.assertIsNone(ocsp_server.decode_get_request(target), target)
+
+    def test_malformed_request_response(self):
+        server = ocsp_server.OcspHttpServer(None)
+
+        status, content_type, body, headers = server.handle_request("GET", "/ocsp/", b"")
+
+        self.assertEqual(status, 200)
+        self.assertEqual(body, ocspresp.malformed_request_response)
+        self.assertEqual(server.request_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import datetime
+import sqlite3
+import unittest
+
+from mini_py_ca import dbaccess
+from mini_py_ca import utils
+
+
+far_future = utils.to_timestamp_milis(datetime.datetime(2099, 1, 1, tzinfo = datetime.timezone.utc))
+
+class QueryPlanTest(unittest.TestCase):
+    # Migrates a database created with the original schema, then checks the
+    # plans of the queries executed by the certificate listing functions.
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+
+        for create_statement in [
+            dbaccess.issued_certificate_create,
+            dbaccess.revoked_certificate_create,
+            dbaccess.revocation_list_create,
+        ]:
+            self.conn.execute(create_statement)
+
+        for certificate_id in range(1, 11):
+            self.conn.execute(
+                "INSERT INTO issued_certificate VALUES(:id, 0, 0, :not_after_date, :serial, :subject, :is_self_signed);",
+                {
+                    "id": certificate_id,
+                    "not_after_date": far_future,
+                    "serial": "{0:02x}".format(certificate_id),
+                    "subject": "CN=Test {0}".format(certificate_id),
+                    "is_self_signed": 1 if certificate_id == 1 else 0,
+                }
+            )
+
+        self.conn.execute("INSERT INTO revoked_certificate VALUES(1, 5, 0, 'keyCompromise');")
+        self.conn.commit()
+
+        self.assertEqual(dbaccess.get_schema_version(self.conn), 0)
+        dbaccess.migrate_database(self.conn)
+
+        self.previous_connection = dbaccess.database_connection
+        dbaccess.database_connection = self.conn
+
+    def tearDown(self):
+        dbaccess.database_connection = self.previous_connection
+        self.conn.close()
+
+    def get_query_plans(self, fn):
+        # The trace callback receives the statements with their parameters
+        # expanded, so they can be explained as they were executed.
+        statements = []
+        self.conn.set_trace_callback(statements.append)
+        try:
+            fn()
+        finally:
+            self.conn.set_trace_callback(None)
+
+        plans = []
+        for statement in statements:
+            if not statement.lstrip().upper().startswith("SELECT"):
+                continue
+
+            cur = self.conn.execute("EXPLAIN QUERY PLAN " + statement)
+            plans.append([ row[3] for row in cur.fetchall() ])
+            cur.close()
+
+        self.assertGreater(len(plans), 0)
+        return plans
+
+    def assert_no_table_scan(self, plans):
+        for plan in plans:
+            for detail in plan:
+                self.assertFalse(detail.startswith("SCAN "), "Table scan in plan {0}".format(plan))
+
+    def assert_plan_uses(self, plans, expected_detail):
+        for plan in plans:
+            for detail in plan:
+                if expected_detail in detail:
+                    return
+
+        self.fail("No '{0}' in plans {1}".format(expected_detail, plans))
+
+    def test_migrated_version(self):
+        self.assertEqual(dbaccess.get_schema_version(self.conn), len(dbaccess.migrations))
+
+    def test_get_active_certificates(self):
+        plans = self.get_query_plans(dbaccess.get_active_certificates)
+
+        self.assert_no_table_scan(plans)
+        self.assert_plan_uses(plans, "SEARCH ic USING INDEX ix_issued_certificate_not_after_date")
+        self.assert_plan_uses(plans, "(issued_certificate_id=?)")
+
+    def test_iter_crl_entries(self):
+        plans = self.get_query_plans(lambda: list(dbaccess.iter_crl_entries(
+            utils.utc_now(),
+            last_revoked_certificate_id = 1
+        )))
+
+        self.assert_no_table_scan(plans)
+        self.assert_plan_uses(plans, "SEARCH rc USING INTEGER PRIMARY KEY (rowid<?)")
+        self.assert_plan_uses(plans, "SEARCH ic USING INTEGER PRIMARY KEY (rowid=?)")
+
+    def test_iter_crl_entries_delta(self):
+        plans = self.get_query_plans(lambda: list(dbaccess.iter_crl_entries(
+            utils.utc_now(),
+            base_revoked_certificate_id = 0,
+            last_revoked_certificate_id = 1
+        )))
+
+        self.assert_no_table_scan(plans)
+        self.assert_plan_uses(plans, "SEARCH rc USING INTEGER PRIMARY KEY (rowid>? AND rowid<?)")
+
+    def test_iter_crl_entries_partition(self):
+        plans = self.get_query_plans(lambda: list(dbaccess.iter_crl_entries(
+            utils.utc_now(),
+            last_revoked_certificate_id = 1,
+            crl_partition = 0
+        )))
+
+        self.assert_no_table_scan(plans)
+        self.assert_plan_uses(plans, "SEARCH ic USING INDEX ix_issued_certificate_crl_partition (crl_partition=? AND not_after_date>?)")
+        self.assert_plan_uses(plans, "(issued_certificate_id=?")
+
+    def test_find_current_authority_certificate_serial(self):
+        plans = self.get_query_plans(dbaccess.find_current_authority_certificate_serial)
+
+        self.assert_no_table_scan(plans)
+        self.assert_plan_uses(plans, "USING COVERING INDEX ix_issued_certificate_is_self_signed")
+
+    def test_iter_certificates_expiring_between(self):
+        start = utils.utc_now()
+        plans = self.get_query_plans(lambda: list(dbaccess.iter_certificates_expiring_between(
+            start,
+            start + datetime.timedelta(days = 30)
+        )))
+
+        self.assert_no_table_scan(plans)
+        self.assert_plan_uses(plans, "SEARCH ic USING INDEX ix_issued_certificate_not_after_date")
+        for plan in plans:
+            self.assertFalse(any([ "TEMP B-TREE" in detail for detail in plan ]), "Sort in plan {0}".format(plan))
+
+    def test_active_certificates_page(self):
+        plans = self.get_query_plans(lambda: list(dbaccess.iter_active_certificates(after_id = 3, limit = 2)))
+
+        self.assert_no_table_scan(plans)
+        self.assert_plan_uses(plans, "USING INTEGER PRIMARY KEY (rowid>?)")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mini_py_ca import dbaccess
+from mini_py_ca import revjournal
+from mini_py_ca.commands import revocation_journal
+from mini_py_ca.commands import revoke_cert
+from mini_py_ca.commands import sign_csr
+
+from authority_fixture import AuthorityTestCase
+
+
+def make_record(revoked_certificate_id, reason = "keyCompromise"):
+    return revjournal.JournalRecord(
+        revoked_certificate_id,
+        revoked_certificate_id + 100,
+        1700000000000 + revoked_certificate_id,
+        0x0102030405060708090a0b0c0d0e0f1011121314 + revoked_certificate_id,
+        reason
+    )
+
+def flip_byte(path, offset):
+    with open(path, "r+b") as file:
+        file.seek(offset)
+        value = file.read(1)[0]
+        file.seek(offset)
+        file.write(bytes([ value ^ 0xff ]))
+
+def get_record_values(record):
+    return None if record is None else record.to_row()
+
+class JournalFileTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.journal = revjournal.RevocationJournal(os.path.join(self.temp_dir, revjournal.journal_name))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def append_bytes(self, data):
+        with open(self.journal.path, "ab") as file:
+            file.write(data)
+
+    def scan_values(self):
+        return [ (offset, get_record_values(record)) for offset, record in self.journal.scan() ]
+
+    def test_records_are_scanned_back(self):
+        records = [ make_record(1), make_record(2, "superseded"), make_record(3, "unspecified") ]
+
+        self.assertEqual(self.journal.append(records[:2]), 0)
+        self.assertEqual(self.journal.append(records[2:]), len(revjournal.journal_magic) + 2 * revjournal.record_size)
+
+        self.assertEqual(self.scan_values(), [
+            (len(revjournal.journal_magic) + i * revjournal.record_size, record.to_row())
+            for i, record in enumerate(records)
+        ])
+        self.assertEqual(self.journal.get_torn_size(), 0)
+
+    def test_torn_last_record_is_ignored_then_overwritten(self):
+        self.journal.append([ make_record(1), make_record(2) ])
+
+        # A crash in the middle of the write of the third record.
+        torn_record = revjournal.encode_record(make_record(3))
+        self.append_bytes(torn_record[:revjournal.record_size // 2])
+
+        self.assertEqual(self.journal.get_torn_size(), revjournal.record_size // 2)
+        self.assertEqual([ values[1] for values in self.scan_values() ], [ make_record(1).to_row(), make_record(2).to_row() ])
+
+        # The next append starts where the valid records end.
+        self.journal.append([ make_record(4) ])
+
+        self.assertEqual(self.journal.get_torn_size(), 0)
+        self.assertEqual(
+            [ values[1] for values in self.scan_values() ],
+            [ make_record(1).to_row(), make_record(2).to_row(), make_record(4).to_row() ]
+        )
+
+    def test_corrupt_last_record_is_reported(self):
+        self.journal.append([ make_record(1), make_record(2), make_record(3) ])
+
+        last_offset = len(revjournal.journal_magic) + 2 * revjournal.record_size
+        flip_byte(self.journal.path, last_offset + 20)
+
+        self.assertEqual(self.scan_values(), [
+            (len(revjournal.journal_magic), make_record(1).to_row()),
+            (len(revjournal.journal_magic) + revjournal.record_size, make_record(2).to_row()),
+            (last_offset, None),
+        ])
+
+    def test_corrupt_checksum_is_reported(self):
+        self.journal.append([ make_record(1), make_record(2) ])
+
+        flip_byte(self.journal.path, os.path.getsize(self.journal.path) - 1)
+
+        self.assertEqual([ values[1] is None for values in self.scan_values() ], [ False, True ])
+
+    def test_invalid_magic_is_rejected(self):
+        self.journal.append([ make_record(1) ])
+        flip_byte(self.journal.path, 0)
+
+        with self.assertRaises(Exception):
+            list(self.journal.scan())
+
+    def test_undone_first_append_removes_journal(self):
+        size = self.journal.append([ make_record(1) ])
+        self.journal.truncate(size)
+
+        self.assertFalse(self.journal.exists())
+
+class JournalReplayTest(AuthorityTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.run_command(sign_csr, "--jobs", "1", *self.make_csrs(4))
+        self.run_command(revoke_cert, "--reason", "keyCompromise", "--subject-like", "CN=Test %")
+
+        self.journal = dbaccess.get_revocation_journal()
+
+    def get_revocations(self):
+        return (
+            self.query_all("SELECT * FROM revoked_certificate ORDER BY revoked_certificate_id;"),
+            self.query_all("SELECT * FROM revoked_certificate_entry ORDER BY revoked_certificate_id;")
+        )
+
+    def lose_revocations(self, revoked_certificate_ids):
+        # As if the process crashed between the journal write and the commit.
+        conn = dbaccess.get_connection()
+        for revoked_certificate_id in revoked_certificate_ids:
+            conn.execute("DELETE FROM revoked_certificate_entry WHERE revoked_certificate_id = ?;", (revoked_certificate_id,))
+            conn.execute("DELETE FROM revoked_certificate WHERE revoked_certificate_id = ?;", (revoked_certificate_id,))
+
+        conn.commit()
+
+    def test_journal_matches_database(self):
+        comparison = revocation_journal.compare_journal(self.journal, dbaccess.get_connection())
+
+        self.assertTrue(comparison.is_consistent())
+        self.assertEqual(comparison.matched_count, 4)
+        self.assertEqual(comparison.pending, [])
+
+        self.assertIn("4 journal record(s) match the database", self.run_command(revocation_journal, "verify"))
+
+    def test_replay_is_idempotent(self):
+        revocations = self.get_revocations()
+        revoked_ids = [ row[0] for row in revocations[0] ]
+
+        self.lose_revocations(revoked_ids[2:])
+        self.assertEqual(len(self.get_revocations()[0]), 2)
+
+        with self.assertRaises(SystemExit):
+            self.run_command(revocation_journal, "verify")
+
+        output = self.run_command(revocation_journal, "replay")
+        self.assertIn("Replayed 2 revocation(s), skipped 0", output)
+        self.assertEqual(self.get_revocations(), revocations)
+
+        output = self.run_command(revocation_journal, "replay")
+        self.assertIn("Replayed 0 revocation(s), skipped 0", output)
+        self.assertIn("4 journal record(s) match the database", output)
+        self.assertEqual(self.get_revocations(), revocations)
+
+        self.run_command(revocation_journal, "verify")
+
+    def test_replay_skips_conflicting_revocation(self):
+        revocations = self.get_revocations()
+        last_revoked_id = revocations[0][-1][0]
+
+        # The certificate was revoked again under another id after the lost
+        # revocation.
+        self.lose_revocations([ last_revoked_id ])
+        conn = dbaccess.get_connection()
+        conn.execute(
+            "INSERT INTO revoked_certificate (revoked_certificate_id, issued_certificate_id, revocation_date, reason) VALUES(:id, :issued_id, 0, 'superseded');",
+            {"id": last_revoked_id + 1, "issued_id": revocations[0][-1][1]}
+        )
+        conn.commit()
+
+        with self.assertRaises(SystemExit):
+            self.run_command(revocation_journal, "replay")
+
+        rows = self.get_revocations()[0]
+        self.assertEqual([ row[0] for row in rows ], [ row[0] for row in revocations[0][:-1] ] + [ last_revoked_id + 1 ])
+
+    def test_corrupt_record_fails_verify(self):
+        last_offset = len(revjournal.journal_magic) + 3 * revjournal.record_size
+        flip_byte(self.journal.path, last_offset + 20)
+
+        comparison = revocation_journal.compare_journal(self.journal, dbaccess.get_connection())
+        self.assertEqual(comparison.corrupt_offsets, [ last_offset ])
+        self.assertEqual(len(comparison.missing), 1)
+
+        with self.assertRaises(SystemExit):
+            self.run_command(revocation_journal, "verify")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import unittest
+
+from mini_py_ca import dbaccess
+from mini_py_ca import utils
+from mini_py_ca.commands import revoke_cert
+from mini_py_ca.commands import sign_csr
+
+from authority_fixture import AuthorityTestCase
+
+
+class RevokeBulkTest(AuthorityTestCase):
+    def setUp(self):
+        super().setUp()
+
+        csr_paths = self.make_csrs(3, "Alpha") + self.make_csrs(2, "Beta")
+        self.run_command(sign_csr, "--jobs", "1", *csr_paths)
+
+        self.certificates = dict([
+            (row[0], (row[1], row[2]))
+            for row in self.query_all("SELECT subject, issued_certificate_id, serial FROM issued_certificate WHERE is_self_signed = 0;")
+        ])
+        self.assertEqual(len(self.certificates), 5)
+
+    def get_id(self, common_name):
+        return self.certificates["CN={0},O=Acme".format(common_name)][0]
+
+    def get_serial(self, common_name):
+        return self.certificates["CN={0},O=Acme".format(common_name)][1]
+
+    def get_revoked_ids(self):
+        return sorted([ row[0] for row in self.query_all("SELECT issued_certificate_id FROM revoked_certificate;") ])
+
+    def write_targets(self, lines):
+        path = os.path.join(self.temp_dir, "targets.txt")
+        with open(path, "w") as file:
+            file.write("\n".join(lines) + "\n")
+
+        return path
+
+    def get_journal_size(self):
+        path = dbaccess.get_revocation_journal().path
+        if not os.path.exists(path):
+            return None
+
+        return os.path.getsize(path)
+
+    def test_ids_from(self):
+        targets_path = self.write_targets([
+            "# Compromised hosts",
+            str(self.get_id("Alpha 0")),
+            "",
+            str(self.get_id("Beta 1")),
+        ])
+
+        output = self.run_command(revoke_cert, "--reason", "keyCompromise", "--ids-from", targets_path)
+
+        self.assertEqual(self.get_revoked_ids(), sorted([ self.get_id("Alpha 0"), self.get_id("Beta 1") ]))
+        self.assertIn("Revoked 2 certificate(s), skipped 0.", output)
+        self.assertEqual(
+            set([ row[0] for row in self.query_all("SELECT reason FROM revoked_certificate;") ]),
+            set([ "keyCompromise" ])
+        )
+
+    def test_serials_from(self):
+        serial = self.get_serial("Alpha 1")
+        colon_serial = ":".join([ serial[i:i + 2] for i in range(0, len(serial), 2) ])
+
+        targets_path = self.write_targets([ colon_serial, self.get_serial("Beta 0").upper(), "ff" ])
+
+        output = self.run_command(revoke_cert, "--serials-from", targets_path)
+
+        self.assertEqual(self.get_revoked_ids(), sorted([ self.get_id("Alpha 1"), self.get_id("Beta 0") ]))
+        self.assertIn("SKIPPED serial {0}: not found".format(utils.format_serial(0xff)), output)
+        self.assertIn("Revoked 2 certificate(s), skipped 1.", output)
+
+    def test_subject_like(self):
+        output = self.run_command(revoke_cert, "--subject-like", "CN=Alpha %")
+
+        self.assertEqual(
+            self.get_revoked_ids(),
+            sorted([ self.get_id("Alpha 0"), self.get_id("Alpha 1"), self.get_id("Alpha 2") ])
+        )
+        self.assertIn("Revoked 3 certificate(s), skipped 0.", output)
+
+    def test_combined_targets_are_revoked_once(self):
+        targets_path = self.write_targets([ str(self.get_id("Alpha 0")) ])
+
+        output = self.run_command(
+            revoke_cert,
+            "--ids-from", targets_path,
+            "--subject-like", "CN=Alpha 0%",
+            str(self.get_id("Alpha 0"))
+        )
+
+        self.assertEqual(self.get_revoked_ids(), [ self.get_id("Alpha 0") ])
+        self.assertIn("Revoked 1 certificate(s), skipped 0.", output)
+
+    def test_already_revoked_and_self_signed_are_skipped(self):
+        self.run_command(revoke_cert, str(self.get_id("Beta 0")))
+        revoked_rows = self.query_all("SELECT * FROM revoked_certificate;")
+
+        self_signed_id = self.query_all("SELECT issued_certificate_id FROM issued_certificate WHERE is_self_signed = 1;")[0][0]
+        output = self.run_command(revoke_cert, "--subject-like", "CN=Beta %", str(self_signed_id))
+
+        self.assertIn("SKIPPED id {0}: already revoked".format(self.get_id("Beta 0")), output)
+        self.assertIn("SKIPPED id {0}: self-signed".format(self_signed_id), output)
+        self.assertIn("Revoked 1 certificate(s), skipped 2.", output)
+
+        # The earlier revocation is left as it was.
+        self.assertEqual(self.query_all("SELECT * FROM revoked_certificate;")[0], revoked_rows[0])
+        self.assertEqual(self.get_revoked_ids(), sorted([ self.get_id("Beta 0"), self.get_id("Beta 1") ]))
+
+    def test_dry_run_writes_nothing(self):
+        self.run_command(revoke_cert, str(self.get_id("Beta 0")))
+
+        journal_size = self.get_journal_size()
+        revoked_rows = self.query_all("SELECT * FROM revoked_certificate;")
+        entry_rows = self.query_all("SELECT * FROM revoked_certificate_entry;")
+
+        output = self.run_command(revoke_cert, "--dry-run", "--subject-like", "CN=%")
+
+        self.assertIn("Would revoke 4 certificate(s), skipped 2.", output)
+        self.assertIn("WOULD REVOKE id {0}".format(self.get_id("Alpha 0")), output)
+
+        self.assertEqual(self.query_all("SELECT * FROM revoked_certificate;"), revoked_rows)
+        self.assertEqual(self.query_all("SELECT * FROM revoked_certificate_entry;"), entry_rows)
+        self.assertEqual(self.get_journal_size(), journal_size)
+        self.assertFalse(dbaccess.get_connection().in_transaction)
+
+
+if __name__ == "__main__":
+    unittest.main()
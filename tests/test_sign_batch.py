@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from mini_py_ca import authority
+from mini_py_ca import common
+from mini_py_ca import config
+from mini_py_ca import dbaccess
+from mini_py_ca import utils
+from mini_py_ca.commands import sign_csr
+
+from authority_fixture import AuthorityTestCase
+
+
+def sign_batch(csr_paths):
+    not_before = utils.floor_time_minute(utils.utc_now())
+    section = config.get_section_for_context("sign_request")
+
+    return sign_csr.sign_batch(
+        csr_paths,
+        section,
+        None,
+        authority.get_authority_context(),
+        common.load_private_key(),
+        not_before,
+        not_before + section.duration,
+        1
+    )
+
+class ExpandCsrSourcesTest(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.csr_dir = os.path.join(self.temp_dir, "requests")
+        os.mkdir(self.csr_dir)
+
+        for name in [ "b.csr", "a.csr", "c.pem" ]:
+            with open(os.path.join(self.csr_dir, name), "w") as file:
+                file.write("")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def csr_path(self, name):
+        return os.path.join(self.csr_dir, name)
+
+    def test_directory_lists_sorted_csr_files(self):
+        self.assertEqual(
+            sign_csr.expand_csr_sources([ self.csr_dir ], None),
+            [ self.csr_path("a.csr"), self.csr_path("b.csr") ]
+        )
+
+    def test_glob_pattern(self):
+        self.assertEqual(
+            sign_csr.expand_csr_sources([ os.path.join(self.csr_dir, "[bc].*") ], None),
+            [ self.csr_path("b.csr"), self.csr_path("c.pem") ]
+        )
+
+    def test_manifest_is_relative_to_its_directory(self):
+        manifest_path = os.path.join(self.csr_dir, "manifest.txt")
+        with open(manifest_path, "w") as file:
+            file.write("# Requests of the batch\n\nc.pem\n  b.csr  \n")
+
+        self.assertEqual(
+            sign_csr.expand_csr_sources([], manifest_path),
+            [ self.csr_path("c.pem"), self.csr_path("b.csr") ]
+        )
+
+    def test_duplicates_keep_first_occurrence(self):
+        manifest_path = os.path.join(self.csr_dir, "manifest.txt")
+        with open(manifest_path, "w") as file:
+            file.write("a.csr\nc.pem\n")
+
+        relative_path = os.path.relpath(self.csr_path("b.csr"))
+
+        self.assertEqual(
+            sign_csr.expand_csr_sources(
+                [ relative_path, self.csr_dir, os.path.join(self.csr_dir, "*.csr") ],
+                manifest_path
+            ),
+            [ relative_path, self.csr_path("a.csr"), self.csr_path("c.pem") ]
+        )
+
+class SignBatchTest(AuthorityTestCase):
+    def get_reserved_serials(self):
+        return set([ row[0] for row in self.query_all("SELECT serial FROM serial_reservation;") ])
+
+    def test_failed_items_release_their_serials(self):
+        csr_paths = self.make_csrs(3)
+        missing_path = os.path.join(self.temp_dir, "missing.csr")
+        csr_paths.insert(1, missing_path)
+
+        results = sign_batch(csr_paths)
+
+        self.assertEqual([ result.csr_path for result in results ], csr_paths)
+        self.assertEqual([ result.error is None for result in results ], [ True, False, True, True ])
+        self.assertIsNone(results[1].certificate)
+
+        # Only the serials of the signed certificates stay reserved, until
+        # the certificates are recorded.
+        signed_serials = set([
+            utils.format_serial(result.certificate.serial_number)
+            for result in results if result.error is None
+        ])
+        self.assertEqual(self.get_reserved_serials(), signed_serials)
+
+    def test_all_items_failing_release_every_serial(self):
+        results = sign_batch([ os.path.join(self.temp_dir, "missing.csr") ])
+
+        self.assertIsNotNone(results[0].error)
+        self.assertEqual(self.get_reserved_serials(), set())
+
+class StoreBatchTest(AuthorityTestCase):
+    def list_certificate_files(self):
+        paths = []
+        for dir_name in [ "cert", "byserial" ]:
+            if os.path.isdir(dir_name):
+                paths.extend([ os.path.join(dir_name, name) for name in os.listdir(dir_name) ])
+
+        return sorted(paths)
+
+    def test_written_files_are_removed_when_insert_fails(self):
+        results = sign_batch(self.make_csrs(3))
+        certificates = [ result.certificate for result in results ]
+
+        files_before = self.list_certificate_files()
+        count_before = self.query_all("SELECT COUNT(*) FROM issued_certificate;")[0][0]
+
+        with unittest.mock.patch.object(dbaccess, "add_certificates_to_db", side_effect = Exception("Insert failed")):
+            with self.assertRaises(Exception):
+                sign_csr.store_batch(certificates, None)
+
+        self.assertEqual(self.list_certificate_files(), files_before)
+        self.assertEqual(self.query_all("SELECT COUNT(*) FROM issued_certificate;")[0][0], count_before)
+
+    def test_files_are_kept_when_insert_succeeds(self):
+        results = sign_batch(self.make_csrs(2))
+        certificates = [ result.certificate for result in results ]
+
+        files_before = self.list_certificate_files()
+        sign_csr.store_batch(certificates, None)
+
+        # A file by serial and a link by name for each certificate.
+        self.assertEqual(len(self.list_certificate_files()), len(files_before) + 4)
+        self.assertEqual(
+            len(self.query_all("SELECT issued_certificate_id FROM issued_certificate WHERE is_self_signed = 0;")),
+            2
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()